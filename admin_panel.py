@@ -1,16 +1,25 @@
 # -*- coding: utf-8 -*-
 import logging
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from config import ADMIN_USER_IDS
-from database import set_user_limit, set_user_subscriber, get_or_create_user, get_all_case_ids
+from config import ADMIN_USER_IDS, TZ, TRACE_SLOW_THRESHOLD
+from broadcast import broadcaster
+from catalog import case_catalog
+from stats_snapshot import stats_snapshot
+from storage import (
+    set_user_limit, set_user_subscriber, get_or_create_user,
+    create_broadcast, get_broadcast, get_latest_broadcast
+)
+from tracing import traced, recent_slow_traces
 
 logger = logging.getLogger(__name__)
 
 def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_USER_IDS
 
+@traced
 async def cmd_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
@@ -18,11 +27,14 @@ async def cmd_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("📊 Estadísticas", callback_data="admin_stats")],
         [InlineKeyboardButton("👥 Gestionar usuarios", callback_data="admin_users")],
-        [InlineKeyboardButton("📚 Info casos", callback_data="admin_cases")]
+        [InlineKeyboardButton("📚 Info casos", callback_data="admin_cases")],
+        [InlineKeyboardButton("📈 Análisis de casos", callback_data="admin_analytics")],
+        [InlineKeyboardButton("🐢 Updates lentas", callback_data="admin_traces")]
     ])
     
     await update.message.reply_text("🔐 Panel de Administración\n\nSelecciona una opción", reply_markup=keyboard)
 
+@traced
 async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -33,19 +45,78 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
     data = query.data
     
     if data == "admin_stats":
-        from database import get_all_users, get_subscribers
-        total_users = len(get_all_users())
-        subs = len(get_subscribers())
-        cases = len(get_all_case_ids())
-        await query.edit_message_text(f"📊 Estadísticas\n\n👥 Usuarios totales: {total_users}\n⭐ Subscriptores: {subs}\n📚 Casos disponibles: {cases}")
+        stats = await stats_snapshot.get()
+        accuracy = f"{stats['correct_today'] * 100 // stats['answers_today']}%" if stats['answers_today'] else "-"
+        text = (
+            f"📊 Estadísticas\n\n"
+            f"👥 Usuarios totales: {stats['users']}\n"
+            f"⭐ Subscriptores: {stats['subscribers']}\n"
+            f"📚 Casos disponibles: {len(case_catalog)}\n\n"
+            f"📅 Hoy: {stats['active_today']} usuarios activos, {stats['answers_today']} respuestas ({accuracy} correctas)\n"
+            f"🗓 Últimos 7 días: {stats['active_week']} usuarios activos, {stats['answers_week']} respuestas"
+        )
+        if stats['cases_by_specialty']:
+            text += "\n\n🩺 Casos por especialidad:\n"
+            text += "\n".join(f"   • {specialty}: {n}" for specialty, n in stats['cases_by_specialty'][:20])
+            if len(stats['cases_by_specialty']) > 20:
+                text += f"\n   … y {len(stats['cases_by_specialty']) - 20} más"
+        text += f"\n\n🕒 Actualizado hace {int(stats_snapshot.age())}s"
+        await query.edit_message_text(text)
     
     elif data == "admin_users":
-        await query.edit_message_text("👥 Gestión de Usuarios\n\nComandos:\n/set_limit USER_ID 10 - Cambiar límite\n/set_sub USER_ID 1 - Activar subscripción")
+        await query.edit_message_text("👥 Gestión de Usuarios\n\nComandos:\n/set_limit USER_ID 10 - Cambiar límite\n/set_sub USER_ID 1 - Activar subscripción\n/broadcast all|subs TEXTO - Difusión\n/broadcast_status - Progreso de la última difusión")
+    
+    elif data == "admin_analytics":
+        from storage import get_case_analytics, get_specialty_analytics
+        hardest = await get_case_analytics("p_value")
+        weakest = await get_case_analytics("discrimination")
+        topics = await get_specialty_analytics()
+        if not topics:
+            await query.edit_message_text("📈 Aún no hay análisis de casos (se calcula periódicamente)")
+            return
+        
+        def fmt(value):
+            return "-" if value is None else f"{value:.2f}"
+        
+        text = "📈 Análisis de casos\n\n🔥 Más difíciles (p):\n"
+        text += "\n".join(f"   • {c['case_id']}: p={fmt(c['p_value'])} ({c['responses']} resp.)" for c in hardest) or "   -"
+        text += "\n\n⚠️ Menor discriminación (revisar):\n"
+        text += "\n".join(
+            f"   • {c['case_id']}: D={fmt(c['discrimination'])}, distractores={fmt(c['distractor_efficiency'])}"
+            for c in weakest
+        ) or "   -"
+        
+        by_specialty = {}
+        for specialty, _, responses, correct in topics:
+            total = by_specialty.setdefault(specialty, [0, 0])
+            total[0] += responses
+            total[1] += correct
+        text += "\n\n🩺 Acierto por especialidad:\n"
+        text += "\n".join(
+            f"   • {specialty}: {correct * 100 // responses}% ({responses} resp.)"
+            for specialty, (responses, correct) in sorted(by_specialty.items(), key=lambda item: -item[1][0])[:15]
+            if responses
+        )
+        await query.edit_message_text(text[:4000])
+    
+    elif data == "admin_traces":
+        traces = recent_slow_traces(5)
+        if not traces:
+            await query.edit_message_text(f"🐢 Sin updates lentas (umbral {TRACE_SLOW_THRESHOLD}s)")
+            return
+        text = f"🐢 Últimas updates lentas (umbral {TRACE_SLOW_THRESHOLD}s)\n"
+        for trace in traces:
+            when = datetime.fromtimestamp(trace.started_at, tz=TZ).strftime("%H:%M:%S")
+            text += f"\n⏱ {when} {trace.summary()}\n"
+            for kind, name, duration in trace.slowest_spans(3):
+                text += f"   • {kind} {name}: {duration:.2f}s\n"
+        await query.edit_message_text(text[:4000])
     
     elif data == "admin_cases":
-        cases = get_all_case_ids()
+        cases = case_catalog.ids()
         await query.edit_message_text(f"📚 Casos en base de datos: {len(cases)}\n\nPrimeros 10:\n" + "\n".join(cases[:10]))
 
+@traced
 async def cmd_set_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
@@ -61,10 +132,11 @@ async def cmd_set_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ USER_ID y límite deben ser números")
         return
     
-    get_or_create_user(user_id, "", "Usuario")
-    set_user_limit(user_id, limit)
+    await get_or_create_user(user_id, "", "Usuario")
+    await set_user_limit(user_id, limit)
     await update.message.reply_text(f"✅ Límite de usuario {user_id} actualizado a {limit}")
 
+@traced
 async def cmd_set_sub(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
@@ -80,7 +152,107 @@ async def cmd_set_sub(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ USER_ID y valor deben ser números")
         return
     
-    get_or_create_user(user_id, "", "Usuario")
-    set_user_subscriber(user_id, is_sub)
+    await get_or_create_user(user_id, "", "Usuario")
+    await set_user_subscriber(user_id, is_sub)
     status = "activada" if is_sub else "desactivada"
     await update.message.reply_text(f"✅ Subscripción de usuario {user_id} {status}")
+
+# ====== Difusiones ======
+
+_AUDIENCES = {"all": "all", "todos": "all", "subs": "subscribers", "subscriptores": "subscribers"}
+
+def _broadcast_content(message) -> tuple:
+    """(file_type, file_id, texto) del mensaje al que se responde"""
+    if message.animation:
+        return "animation", message.animation.file_id, message.caption
+    if message.photo:
+        return "photo", message.photo[-1].file_id, message.caption
+    for file_type in ("document", "video", "audio", "voice"):
+        media = getattr(message, file_type)
+        if media:
+            return file_type, media.file_id, message.caption
+    return "text", None, message.text
+
+@traced
+async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    
+    usage = (
+        "Uso:\n"
+        "/broadcast all|subs TEXTO - Enviar un texto\n"
+        "Responder a un mensaje (texto o archivo) con /broadcast all|subs - Reenviar su contenido"
+    )
+    if not context.args or context.args[0].lower() not in _AUDIENCES:
+        await update.message.reply_text(usage)
+        return
+    
+    audience = _AUDIENCES[context.args[0].lower()]
+    reply = update.message.reply_to_message
+    if reply:
+        file_type, file_id, text = _broadcast_content(reply)
+    else:
+        # Texto tal cual tras la audiencia (conserva saltos de línea)
+        text = update.message.text.split(maxsplit=2)[2] if len(context.args) > 1 else ""
+        file_type, file_id = "text", None
+    if file_type == "text" and not (text or "").strip():
+        await update.message.reply_text(usage)
+        return
+    
+    broadcast_id = await create_broadcast(update.effective_user.id, audience, file_type, file_id, text)
+    broadcast = await get_broadcast(broadcast_id)
+    broadcaster.start(context.bot, broadcast)
+    await update.message.reply_text(
+        f"📣 Difusión #{broadcast_id} iniciada: {broadcast['total']} destinatarios ({audience})\n"
+        f"/broadcast_status {broadcast_id} - Ver progreso\n"
+        f"/broadcast_cancel {broadcast_id} - Cancelar"
+    )
+
+async def _resolve_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args:
+        try:
+            return await get_broadcast(int(context.args[0]))
+        except ValueError:
+            await update.message.reply_text("❌ El ID de difusión debe ser un número")
+            return None
+    return await get_latest_broadcast()
+
+@traced
+async def cmd_broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    
+    broadcast = await _resolve_broadcast(update, context)
+    if not broadcast:
+        await update.message.reply_text("📭 No hay difusiones")
+        return
+    
+    broadcast_id = broadcast["id"]
+    counts = broadcaster.progress(broadcast_id) if broadcaster.is_running(broadcast_id) else None
+    counts = counts or broadcast
+    processed = counts["sent"] + counts["blocked"] + counts["failed"]
+    text = (
+        f"📣 Difusión #{broadcast_id} ({broadcast['audience']}, {broadcast['file_type']})\n"
+        f"Estado: {broadcast['status']}\n\n"
+        f"📊 {processed}/{broadcast['total']}\n"
+        f"✅ Enviados: {counts['sent']}\n🚫 Bloqueados: {counts['blocked']}\n❌ Fallidos: {counts['failed']}"
+    )
+    if broadcaster.is_running(broadcast_id):
+        rate = broadcaster.rate(broadcast_id)
+        text += f"\n\n⚡ {rate:.1f} msg/s"
+        if rate > 0 and broadcast['total'] > processed:
+            text += f", quedan ~{int((broadcast['total'] - processed) / rate / 60) + 1} min"
+    await update.message.reply_text(text)
+
+@traced
+async def cmd_broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    
+    broadcast = await _resolve_broadcast(update, context)
+    if not broadcast or broadcast["status"] != "running":
+        await update.message.reply_text("📭 No hay ninguna difusión en marcha con ese ID")
+        return
+    
+    broadcaster.cancel(broadcast["id"])
+    await update.message.reply_text(f"⏹ Difusión #{broadcast['id']} se detendrá al terminar el bloque en curso")
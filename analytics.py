@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Análisis de ítems sobre user_responses
+Las respuestas se leen por bloques a partir de una marca de agua (último id
+procesado) y se acumulan en arrays de NumPy de sumas por (caso, usuario) y
+por (caso, opción), no una entrada por respuesta; cada recálculo solo lee lo
+nuevo y calcula todas las métricas vectorizadas. Al arrancar se suman también
+los agregados de response_rollups (respuestas antiguas ya podadas por
+maintenance.py), así que el resultado es el mismo:
+
+- p_value: proporción de aciertos del caso (dificultad; bajo = difícil)
+- discrimination: p del 27% de usuarios con mejor acierto global menos p del 27% peor
+- distractor_efficiency: fracción de distractores elegidos por al menos el 5%
+- acierto por especialidad y tema (de parse_case_id)
+
+Los resultados van a case_analytics / specialty_analytics, que lee /admin, y el
+p de cada caso alimenta el sesgo por dificultad de sampler.py.
+
+  python analytics.py      # recálculo completo desde la línea de comandos
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from database import parse_case_id
+from sampler import case_sampler
+import storage
+
+logger = logging.getLogger(__name__)
+
+ANSWERS = "ABCD"
+GROUP_FRACTION = 0.27        # grupos superior/inferior del índice de discriminación
+MIN_USER_RESPONSES = 5       # usuarios con menos respuestas no entran en los grupos
+DISTRACTOR_THRESHOLD = 0.05  # un distractor "funciona" si lo elige al menos el 5%
+CHUNK_SIZE = 50000
+
+class _Index:
+    """Asigna índices densos a claves (case_id, user_id) de forma incremental"""
+    def __init__(self):
+        self.keys: List = []
+        self._pos: Dict = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        uniques, inverse = np.unique(values, return_inverse=True)
+        mapped = np.empty(len(uniques), dtype=np.int32)
+        for i, key in enumerate(uniques.tolist()):
+            pos = self._pos.get(key)
+            if pos is None:
+                pos = self._pos[key] = len(self.keys)
+                self.keys.append(key)
+            mapped[i] = pos
+        return mapped[inverse]
+
+class ItemAnalytics:
+    """Sumas por (caso, usuario) y por (caso, opción): la memoria crece con los pares
+    distintos caso-usuario y con los casos, no con el número de respuestas."""
+    def __init__(self):
+        self.watermark = 0
+        self._cases = _Index()
+        self._users = _Index()
+        # Pares (caso, usuario) como clave case_idx << 32 | user_idx, ordenadas
+        self._pair_keys = np.empty(0, dtype=np.int64)
+        self._pair_responses = np.empty(0, dtype=np.int64)
+        self._pair_hits = np.empty(0, dtype=np.int64)
+        self._answer_counts = np.zeros(0, dtype=np.int64)  # case_idx * 4 + opción (A-D)
+        self._pending: List[tuple] = []  # sumas de cada bloque aún sin fundir
+        self._total = 0
+        self._rollups_loaded = False
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        """Respuestas representadas (crudas + agregadas)"""
+        return self._total
+
+    def _add(self, case_idx: np.ndarray, user_idx: np.ndarray, answers: np.ndarray, hits: np.ndarray, weights: np.ndarray):
+        """Reduce un bloque a sus sumas por par y por (caso, opción); se funden en compute()"""
+        keys = (case_idx.astype(np.int64) << 32) | user_idx.astype(np.int64)
+        pair_keys, inverse = np.unique(keys, return_inverse=True)
+        valid = answers >= 0
+        cells, cell_inverse = np.unique(case_idx[valid].astype(np.int64) * 4 + answers[valid], return_inverse=True)
+        self._pending.append((
+            pair_keys,
+            np.bincount(inverse, weights=weights).astype(np.int64),
+            np.bincount(inverse, weights=hits).astype(np.int64),
+            cells,
+            np.bincount(cell_inverse, weights=weights[valid]).astype(np.int64),
+        ))
+        self._total += int(weights.sum())
+
+    def append(self, rows: List[tuple]):
+        """Añade un bloque (id, user_id, case_id, answer, is_correct) y avanza la marca de agua"""
+        if not rows:
+            return
+        ids, user_ids, case_ids, answers, correct = zip(*rows)
+        answers = np.array(answers, dtype=object)
+        answer_codes = np.full(len(answers), -1, dtype=np.int8)
+        for code, letter in enumerate(ANSWERS):
+            answer_codes[answers == letter] = code
+        self._add(
+            self._cases.encode(np.array(case_ids, dtype=object)),
+            self._users.encode(np.array(user_ids, dtype=np.int64)),
+            answer_codes,
+            (np.array(correct, dtype=object) == 1).astype(np.int64),
+            np.ones(len(answer_codes), dtype=np.int64),
+        )
+        self.watermark = max(self.watermark, max(ids))
+
+    def append_rollups(self, rows: List[tuple]):
+        """Añade agregados (user_id, case_id, día, respuestas, correctas, a, b, c, d).
+        Cada fila se expande en una entrada por opción elegida (más una para "otra cosa");
+        los aciertos van en la primera: todas las métricas solo usan sumas por caso y usuario."""
+        user_ids, case_ids, answers, correct, weights = [], [], [], [], []
+        for user_id, case_id, _, responses, hits, *by_answer in rows:
+            parts = [(code, n) for code, n in enumerate(by_answer) if n]
+            other = responses - sum(by_answer)
+            if other > 0:
+                parts.append((-1, other))
+            for i, (code, n) in enumerate(parts):
+                user_ids.append(user_id)
+                case_ids.append(case_id)
+                answers.append(code)
+                correct.append(hits if i == 0 else 0)
+                weights.append(n)
+        if not weights:
+            return
+        self._add(
+            self._cases.encode(np.array(case_ids, dtype=object)),
+            self._users.encode(np.array(user_ids, dtype=np.int64)),
+            np.array(answers, dtype=np.int8),
+            np.array(correct, dtype=np.int64),
+            np.array(weights, dtype=np.int64),
+        )
+
+    def _consolidate(self):
+        # Una sola fusión por recálculo, no una por bloque
+        n_cells = len(self._cases) * 4
+        if len(self._answer_counts) < n_cells:
+            self._answer_counts = np.concatenate([
+                self._answer_counts, np.zeros(n_cells - len(self._answer_counts), dtype=np.int64)
+            ])
+        if not self._pending:
+            return
+        parts = list(zip(*self._pending))
+        self._pending.clear()
+        keys, inverse = np.unique(np.concatenate([self._pair_keys, *parts[0]]), return_inverse=True)
+        self._pair_responses = np.bincount(
+            inverse, weights=np.concatenate([self._pair_responses, *parts[1]]), minlength=len(keys)
+        ).astype(np.int64)
+        self._pair_hits = np.bincount(
+            inverse, weights=np.concatenate([self._pair_hits, *parts[2]]), minlength=len(keys)
+        ).astype(np.int64)
+        self._pair_keys = keys
+        self._answer_counts += np.bincount(
+            np.concatenate(parts[3]), weights=np.concatenate(parts[4]), minlength=n_cells
+        ).astype(np.int64)
+
+    def compute(self, correct_answers: Dict[str, str]) -> Tuple[List[tuple], List[tuple]]:
+        self._consolidate()
+        n_cases, n_users = len(self._cases), len(self._users)
+        if not n_cases:
+            return [], []
+        # Una entrada por par (caso, usuario) con sus respuestas y aciertos
+        case_idx = (self._pair_keys >> 32).astype(np.int64)
+        user_idx = (self._pair_keys & 0xFFFFFFFF).astype(np.int64)
+        weight, correct = self._pair_responses, self._pair_hits
+
+        responses = np.bincount(case_idx, weights=weight, minlength=n_cases)
+        hits = np.bincount(case_idx, weights=correct, minlength=n_cases)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            p_value = hits / responses
+
+        # Discriminación: grupos por acierto global del usuario
+        user_total = np.bincount(user_idx, weights=weight, minlength=n_users)
+        user_hits = np.bincount(user_idx, weights=correct, minlength=n_users)
+        eligible = np.flatnonzero(user_total >= MIN_USER_RESPONSES)
+        group = np.zeros(n_users, dtype=np.int8)  # 1 = superior, -1 = inferior
+        size = int(len(eligible) * GROUP_FRACTION)
+        if size:
+            order = eligible[np.argsort(user_hits[eligible] / user_total[eligible], kind="stable")]
+            group[order[:size]] = -1
+            group[order[-size:]] = 1
+        response_group = group[user_idx]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            upper = response_group == 1
+            lower = response_group == -1
+            p_upper = np.bincount(case_idx[upper], weights=correct[upper], minlength=n_cases) / \
+                np.bincount(case_idx[upper], weights=weight[upper], minlength=n_cases)
+            p_lower = np.bincount(case_idx[lower], weights=correct[lower], minlength=n_cases) / \
+                np.bincount(case_idx[lower], weights=weight[lower], minlength=n_cases)
+            discrimination = p_upper - p_lower
+
+        # Reparto de opciones y eficiencia de distractores
+        counts = self._answer_counts.reshape(n_cases, 4)
+        key = np.array([ANSWERS.find((correct_answers.get(case_id) or "?")[:1]) for case_id in self._cases.keys])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            share = counts / counts.sum(axis=1, keepdims=True)
+        functional = share >= DISTRACTOR_THRESHOLD
+        has_key = key >= 0
+        functional[np.flatnonzero(has_key), key[has_key]] = False
+        distractor_efficiency = np.where(has_key & (counts.sum(axis=1) > 0), functional.sum(axis=1) / 3, np.nan)
+
+        def clean(value):
+            return None if np.isnan(value) else round(float(value), 4)
+
+        case_rows = [
+            (case_id, int(responses[i]), clean(p_value[i]), clean(discrimination[i]), clean(distractor_efficiency[i]),
+             *(int(c) for c in counts[i]))
+            for i, case_id in enumerate(self._cases.keys)
+        ]
+
+        # Acierto por especialidad y tema
+        groups: Dict[Tuple[str, str], int] = {}
+        topic_of_case = np.empty(n_cases, dtype=np.int32)
+        for i, case_id in enumerate(self._cases.keys):
+            parsed = parse_case_id(case_id)
+            topic_of_case[i] = groups.setdefault((parsed['specialty'] or "-", parsed['topic'] or "-"), len(groups))
+        topic_responses = np.bincount(topic_of_case, weights=responses, minlength=len(groups))
+        topic_hits = np.bincount(topic_of_case, weights=hits, minlength=len(groups))
+        specialty_rows = [
+            (specialty, topic, int(topic_responses[i]), int(topic_hits[i]))
+            for (specialty, topic), i in groups.items()
+        ]
+        return case_rows, specialty_rows
+
+    async def refresh(self, save_watermark: bool = True) -> int:
+        """Lee lo nuevo desde la marca de agua, recalcula y guarda el resumen.
+        save_watermark=False no publica la marca de agua (recálculo desde otro proceso
+        que el bot: maintenance.py debe seguir usando la del bot)."""
+        async with self._lock:
+            started = time.perf_counter()
+            if not self._rollups_loaded:
+                # Antes que las crudas: maintenance.py solo agrega respuestas con id <= watermark
+                after = None
+                while True:
+                    rows = await storage.get_response_rollups_after(after, CHUNK_SIZE)
+                    if not rows:
+                        break
+                    after = rows[-1][:3]
+                    await asyncio.to_thread(self.append_rollups, rows)
+                self._rollups_loaded = True
+            before = len(self)
+            while True:
+                rows = await storage.get_responses_after(self.watermark, CHUNK_SIZE)
+                if not rows:
+                    break
+                await asyncio.to_thread(self.append, rows)
+            new_rows = len(self) - before
+            loaded = time.perf_counter()
+
+            correct_answers = await storage.get_correct_answers()
+            case_rows, specialty_rows = await asyncio.to_thread(self.compute, correct_answers)
+            await storage.save_analytics(case_rows, specialty_rows, self.watermark if save_watermark else None)
+            await asyncio.to_thread(case_sampler.update_difficulty, {row[0]: row[2] for row in case_rows})
+            logger.info(
+                f"📈 Análisis de casos: {new_rows} respuestas nuevas ({len(self)} en total), "
+                f"{len(case_rows)} casos; lectura {loaded - started:.2f}s, "
+                f"cálculo y guardado {time.perf_counter() - loaded:.2f}s"
+            )
+            return new_rows
+
+item_analytics = ItemAnalytics()
+
+async def refresh_analytics_job(context):
+    try:
+        await item_analytics.refresh()
+    except Exception as e:
+        logger.error(f"❌ Error en el análisis de casos: {e}")
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    from database import init_db
+    init_db()
+    asyncio.run(item_analytics.refresh(save_watermark=False))
+    storage.shutdown()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Copia de seguridad en JSONL comprimido
+
+  python backup.py export respaldo/            # una <tabla>.jsonl.gz por tabla + manifest.json
+  python backup.py restore respaldo/           # inserta lo que falte, sin duplicar
+  python backup.py restore respaldo/ --tables users user_responses
+
+Lee y escribe por bloques, así que la memoria no depende del tamaño de las
+tablas. El formato es el mismo con SQLite y con PostgreSQL: se restaura por
+nombre de columna y se ignoran las columnas que no existan en el destino.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from database import (
+    USE_POSTGRES, BACKUP_TABLES, init_db, iter_table_chunks, table_columns, restore_rows, reset_sequences
+)
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+def _table_path(directory: str, table: str) -> str:
+    return os.path.join(directory, f"{table}.jsonl.gz")
+
+def export_tables(directory: str, tables: List[str], chunk_size: int = 5000) -> Dict[str, int]:
+    os.makedirs(directory, exist_ok=True)
+    counts = {table: 0 for table in tables}
+    started = time.perf_counter()
+    current, out = None, None
+    try:
+        for table, _, rows in iter_table_chunks(tables, chunk_size):
+            if table != current:
+                if out:
+                    out.close()
+                current, out = table, gzip.open(_table_path(directory, table), "wt", encoding="utf-8")
+            for row in rows:
+                out.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+                out.write("\n")
+            counts[table] += len(rows)
+    finally:
+        if out:
+            out.close()
+
+    # Tablas vacías también tienen su archivo, para que restore sepa que existían
+    for table in tables:
+        if not counts[table]:
+            gzip.open(_table_path(directory, table), "wt", encoding="utf-8").close()
+        logger.info(f"📤 {table}: {counts[table]} filas")
+
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({
+            "created_at": int(time.time()),
+            "backend": "postgres" if USE_POSTGRES else "sqlite",
+            "tables": counts
+        }, f, indent=2)
+    logger.info(f"✅ Exportación terminada en {time.perf_counter() - started:.1f}s → {directory}")
+    return counts
+
+def _read_chunks(path: str, chunk_size: int):
+    chunk = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                chunk.append(json.loads(line))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+def restore_tables(directory: str, tables: Optional[List[str]] = None, chunk_size: int = 5000) -> Dict[str, int]:
+    with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+    tables = [t for t in BACKUP_TABLES if t in manifest["tables"] and (not tables or t in tables)]
+    started = time.perf_counter()
+    restored = {}
+
+    for table in tables:
+        path = _table_path(directory, table)
+        if not os.path.exists(path):
+            logger.warning(f"⚠️ Falta {path}, se omite {table}")
+            continue
+        target = set(table_columns(table))
+        columns, skipped = None, set()
+        inserted = read = 0
+        for rows in _read_chunks(path, chunk_size):
+            if columns is None:
+                columns = [col for col in rows[0] if col in target]
+                skipped = set(rows[0]) - target
+                if skipped:
+                    logger.warning(f"⚠️ {table}: columnas sin equivalente en destino: {sorted(skipped)}")
+            inserted += restore_rows(table, columns, rows)
+            read += len(rows)
+        restored[table] = inserted
+        logger.info(f"📥 {table}: {inserted} insertadas, {read - inserted} ya existían")
+
+    reset_sequences()
+    logger.info(f"✅ Restauración terminada en {time.perf_counter() - started:.1f}s")
+    return restored
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Exporta o restaura todas las tablas en JSONL comprimido")
+    parser.add_argument("command", choices=["export", "restore"])
+    parser.add_argument("directory")
+    parser.add_argument("--tables", nargs="+", choices=BACKUP_TABLES, help="Solo estas tablas")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "export":
+        export_tables(args.directory, args.tables or BACKUP_TABLES, args.chunk_size)
+    else:
+        restore_tables(args.directory, args.tables, args.chunk_size)
+        logger.info("💡 Si el bot está en marcha, ejecuta /refresh_catalog")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Conjuntos de ordinales como bitmaps comprimidos
+El bit k representa el caso con ordinal k (ver case_ordinals).
+
+Todo lo que recorre o construye un bitmap va por bytes (tabla de bits por
+byte), nunca quitando bits de un int de uno en uno: eso copia el entero en
+cada paso y es cuadrático en el número de casos.
+"""
+import zlib
+from typing import Iterable, Iterator, Union
+
+# Posiciones de los bits a 1 de cada valor de byte
+_BYTE_BITS = tuple(tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256))
+
+def to_bytes(bits: int) -> bytes:
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+def encode(bits: int) -> bytes:
+    return zlib.compress(to_bytes(bits))
+
+def decode_bytes(blob) -> bytes:
+    """Bitmap sin comprimir (little-endian), para consultar bits sin pasar a int"""
+    if not blob:
+        return b""
+    return zlib.decompress(bytes(blob))
+
+def decode(blob) -> int:
+    return int.from_bytes(decode_bytes(blob), "little")
+
+def set_bit(buf: bytearray, ordinal: int):
+    index = ordinal >> 3
+    if index >= len(buf):
+        buf.extend(bytes(index + 1 - len(buf)))
+    buf[index] |= 1 << (ordinal & 7)
+
+def clear_bit(buf: bytearray, ordinal: int):
+    index = ordinal >> 3
+    if index < len(buf):
+        buf[index] &= ~(1 << (ordinal & 7)) & 0xFF
+
+def from_ordinals(ordinals: Iterable[int]) -> int:
+    buf = bytearray()
+    for ordinal in ordinals:
+        set_bit(buf, ordinal)
+    return int.from_bytes(buf, "little")
+
+def contains(bits: int, ordinal: int) -> bool:
+    return (bits >> ordinal) & 1 == 1
+
+def contains_bytes(raw: bytes, ordinal: int) -> bool:
+    """contains() en O(1) sobre el bitmap sin comprimir"""
+    index = ordinal >> 3
+    return index < len(raw) and raw[index] >> (ordinal & 7) & 1 == 1
+
+def add(bits: int, ordinal: int) -> int:
+    return bits | (1 << ordinal)
+
+def ordinals(bits: Union[int, bytes, bytearray]) -> Iterator[int]:
+    raw = to_bytes(bits) if isinstance(bits, int) else bits
+    for index, value in enumerate(raw):
+        if value:
+            base = index << 3
+            for bit in _BYTE_BITS[value]:
+                yield base + bit
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Banco de pruebas de SENT_CASES_STORAGE=bitmap, en memoria y sin BD
+
+  python bitmap_bench.py --cases 100000 --seen 0 0.1 0.5 0.9 0.99 --count 10
+
+Para un catálogo sintético (con un 5% de ordinales borrados) mide el tamaño
+comprimido del bitmap de vistos y la latencia de cada paso que corre en el
+hilo de la BD: construir live_bits, listar los ordinales vistos y sortear
+casos no vistos. Compara con el recorrido bit a bit anterior (cuadrático) y
+sale con código 1 si algún paso supera su presupuesto (--budget-ms).
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+from typing import Callable, List
+
+import bitmap
+from catalog import CaseCatalog
+
+def timed(fn: Callable, repeat: int) -> float:
+    """Milisegundos por llamada"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e3
+
+def legacy_ordinals(bits: int) -> List[int]:
+    found = []
+    while bits:
+        low = bits & -bits
+        found.append(low.bit_length() - 1)
+        bits ^= low
+    return found
+
+def synthetic_catalog(size: int, rng: random.Random) -> CaseCatalog:
+    max_ordinal = int(size / 0.95)
+    ordinals = rng.sample(range(1, max_ordinal + 1), size)
+    catalog = CaseCatalog()
+    catalog.load(((f"###CASE_{ordinal:06d}", ordinal) for ordinal in ordinals), max_ordinal)
+    return catalog
+
+def bench(size: int, seen_fractions: List[float], count: int, repeat: int, budget_ms: float, legacy: bool) -> bool:
+    rng = random.Random(7)
+    catalog = synthetic_catalog(size, rng)
+    live = sorted(catalog.ordinal(case_id) for case_id in catalog.ids())
+    ok = True
+
+    def check(label: str, ms: float) -> str:
+        nonlocal ok
+        within = ms <= budget_ms
+        ok = ok and within
+        return f"{label} {ms:8.2f} ms {'✅' if within else '❌'}"
+
+    def rebuild():
+        catalog._live_bits = None
+        catalog.live_bits()
+
+    print(f"📚 {size} casos vivos, max_ordinal {catalog.max_ordinal()}, presupuesto {budget_ms:.0f} ms por paso")
+    print("  " + check("live_bits (bytearray → int):", timed(rebuild, repeat)))
+    if legacy:
+        print(f"  live_bits anterior (suma de 1 << k): {timed(lambda: sum(1 << o for o in live), 1):8.2f} ms")
+
+    added = iter(range(catalog.max_ordinal() + 1, catalog.max_ordinal() + 1 + repeat))
+    add = timed(lambda: catalog.add(f"###CASE_NEW_{rng.random()}", next(added)), repeat)
+    print(f"  save_case / delete_case sobre el catálogo: {add * 1e3:.1f} µs")
+
+    print(f"  {'vistos':>7} {'comprimido':>11} {'listar vistos':>22} {'sortear no vistos':>26}")
+    for fraction in seen_fractions:
+        seen_ordinals = rng.sample(live, int(len(live) * fraction))
+        seen_bits = bitmap.from_ordinals(seen_ordinals)
+        blob = bitmap.encode(seen_bits)
+        seen_raw = bitmap.decode_bytes(blob)
+        assert sorted(bitmap.ordinals(seen_raw)) == sorted(seen_ordinals)
+
+        listing = timed(lambda: sum(1 for _ in bitmap.ordinals(bitmap.decode_bytes(blob))), repeat)
+        sampling = timed(lambda: catalog.sample_unseen(bitmap.decode_bytes(blob), count, rng), repeat)
+        chosen, available = catalog.sample_unseen(seen_raw, count, rng)
+        assert available == len(catalog) - len(seen_ordinals)
+        assert len(chosen) == min(count, available) and len(set(chosen)) == len(chosen)
+        assert not any(bitmap.contains_bytes(seen_raw, ordinal) or not catalog.by_ordinal(ordinal) for ordinal in chosen)
+
+        print(f"  {fraction:>7.0%} {len(blob) / 1024:>8.1f} KiB {check('', listing):>22} {check('', sampling):>26}")
+        if legacy and seen_ordinals:
+            print(f"  {'':>7} listar vistos bit a bit (anterior): {timed(lambda: legacy_ordinals(seen_bits), 1):.0f} ms")
+    return ok
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Tamaño y latencia del almacenamiento en bitmap")
+    parser.add_argument("--cases", type=int, default=100000)
+    parser.add_argument("--seen", type=float, nargs="+", default=[0, 0.1, 0.5, 0.9, 0.99], help="Fracción de casos vistos")
+    parser.add_argument("--count", type=int, default=10, help="Casos por petición (/random_cases)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=25.0)
+    parser.add_argument("--legacy", action="store_true", help="Medir también el recorrido anterior (lento)")
+    args = parser.parse_args()
+    if not bench(args.cases, args.seen, args.count, args.repeat, args.budget_ms, args.legacy):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Difusiones masivas a usuarios o subscriptores
+Los destinatarios se leen por bloques de BROADCAST_PAGE_SIZE recorriendo
+users por user_id (nunca se cargan todos) y cada bloque se envía con hasta
+BROADCAST_CONCURRENCY envíos a la vez; el ritmo global lo pone outbound.py
+con prioridad PRIORITY_BULK, así que las respuestas del quiz pasan antes.
+
+Reanudación sin duplicados: antes de enviar un bloque se guarda su último
+user_id (claimed_user_id) y al terminarlo los contadores (done_user_id).
+Si el proceso muere a mitad de bloque, al arrancar se sigue después de
+claimed_user_id: los usuarios de ese bloque que no llegaron a recibirlo se
+omiten (como mucho un bloque), nunca se les envía dos veces.
+
+Los usuarios que bloquearon el bot van a blocked_users y no se vuelven a
+intentar hasta que escriban de nuevo (/start).
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from config import BROADCAST_CONCURRENCY, BROADCAST_PAGE_SIZE
+from outbound import PRIORITY_BULK
+from storage import (
+    get_running_broadcasts, get_broadcast_recipients, claim_broadcast_page,
+    finish_broadcast_page, set_broadcast_status
+)
+
+logger = logging.getLogger(__name__)
+
+_MIN_USER_ID = -(1 << 63)
+
+_SEND_METHODS = {
+    "photo": "send_photo",
+    "document": "send_document",
+    "video": "send_video",
+    "audio": "send_audio",
+    "voice": "send_voice",
+    "animation": "send_animation",
+}
+
+SENT, FAILED, BLOCKED = "sent", "failed", "blocked"
+
+class Broadcaster:
+    def __init__(self, concurrency: int, page_size: int):
+        self._concurrency = concurrency
+        self._page_size = page_size
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled = set()
+        self._progress: Dict[int, dict] = {}
+
+    def is_running(self, broadcast_id: int) -> bool:
+        task = self._tasks.get(broadcast_id)
+        return task is not None and not task.done()
+
+    def progress(self, broadcast_id: int) -> Optional[dict]:
+        """Contadores en memoria del envío en curso (la BD se actualiza por bloque)"""
+        return self._progress.get(broadcast_id)
+
+    def start(self, bot: Bot, broadcast: dict) -> asyncio.Task:
+        broadcast_id = broadcast["id"]
+        if self.is_running(broadcast_id):
+            return self._tasks[broadcast_id]
+        task = asyncio.create_task(self._run(bot, broadcast), name=f"broadcast-{broadcast_id}")
+        self._tasks[broadcast_id] = task
+        return task
+
+    def cancel(self, broadcast_id: int):
+        """Termina el bloque en curso y se detiene"""
+        self._cancelled.add(broadcast_id)
+
+    async def stop(self):
+        """Apagado: corta los envíos sin marcarlos; al arrancar se reanudan"""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    async def _send_one(self, bot: Bot, broadcast: dict, user_id: int) -> str:
+        try:
+            if broadcast["file_type"] == "text":
+                await bot.send_message(user_id, broadcast["text"], rate_limit_args=PRIORITY_BULK)
+            else:
+                send = getattr(bot, _SEND_METHODS[broadcast["file_type"]])
+                await send(user_id, broadcast["file_id"], caption=broadcast["text"] or None, rate_limit_args=PRIORITY_BULK)
+            return SENT
+        except Forbidden:
+            # Bloqueó el bot o borró la cuenta
+            return BLOCKED
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                return BLOCKED
+            logger.warning(f"⚠️ Difusión #{broadcast['id']} a {user_id}: {e}")
+            return FAILED
+        except TelegramError as e:
+            logger.warning(f"⚠️ Difusión #{broadcast['id']} a {user_id}: {e}")
+            return FAILED
+
+    async def _send_page(self, bot: Bot, broadcast: dict, user_ids: List[int]) -> Dict[int, str]:
+        semaphore = asyncio.Semaphore(self._concurrency)
+        progress = self._progress[broadcast["id"]]
+
+        async def send(user_id: int) -> str:
+            async with semaphore:
+                result = await self._send_one(bot, broadcast, user_id)
+            progress[result] += 1
+            return result
+
+        results = await asyncio.gather(*(send(user_id) for user_id in user_ids))
+        return dict(zip(user_ids, results))
+
+    async def _run(self, bot: Bot, broadcast: dict):
+        broadcast_id = broadcast["id"]
+        claimed, done = broadcast.get("claimed_user_id"), broadcast.get("done_user_id")
+        if claimed is not None and claimed != done:
+            logger.warning(
+                f"⚠️ Difusión #{broadcast_id}: se corta un bloque a medias; "
+                f"se omiten los usuarios {done} < user_id ≤ {claimed} para no repetir envíos"
+            )
+        after = claimed if claimed is not None else _MIN_USER_ID
+        self._progress[broadcast_id] = {
+            SENT: broadcast.get("sent", 0), FAILED: broadcast.get("failed", 0), BLOCKED: broadcast.get("blocked", 0),
+            "total": broadcast.get("total", 0), "started_at": time.monotonic(), "started_done": 0
+        }
+        progress = self._progress[broadcast_id]
+        progress["started_done"] = progress[SENT] + progress[FAILED] + progress[BLOCKED]
+        logger.info(f"📣 Difusión #{broadcast_id} ({broadcast['audience']}) desde user_id > {after}")
+
+        try:
+            status = "running"
+            while status == "running":
+                if broadcast_id in self._cancelled:
+                    status = "cancelled"
+                    break
+                user_ids = await get_broadcast_recipients(broadcast["audience"], after, self._page_size)
+                if not user_ids:
+                    status = "done"
+                    break
+                after = user_ids[-1]
+                await claim_broadcast_page(broadcast_id, after)
+                results = await self._send_page(bot, broadcast, user_ids)
+                blocked_ids = [user_id for user_id, result in results.items() if result == BLOCKED]
+                sent = sum(1 for result in results.values() if result == SENT)
+                failed = len(results) - sent - len(blocked_ids)
+                # Otra instancia (o /broadcast_cancel antes de un reinicio) puede haberla cancelado
+                status = await finish_broadcast_page(broadcast_id, after, sent, failed, blocked_ids)
+            await set_broadcast_status(broadcast_id, status)
+            elapsed = time.monotonic() - progress["started_at"]
+            logger.info(
+                f"📣 Difusión #{broadcast_id} {status}: {progress[SENT]} enviados, "
+                f"{progress[BLOCKED]} bloqueados, {progress[FAILED]} fallidos en {elapsed:.0f}s"
+            )
+            if broadcast.get("created_by"):
+                try:
+                    await bot.send_message(
+                        broadcast["created_by"],
+                        f"📣 Difusión #{broadcast_id} {'terminada' if status == 'done' else 'cancelada'}\n\n"
+                        f"✅ Enviados: {progress[SENT]}\n🚫 Bloqueados: {progress[BLOCKED]}\n"
+                        f"❌ Fallidos: {progress[FAILED]}\n⏱ {elapsed:.0f}s"
+                    )
+                except TelegramError as e:
+                    logger.warning(f"⚠️ No se pudo avisar del fin de la difusión #{broadcast_id}: {e}")
+        except asyncio.CancelledError:
+            logger.info(f"⏸ Difusión #{broadcast_id} interrumpida; se reanudará al arrancar")
+            raise
+        except Exception as e:
+            logger.exception(f"❌ Error en la difusión #{broadcast_id}: {e}")
+        finally:
+            self._cancelled.discard(broadcast_id)
+            self._tasks.pop(broadcast_id, None)
+
+    def rate(self, broadcast_id: int) -> float:
+        progress = self._progress.get(broadcast_id)
+        if not progress:
+            return 0.0
+        done = progress[SENT] + progress[FAILED] + progress[BLOCKED] - progress["started_done"]
+        return done / max(time.monotonic() - progress["started_at"], 1e-6)
+
+broadcaster = Broadcaster(BROADCAST_CONCURRENCY, BROADCAST_PAGE_SIZE)
+
+async def resume_broadcasts_job(context):
+    """Al arrancar: sigue con las difusiones que quedaron en marcha"""
+    try:
+        for broadcast in await get_running_broadcasts():
+            broadcaster.start(context.bot, broadcast)
+    except Exception as e:
+        logger.error(f"❌ Error reanudando difusiones: {e}")
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Banco de pruebas de las difusiones contra la Bot API simulada (webhook_bench.OfflineRequest)
+
+  OUTBOUND_GLOBAL_RATE=1000 python broadcast_bench.py --users 20000 --blocked-every 50 --interrupt-after 5
+
+Crea usuarios sintéticos en la BD configurada, lanza una difusión a todos y,
+con --interrupt-after, la corta a mitad (como un reinicio) y la reanuda desde
+la BD. Al final comprueba que ningún chat recibió el mensaje dos veces y que
+los chats bloqueados quedaron en blocked_users; una segunda difusión ya no
+los intenta. Con el ritmo real de Telegram (30 msg/s) usar pocos usuarios.
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from database import init_db, restore_rows
+from broadcast import broadcaster
+from storage import create_broadcast, get_broadcast, shutdown as shutdown_storage
+from webhook_bench import OfflineRequest
+
+logger = logging.getLogger(__name__)
+
+FIRST_USER_ID = 10_000_000
+
+def seed_users(total: int, chunk_size: int = 5000) -> int:
+    inserted = 0
+    for start in range(0, total, chunk_size):
+        rows = [
+            {"user_id": FIRST_USER_ID + i, "username": f"bench{i}", "first_name": "Bench", "is_subscriber": i % 2}
+            for i in range(start, min(total, start + chunk_size))
+        ]
+        inserted += restore_rows("users", list(rows[0]), rows)
+    return inserted
+
+async def run_broadcast(app, request: OfflineRequest, interrupt_after: float) -> dict:
+    broadcast_id = await create_broadcast(0, "all", "text", None, "📣 Difusión de prueba")
+    started = time.perf_counter()
+    task = broadcaster.start(app.bot, await get_broadcast(broadcast_id))
+    if interrupt_after:
+        await asyncio.sleep(interrupt_after)
+        await broadcaster.stop()
+        state = await get_broadcast(broadcast_id)
+        print(f"⏸ Cortada tras {interrupt_after:.0f}s: {state['sent'] + state['blocked'] + state['failed']} procesados "
+              f"en BD, {sum(request.sent_to.values())} mensajes entregados")
+        task = broadcaster.start(app.bot, state)
+    await task
+    elapsed = time.perf_counter() - started
+    state = await get_broadcast(broadcast_id)
+    processed = state["sent"] + state["blocked"] + state["failed"]
+    print(f"📣 Difusión #{broadcast_id} {state['status']}: {state['total']} destinatarios, {state['sent']} enviados, "
+          f"{state['blocked']} bloqueados, {state['failed']} fallidos en {elapsed:.1f}s "
+          f"({processed / elapsed:.0f} msg/s)")
+    return state
+
+async def bench(users: int, blocked_every: int, interrupt_after: float, latency: float):
+    import main as bot_main
+    request = OfflineRequest(latency, blocked_every)
+    app = bot_main.build_application(request=request)
+    await app.initialize()
+    try:
+        first = await run_broadcast(app, request, interrupt_after)
+        duplicates = sum(1 for n in request.sent_to.values() if n > 1)
+        skipped = first["total"] - first["sent"] - first["blocked"] - first["failed"]
+        print(f"🔁 Chats con mensaje duplicado: {duplicates} · omitidos por el corte: {skipped}")
+
+        request.sent_to.clear()
+        second = await run_broadcast(app, request, 0)
+        print(f"🚫 Segunda difusión: {second['total']} destinatarios ({first['blocked']} bloqueados excluidos), "
+              f"{second['blocked']} bloqueados nuevos")
+    finally:
+        await app.shutdown()
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Difusión contra la Bot API simulada")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--blocked-every", type=int, default=50, help="Uno de cada N chats tiene el bot bloqueado")
+    parser.add_argument("--interrupt-after", type=float, default=0, help="Cortar y reanudar tras N segundos")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia simulada por llamada (s)")
+    args = parser.parse_args()
+
+    init_db()
+    print(f"👥 {seed_users(args.users)} usuarios sintéticos nuevos")
+    asyncio.run(bench(args.users, args.blocked_every, args.interrupt_after, args.latency))
+    shutdown_storage()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Índice invertido del catálogo: especialidad / tema / subtema → ordinales
+Se suscribe a case_catalog, así que sigue cada save_case/delete_case sin
+recargar. Con él /random_cases PED o /random_cases INFECTO DENGUE sortea
+solo entre los casos del filtro, sin recorrer el catálogo entero.
+"""
+import logging
+import random
+import threading
+from typing import Collection, Dict, List, Optional, Set, Tuple
+
+from catalog import case_catalog, sample_rejecting
+from database import parse_case_id
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[str, ...]
+
+def _keys(case_id: str) -> List[Key]:
+    parsed = parse_case_id(case_id)
+    specialty = parsed['specialty'].upper()
+    topic = parsed['topic'].upper()
+    subtopic = parsed['subtopic'].upper()
+    keys = []
+    if specialty:
+        keys.append(("specialty", specialty))
+    if topic:
+        keys.append(("topic", topic))
+        if specialty:
+            keys.append(("specialty", specialty, "topic", topic))
+    if subtopic and specialty:
+        keys.append(("specialty", specialty, "subtopic", subtopic))
+    return keys
+
+class CaseIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[Key, Set[int]] = {}
+        self._snapshots: Dict[Key, Tuple[int, ...]] = {}
+
+    # ====== Mantenimiento (lo llama el catálogo) ======
+
+    def on_load(self, rows: Collection[Tuple[str, int]]):
+        postings: Dict[Key, Set[int]] = {}
+        for case_id, ordinal in rows:
+            for key in _keys(case_id):
+                postings.setdefault(key, set()).add(ordinal)
+        with self._lock:
+            self._postings = postings
+            self._snapshots = {}
+        logger.info(f"🗂 Índice por especialidad/tema: {len(postings)} entradas")
+
+    def on_add(self, case_id: str, ordinal: int):
+        with self._lock:
+            for key in _keys(case_id):
+                self._postings.setdefault(key, set()).add(ordinal)
+                self._snapshots.pop(key, None)
+
+    def on_discard(self, case_id: str, ordinal: int):
+        with self._lock:
+            for key in _keys(case_id):
+                posting = self._postings.get(key)
+                if posting is None:
+                    continue
+                posting.discard(ordinal)
+                if not posting:
+                    del self._postings[key]
+                self._snapshots.pop(key, None)
+
+    # ====== Consultas ======
+
+    def resolve(self, terms: List[str]) -> Optional[Key]:
+        """Traduce los argumentos del comando a una clave del índice.
+        1 término: especialidad, o tema si no hay especialidad con ese nombre.
+        2 términos: especialidad + tema, o especialidad + subtema."""
+        terms = [term.upper() for term in terms if term]
+        if len(terms) == 1:
+            candidates = [("specialty", terms[0]), ("topic", terms[0])]
+        elif len(terms) == 2:
+            candidates = [("specialty", terms[0], "topic", terms[1]), ("specialty", terms[0], "subtopic", terms[1])]
+        else:
+            return None
+        return next((key for key in candidates if key in self._postings), None)
+
+    def ordinals(self, key: Key) -> Tuple[int, ...]:
+        """Ordinales del filtro, en una tupla compartida que se recalcula solo tras un cambio"""
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshots[key] = tuple(self._postings.get(key, ()))
+        return snapshot
+
+    def count_unseen(self, key: Key, seen_ordinals: Collection[int]) -> int:
+        posting = self._postings.get(key, set())
+        return len(posting) - sum(1 for ordinal in seen_ordinals if ordinal in posting)
+
+    def specialties(self) -> List[str]:
+        return sorted(key[1] for key in self._postings if len(key) == 2 and key[0] == "specialty")
+
+    def sample(self, key: Key, count: int, exclude: Collection[int] = (), rng=random) -> List[str]:
+        """Hasta `count` casos del filtro cuyo ordinal no esté en `exclude`.
+        Sorteo por rechazo, O(count) si quedan bastantes sin ver; si no, diferencia exacta."""
+        ordinals = self.ordinals(key)
+        if not ordinals:
+            return []
+        chosen = sample_rejecting(
+            count,
+            draw=lambda: ordinals[rng.randrange(len(ordinals))],
+            accept=lambda ordinal: ordinal not in exclude,
+            remaining=lambda: (ordinal for ordinal in ordinals if ordinal not in exclude),
+            rng=rng
+        )
+        return [case_id for case_id in map(case_catalog.by_ordinal, chosen) if case_id]
+
+case_index = CaseIndex()
+case_catalog.subscribe(case_index)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Contadores de respuestas por caso en memoria
+get_case_stats se sirve desde memoria y los incrementos se escriben en lote
+cada CASE_STATS_FLUSH_INTERVAL segundos y al apagar el bot.
+
+Pérdida acotada: si el proceso cae sin apagado limpio se pierden, como mucho,
+los incrementos del último intervalo en case_stats. user_responses se escribe
+en cada respuesta, así que case_stats siempre puede reconstruirse con un
+GROUP BY case_id, answer sobre esa tabla, sumando response_rollups si la
+retención (maintenance.py) ya agregó y borró las respuestas antiguas.
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict
+
+from config import CASE_STATS_FLUSH_INTERVAL
+import storage
+
+logger = logging.getLogger(__name__)
+
+class CaseStatsCache:
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._pending: Counter = Counter()  # (case_id, answer) -> incremento sin escribir
+        # Lecturas de la BD y volcados no se solapan: si no, un volcado que se confirma
+        # durante la lectura se contaría dos veces (en la fila leída y en memoria)
+        self._db_lock = asyncio.Lock()
+
+    def increment(self, case_id: str, answer: str):
+        self._pending[(case_id, answer)] += 1
+        stats = self._stats.get(case_id)
+        if stats is not None:
+            stats[answer] = stats.get(answer, 0) + 1
+
+    async def get(self, case_id: str) -> dict:
+        stats = self._stats.get(case_id)
+        if stats is None:
+            async with self._db_lock:
+                # Otra corrutina pudo cargarlo mientras esperábamos el lock
+                stats = self._stats.get(case_id)
+                if stats is None:
+                    stats = await storage.get_case_stats(case_id)
+                    # Sin volcado en curso, lo leído incluye todo lo volcado y nada de lo pendiente
+                    for answer in list(stats):
+                        stats[answer] += self._pending[(case_id, answer)]
+                    self._stats[case_id] = stats
+        return dict(stats)
+
+    async def flush(self):
+        async with self._db_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, Counter()
+            try:
+                await storage.add_case_stats([(case_id, answer, delta) for (case_id, answer), delta in batch.items()])
+            except Exception:
+                self._pending.update(batch)
+                raise
+        logger.info(f"📊 Estadísticas volcadas: {sum(batch.values())} respuestas en {len(batch)} contadores")
+
+case_stats_cache = CaseStatsCache()
+
+async def record_answer(user_id: int, case_id: str, answer: str, is_correct: int) -> dict:
+    """Como storage.record_answer, pero contando en memoria si la caché está activa"""
+    if CASE_STATS_FLUSH_INTERVAL <= 0:
+        return await storage.record_answer(user_id, case_id, answer, is_correct)
+    await storage.record_answer(user_id, case_id, answer, is_correct, update_case_stats=False)
+    case_stats_cache.increment(case_id, answer)
+    return await case_stats_cache.get(case_id)
+
+async def flush_case_stats_job(context):
+    try:
+        await case_stats_cache.flush()
+    except Exception as e:
+        logger.error(f"❌ Error volcando estadísticas: {e}")
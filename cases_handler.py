@@ -3,26 +3,34 @@ import logging
 import random
 import re
 import asyncio
-from typing import Set
+from typing import List, Optional, Set, Tuple
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
-from telegram.error import TelegramError, RetryAfter
+from telegram.error import TelegramError
 
-from database import (
-    get_all_case_ids, get_user_sent_cases, get_case_by_id,
-    get_daily_progress, increment_daily_progress, get_or_create_user,
-    save_user_sent_case, count_cases, delete_case,
-    save_user_response, increment_case_stat, update_user_stats, get_case_stats
+from case_stats_cache import record_answer
+from case_index import Key, case_index
+from catalog import case_catalog
+from config import CASE_SELECTION_MODE
+from deck import draw_from_deck
+from sampler import case_sampler
+from justifications_cache import justification_cache
+from sessions import session_store
+from storage import (
+    get_user_sent_cases, get_case_by_id, get_cases_by_ids,
+    get_daily_progress, get_or_create_user,
+    save_user_sent_case, reset_user_sent_cases, sample_unseen_case_ids, delete_case
 )
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
-user_sessions = {}
 deleted_cases_cache: Set[str] = set()
 
 MAX_RETRIES = 3
 RETRY_DELAY = 2
 
+@traced
 async def cmd_random_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """VERSIÓN CON DEBUG EXTREMO"""
     try:
@@ -35,10 +43,10 @@ async def cmd_random_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         logger.info(f"👤 Usuario: {user_id} (@{username})")
         
-        user = get_or_create_user(user_id, username, first_name)
+        user = await get_or_create_user(user_id, username, first_name)
         logger.info(f"✅ Usuario creado/recuperado: {user}")
         
-        today_solved = get_daily_progress(user_id)
+        today_solved = await get_daily_progress(user_id)
         limit = user["daily_limit"]
         
         logger.info(f"📊 Progreso hoy: {today_solved}/{limit}")
@@ -52,17 +60,17 @@ async def cmd_random_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # VERIFICACIÓN EXHAUSTIVA DE CASOS
-        total_in_db = count_cases()
+        total_in_db = len(case_catalog)
         logger.info(f"📚 Total casos en BD: {total_in_db}")
         await update.message.reply_text(f"📚 Total casos en BD: {total_in_db}")
         
-        all_cases = set(get_all_case_ids())
+        all_cases = case_catalog.id_set()
         logger.info(f"📋 Casos recuperados: {len(all_cases)}")
         await update.message.reply_text(f"📋 Casos recuperados: {len(all_cases)}")
         
         if all_cases:
-            logger.info(f"🔍 Primeros 5 casos: {list(all_cases)[:5]}")
-            await update.message.reply_text(f"🔍 Muestra: {list(all_cases)[:5]}")
+            logger.info(f"🔍 Primeros 5 casos: {list(case_catalog.ids()[:5])}")
+            await update.message.reply_text(f"🔍 Muestra: {list(case_catalog.ids()[:5])}")
         
         if not all_cases:
             await update.message.reply_text(
@@ -73,28 +81,40 @@ async def cmd_random_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        sent_cases = get_user_sent_cases(user_id)
-        logger.info(f"📤 Casos ya enviados al usuario: {len(sent_cases)}")
+        # /random_cases <especialidad> [tema]
+        key = None
+        if context.args:
+            key = case_index.resolve(context.args)
+            if key is None:
+                await update.message.reply_text(
+                    f"❌ No hay casos para: {' '.join(context.args)}\n\n"
+                    f"📚 Especialidades: {', '.join(case_index.specialties()) or '-'}\n"
+                    f"Uso: /random_cases <especialidad> [tema]",
+                    reply_markup=ReplyKeyboardRemove()
+                )
+                return
         
-        available = all_cases - sent_cases
-        logger.info(f"✅ Casos disponibles: {len(available)}")
-        await update.message.reply_text(f"✅ Casos disponibles para ti: {len(available)}")
+        remaining = limit - today_solved
+        selected, available_count, was_reset = await select_cases(user_id, remaining, key)
+        logger.info(f"✅ Casos disponibles: {available_count}")
+        await update.message.reply_text(f"✅ Casos disponibles para ti: {available_count}")
         
-        # Si completó todos, resetear
-        if not available:
-            from database import _get_conn, USE_POSTGRES
-            conn = _get_conn()
-            if USE_POSTGRES:
-                with conn.cursor() as cur:
-                    cur.execute("DELETE FROM user_sent_cases WHERE user_id=%s", (user_id,))
-            else:
-                conn.execute("DELETE FROM user_sent_cases WHERE user_id=?", (user_id,))
-                conn.commit()
-            
+        if was_reset and key:
+            await update.message.reply_text(
+                f"🎉 ¡Completaste todos los casos de {' '.join(context.args).upper()}! 🔄 Se repiten casos ya vistos..."
+            )
+        elif was_reset:
             await update.message.reply_text("🎉 ¡Completaste todos los casos! 🔄 Reiniciando catálogo...")
-            available = all_cases
         
-        if not available:
+        # Una sola consulta para todos los casos de la sesión
+        rows = await get_cases_by_ids(selected)
+        missing = [case_id for case_id in selected if case_id not in rows]
+        for case_id in missing:
+            logger.warning(f"⚠️ Caso {case_id} no existe en DB")
+            case_catalog.discard(case_id)
+        selected = [case_id for case_id in selected if case_id in rows]
+        
+        if not selected:
             await update.message.reply_text(
                 "❌ No hay casos disponibles después del reset.\n\n"
                 "Contacta al administrador.",
@@ -102,18 +122,16 @@ async def cmd_random_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        remaining = limit - today_solved
-        cases_to_send = min(remaining, len(available))
-        selected = random.sample(list(available), cases_to_send)
-        
         logger.info(f"🎯 Casos seleccionados: {selected}")
         await update.message.reply_text(f"🎯 Enviando {len(selected)} casos...")
         
-        user_sessions[user_id] = {
+        session_store.put(user_id, {
             "cases": selected,
             "current_index": 0,
-            "correct_count": 0
-        }
+            "correct_count": 0,
+            "rows": rows,
+            "filtered": key is not None
+        })
         
         await send_case(update, context, user_id)
         
@@ -121,8 +139,63 @@ async def cmd_random_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.exception(f"💥 ERROR CRÍTICO en cmd_random_cases: {e}")
         await update.message.reply_text(f"💥 ERROR: {str(e)}")
 
+async def select_cases(user_id: int, count: int, key: Optional[Key] = None) -> Tuple[List[str], int, bool]:
+    """Elige hasta `count` casos no vistos, opcionalmente solo de un filtro del índice (case_index).
+    Devuelve (seleccionados, disponibles antes de elegir, si hubo reset del historial)."""
+    if key is not None:
+        return await select_filtered_cases(user_id, count, key)
+    
+    if CASE_SELECTION_MODE == "deck":
+        return await draw_from_deck(user_id, count)
+    
+    if CASE_SELECTION_MODE == "sql":
+        # Anti-join y sorteo en la BD: solo viajan los IDs elegidos
+        selected, available = await sample_unseen_case_ids(user_id, count)
+        if available:
+            return selected, available, False
+        await reset_user_sent_cases(user_id)
+        selected, _ = await sample_unseen_case_ids(user_id, count)
+        return selected, 0, True
+    
+    if CASE_SELECTION_MODE == "weighted":
+        # Sorteo en O(count·log n); solo se recorre lo ya visto, no el catálogo
+        sent_cases = await get_user_sent_cases(user_id)
+        available_count = len(case_catalog) - sum(1 for case_id in sent_cases if case_id in case_catalog)
+        if available_count > 0:
+            return case_sampler.sample(count, exclude=sent_cases), available_count, False
+        await reset_user_sent_cases(user_id)
+        return case_sampler.sample(count), 0, True
+    
+    all_cases = case_catalog.id_set()
+    sent_cases = await get_user_sent_cases(user_id)
+    logger.info(f"📤 Casos ya enviados al usuario: {len(sent_cases)}")
+    
+    available = all_cases - sent_cases
+    available_count = len(available)
+    was_reset = False
+    
+    # Si completó todos, resetear
+    if not available:
+        await reset_user_sent_cases(user_id)
+        available = all_cases
+        was_reset = True
+    
+    selected = random.sample(list(available), min(count, len(available)))
+    return selected, available_count, was_reset
+
+async def select_filtered_cases(user_id: int, count: int, key: Key) -> Tuple[List[str], int, bool]:
+    """Igual que select_cases pero dentro de un filtro, en cualquier CASE_SELECTION_MODE.
+    Solo se recorre lo ya visto (para pasarlo a ordinales), no el catálogo ni el filtro.
+    Si el filtro está completo se repiten sus casos sin borrar el resto del historial."""
+    sent_cases = await get_user_sent_cases(user_id)
+    seen = {ordinal for ordinal in map(case_catalog.ordinal, sent_cases) if ordinal is not None}
+    available_count = case_index.count_unseen(key, seen)
+    if available_count > 0:
+        return case_index.sample(key, count, exclude=seen), available_count, False
+    return case_index.sample(key, count), 0, True
+
 async def send_case(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    session = user_sessions.get(user_id)
+    session = await session_store.get(user_id)
     if not session:
         await context.bot.send_message(user_id, "❌ Sesión no encontrada")
         return
@@ -137,12 +210,16 @@ async def send_case(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id:
     case_id = cases[idx]
     logger.info(f"📤 Intentando enviar caso: {case_id}")
     
-    case_data = get_case_by_id(case_id)
+    case_data = session.get("rows", {}).get(case_id)
+    if case_data is None:
+        case_data = await get_case_by_id(case_id)
     
     if not case_data:
         logger.warning(f"⚠️ Caso {case_id} no existe en DB")
+        case_catalog.discard(case_id)
         await context.bot.send_message(user_id, f"⚠️ Caso {case_id} no existe")
         session["current_index"] += 1
+        session_store.mark_dirty(user_id)
         await send_case(update, context, user_id)
         return
     
@@ -151,6 +228,7 @@ async def send_case(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id:
     
     session["current_case"] = case_id
     session["correct_answer"] = correct_answer
+    session_store.mark_dirty(user_id)
     
     tries = 0
     while tries < MAX_RETRIES:
@@ -173,15 +251,10 @@ async def send_case(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id:
                 await context.bot.send_message(chat_id=user_id, text=caption)
             
             logger.info(f"✅ Caso {case_id} enviado exitosamente")
-            save_user_sent_case(user_id, case_id)
+            # También en modo mazo: los filtros excluyen lo visto con este historial
+            await save_user_sent_case(user_id, case_id)
             break
             
-        except RetryAfter as e:
-            wait = e.retry_after
-            logger.warning(f"⚠️ Rate limit: esperar {wait}s")
-            await asyncio.sleep(wait + 1)
-            continue
-            
         except TelegramError as e:
             error = str(e).lower()
             logger.error(f"❌ Error Telegram: {error}")
@@ -190,9 +263,10 @@ async def send_case(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id:
                 if case_id not in deleted_cases_cache:
                     logger.warning(f"⚠️ file_id inválido: {case_id}")
                     deleted_cases_cache.add(case_id)
-                    delete_case(case_id)
+                    await delete_case(case_id)
                 
                 session["current_index"] += 1
+                session_store.mark_dirty(user_id)
                 await send_case(update, context, user_id)
                 return
             
@@ -203,6 +277,7 @@ async def send_case(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id:
             else:
                 logger.error(f"❌ Saltando caso {case_id}")
                 session["current_index"] += 1
+                session_store.mark_dirty(user_id)
                 await send_case(update, context, user_id)
                 return
     
@@ -218,6 +293,7 @@ async def send_case(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id:
         reply_markup=reply_markup
     )
 
+@traced
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = update.message.text.strip().upper()
@@ -225,7 +301,7 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if text not in ["A", "B", "C", "D"]:
         return
     
-    session = user_sessions.get(user_id)
+    session = await session_store.get(user_id)
     
     if not session or "current_case" not in session:
         await update.message.reply_text("❌ Sesión expirada. Usa /random_cases", reply_markup=ReplyKeyboardRemove())
@@ -237,14 +313,15 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     is_correct = (answer == correct)
     
-    save_user_response(user_id, case_id, answer, 1 if is_correct else 0)
-    increment_case_stat(case_id, answer)
-    update_user_stats(user_id, 1 if is_correct else 0)
+    # El usuario pedirá la justificación enseguida: precargarla mientras tanto
+    justification_cache.prefetch(case_id)
+    
+    stats = await record_answer(user_id, case_id, answer, 1 if is_correct else 0)
     
     if is_correct:
         session["correct_count"] += 1
+        session_store.mark_dirty(user_id)
     
-    stats = get_case_stats(case_id)
     total = sum(stats.values())
     
     stats_text = "\n📊 Estadísticas:\n"
@@ -269,7 +346,7 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
 async def finish_session(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    session = user_sessions.get(user_id)
+    session = await session_store.get(user_id)
     if not session:
         return
     
@@ -288,4 +365,4 @@ async def finish_session(update: Update, context: ContextTypes.DEFAULT_TYPE, use
         reply_markup=ReplyKeyboardRemove()
     )
     
-    del user_sessions[user_id]
+    session_store.delete(user_id)
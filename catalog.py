@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Índice en memoria del catálogo de casos
+Se carga una vez al arrancar y database.py lo mantiene al día
+en cada save_case/delete_case. Otros índices derivados (sampler.py) se
+suscriben para recibir los mismos cambios.
+"""
+import bisect
+import logging
+import random
+import threading
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import bitmap
+
+logger = logging.getLogger(__name__)
+
+# Intentos de sorteo por caso pedido antes de pasar a la diferencia exacta
+REJECTION_ATTEMPTS = 8
+
+def sample_rejecting(wanted: int, draw: Callable[[], int], accept: Callable[[int], bool],
+                     remaining: Callable[[], Iterable[int]], rng=random) -> List[int]:
+    """Hasta `wanted` ordinales distintos: los sortea con draw() y descarta los que accept()
+    rechaza; si tras REJECTION_ATTEMPTS intentos por caso faltan, los completa con una
+    muestra de remaining() (la diferencia exacta, que solo se recorre entonces)"""
+    chosen: List[int] = []
+    for _ in range(wanted * REJECTION_ATTEMPTS):
+        if len(chosen) >= wanted:
+            break
+        ordinal = draw()
+        if accept(ordinal) and ordinal not in chosen:
+            chosen.append(ordinal)
+    if len(chosen) < wanted:
+        taken = set(chosen)
+        rest = [ordinal for ordinal in remaining() if ordinal not in taken]
+        chosen.extend(rng.sample(rest, min(wanted - len(chosen), len(rest))))
+    return chosen
+
+class CaseCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = set()
+        self._ordinals: Dict[str, int] = {}
+        self._by_ordinal: List[Optional[str]] = [None]  # ordinal 0 no se usa
+        self._sorted: Optional[Tuple[str, ...]] = None
+        self._frozen: Optional[FrozenSet[str]] = None
+        self._live = bytearray()  # un bit por ordinal vivo, se mantiene en cada cambio
+        self._live_bits: Optional[int] = None
+        self._holes = set()  # ordinales ya asignados sin caso vivo (borrados)
+        self._holes_sorted: Optional[Tuple[int, ...]] = None
+        self._listeners: List = []
+        self.loaded = False
+
+    def subscribe(self, listener):
+        """listener implementa on_load(rows), on_add(case_id, ordinal) y on_discard(case_id, ordinal).
+        Si el catálogo ya tiene casos recibe on_load con el estado actual."""
+        with self._lock:
+            self._listeners.append(listener)
+            if self.loaded or self._ids:
+                listener.on_load(list(self._ordinals.items()))
+
+    def load(self, rows: Iterable[Tuple[str, int]], max_ordinal: int = 0):
+        """rows: pares (case_id, ordinal) de los casos existentes.
+        max_ordinal incluye los ordinales de casos borrados para no reutilizarlos."""
+        with self._lock:
+            self._ids = set()
+            self._ordinals = {}
+            self._by_ordinal = [None] * (max_ordinal + 1)
+            self._live = bytearray((max_ordinal + 8) // 8)
+            self._holes = set(range(1, max_ordinal + 1))
+            for case_id, ordinal in rows:
+                self._set(case_id, ordinal)
+            self._invalidate()
+            self.loaded = True
+            for listener in self._listeners:
+                listener.on_load(list(self._ordinals.items()))
+        logger.info(f"📚 Catálogo cargado en memoria: {len(self._ids)} casos")
+
+    def _set(self, case_id: str, ordinal: int):
+        self._ids.add(case_id)
+        self._ordinals[case_id] = ordinal
+        if ordinal >= len(self._by_ordinal):
+            # Los ordinales saltados los tomó otro proceso para casos ya borrados
+            self._holes.update(range(len(self._by_ordinal), ordinal))
+            self._by_ordinal.extend([None] * (ordinal + 1 - len(self._by_ordinal)))
+        self._holes.discard(ordinal)
+        self._by_ordinal[ordinal] = case_id
+        bitmap.set_bit(self._live, ordinal)
+
+    def add(self, case_id: str, ordinal: int):
+        with self._lock:
+            if case_id not in self._ids:
+                self._set(case_id, ordinal)
+                self._invalidate()
+                for listener in self._listeners:
+                    listener.on_add(case_id, ordinal)
+
+    def discard(self, case_id: str):
+        with self._lock:
+            if case_id in self._ids:
+                self._ids.discard(case_id)
+                ordinal = self._ordinals.pop(case_id)
+                self._by_ordinal[ordinal] = None
+                self._holes.add(ordinal)
+                bitmap.clear_bit(self._live, ordinal)
+                self._invalidate()
+                for listener in self._listeners:
+                    listener.on_discard(case_id, ordinal)
+
+    def _invalidate(self):
+        self._sorted = None
+        self._frozen = None
+        self._live_bits = None
+        self._holes_sorted = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, case_id: str) -> bool:
+        return case_id in self._ids
+
+    def ordinal(self, case_id: str) -> Optional[int]:
+        return self._ordinals.get(case_id)
+
+    def by_ordinal(self, ordinal: int) -> Optional[str]:
+        """Caso vivo con ese ordinal, o None si fue borrado"""
+        if 0 < ordinal < len(self._by_ordinal):
+            return self._by_ordinal[ordinal]
+        return None
+
+    def max_ordinal(self) -> int:
+        return len(self._by_ordinal) - 1
+
+    def holes(self) -> Tuple[int, ...]:
+        """Ordinales de casos borrados (≤ max_ordinal), ordenados"""
+        snapshot = self._holes_sorted
+        if snapshot is None:
+            with self._lock:
+                if self._holes_sorted is None:
+                    self._holes_sorted = tuple(sorted(self._holes))
+                snapshot = self._holes_sorted
+        return snapshot
+
+    def live_between(self, first: int, last: int) -> int:
+        """Casos vivos con ordinal en [first, last]"""
+        if last < first:
+            return 0
+        holes = self.holes()
+        return (last - first + 1) - (bisect.bisect_right(holes, last) - bisect.bisect_left(holes, first))
+
+    def live_bits(self) -> int:
+        """Bitmap con un bit por ordinal de caso existente"""
+        bits = self._live_bits
+        if bits is None:
+            with self._lock:
+                if self._live_bits is None:
+                    self._live_bits = int.from_bytes(self._live, "little")
+                bits = self._live_bits
+        return bits
+
+    def sample_unseen(self, seen: bytes, count: int, rng=random) -> Tuple[List[int], int]:
+        """Hasta `count` ordinales vivos cuyo bit no está en `seen` (bitmap sin comprimir)
+        y cuántos quedan sin ver. Sortea ordinales en [1, max_ordinal] y rechaza los
+        vistos o borrados, sin listar los no vistos salvo que queden muy pocos."""
+        available = len(self._ids) - (self.live_bits() & int.from_bytes(seen, "little")).bit_count()
+        if available <= 0:
+            return [], 0
+        max_ordinal = self.max_ordinal()
+        chosen = sample_rejecting(
+            min(count, available),
+            draw=lambda: rng.randint(1, max_ordinal),
+            accept=lambda ordinal: self.by_ordinal(ordinal) is not None and not bitmap.contains_bytes(seen, ordinal),
+            remaining=lambda: bitmap.ordinals(self.live_bits() & ~int.from_bytes(seen, "little")),
+            rng=rng
+        )
+        return chosen, available
+
+    def ids(self) -> Tuple[str, ...]:
+        """IDs ordenados; se recalculan solo tras un cambio"""
+        snapshot = self._sorted
+        if snapshot is None:
+            with self._lock:
+                if self._sorted is None:
+                    self._sorted = tuple(sorted(self._ids))
+                snapshot = self._sorted
+        return snapshot
+
+    def id_set(self) -> FrozenSet[str]:
+        """Conjunto inmutable compartido entre peticiones (sin copia por usuario)"""
+        snapshot = self._frozen
+        if snapshot is None:
+            with self._lock:
+                if self._frozen is None:
+                    self._frozen = frozenset(self._ids)
+                snapshot = self._frozen
+        return snapshot
+
+case_catalog = CaseCatalog()
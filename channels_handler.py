@@ -5,14 +5,17 @@ from telegram import Update
 from telegram.ext import ContextTypes
 
 from config import CASES_UPLOADER_ID
-from database import save_case, save_justification, count_cases, get_case_by_id, delete_case, get_all_case_ids
+from catalog import case_catalog
+from database import CASE_PATTERN, CORRECT_PATTERN
+from justifications_cache import justification_cache, save_justification
+from storage import save_case, get_case_by_id, delete_case, load_catalog
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
-CASE_PATTERN = re.compile(r'###CASE[_\s]*([A-Z0-9_-]+)', re.IGNORECASE)
-CORRECT_PATTERN = re.compile(r'#([A-D])#', re.IGNORECASE)
 JUST_PATTERN = re.compile(r'###JUST[_\s]*([A-Z0-9_-]+)', re.IGNORECASE)
 
+@traced
 async def handle_uploader_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     user_id = update.effective_user.id
@@ -53,7 +56,7 @@ async def handle_uploader_message(update: Update, context: ContextTypes.DEFAULT_
             file_type = "text"
         
         if file_id and file_type:
-            save_case(case_id, file_id, file_type, clean_text, correct_answer)
+            await save_case(case_id, file_id, file_type, clean_text, correct_answer)
             logger.info(f"✅ Caso guardado: {case_id} ({file_type}) → Respuesta: {correct_answer}")
             await msg.reply_text(f"✅ Caso guardado\n\nID: {case_id}\nTipo: {file_type}\nRespuesta correcta: {correct_answer}")
         else:
@@ -85,21 +88,25 @@ async def handle_uploader_message(update: Update, context: ContextTypes.DEFAULT_
             file_type = "text"
         
         if file_id and file_type:
-            save_justification(case_id, file_id, file_type, clean_text)
+            await save_justification(case_id, file_id, file_type, clean_text)
             logger.info(f"✅ Justificación guardada para: {case_id} ({file_type})")
             await msg.reply_text(f"✅ Justificación guardada\n\nPara caso: {case_id}\nTipo: {file_type}")
         else:
             await msg.reply_text("❌ No se pudo detectar contenido válido")
         return
 
+@traced
 async def cmd_refresh_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     from admin_panel import is_admin
     if not is_admin(update.effective_user.id):
         return
     
     msg = await update.message.reply_text("🔄 Verificando catálogo...")
-    total = count_cases()
-    all_ids = get_all_case_ids()
+    # Recarga índice y cachés por si hubo cambios fuera del bot (p. ej. importaciones)
+    await load_catalog()
+    justification_cache.clear()
+    total = len(case_catalog)
+    all_ids = case_catalog.ids()
     
     response = f"✅ Catálogo actualizado\n\n📊 Estado\nTotal de casos: {total}\n\n"
     if all_ids:
@@ -111,6 +118,7 @@ async def cmd_refresh_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     await msg.edit_text(response)
 
+@traced
 async def cmd_replace_caso(update: Update, context: ContextTypes.DEFAULT_TYPE):
     from admin_panel import is_admin
     if not is_admin(update.effective_user.id):
@@ -121,11 +129,11 @@ async def cmd_replace_caso(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     case_id = context.args[0]
-    caso = get_case_by_id(case_id)
+    caso = await get_case_by_id(case_id)
     
     if not caso:
         await update.message.reply_text(f"❌ Caso {case_id} no existe en BD")
         return
     
-    delete_case(case_id)
+    await delete_case(case_id)
     await update.message.reply_text(f"✅ Caso {case_id} eliminado de la BD\n\nAhora puedes enviar el nuevo caso con el mismo ID.")
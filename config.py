@@ -19,4 +19,85 @@ DATABASE_URL = os.environ.get("DATABASE_URL", "")
 DAILY_CASE_LIMIT = int(os.environ.get("DAILY_CASE_LIMIT", "5"))
 TZNAME = os.environ.get("TIMEZONE", "America/Bogota")
 TZ = ZoneInfo(TZNAME)
-PAUSE = float(os.environ.get("PAUSE", "0.3"))
+PAUSE = float(os.environ.get("PAUSE", "0.3"))  # intervalo mínimo entre mensajes a un mismo chat
+
+# Base de datos
+DB_WORKERS = int(os.environ.get("DB_WORKERS", "4"))
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", str(DB_WORKERS + 1)))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+DB_POOL_PING_AFTER = float(os.environ.get("DB_POOL_PING_AFTER", "30"))
+
+# Selección de casos: "memory" (diferencia de conjuntos en Python), "sql" (anti-join en la BD),
+# "deck" (mazo barajado por usuario con cursor) o "weighted" (sorteo ponderado, ver sampler.py)
+CASE_SELECTION_MODE = os.environ.get("CASE_SELECTION_MODE", "memory").lower()
+# Modo "weighted": cuotas por especialidad ("CARDIO:3,NEURO:1"; vacío = proporcional al catálogo),
+# sesgo hacia casos difíciles (0 = sin sesgo) y vida media de recencia en nº de casos (0 = sin recencia)
+SAMPLER_SPECIALTY_QUOTAS = os.environ.get("SAMPLER_SPECIALTY_QUOTAS", "")
+SAMPLER_DIFFICULTY_BIAS = float(os.environ.get("SAMPLER_DIFFICULTY_BIAS", "0"))
+SAMPLER_RECENCY_HALF_LIFE = float(os.environ.get("SAMPLER_RECENCY_HALF_LIFE", "0"))
+# Casos enviados: "rows" (una fila por usuario y caso) o "bitmap" (un blob comprimido por usuario)
+SENT_CASES_STORAGE = os.environ.get("SENT_CASES_STORAGE", "rows").lower()
+
+# Sesiones: caché en memoria (LRU/TTL) con escritura diferida a la BD
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "5000"))
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "1800"))
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", "5"))
+SESSION_MAX_AGE = int(os.environ.get("SESSION_MAX_AGE", str(2 * 24 * 3600)))
+
+# Contadores de case_stats en memoria con volcado periódico (0 = escribir en cada respuesta)
+CASE_STATS_FLUSH_INTERVAL = float(os.environ.get("CASE_STATS_FLUSH_INTERVAL", "0"))
+
+# Justificaciones por caso en caché LRU
+JUSTIFICATION_CACHE_SIZE = int(os.environ.get("JUSTIFICATION_CACHE_SIZE", "1000"))
+
+# Envíos a Telegram (ver outbound.py)
+OUTBOUND_GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_GROUP_PER_MINUTE = int(os.environ.get("OUTBOUND_GROUP_PER_MINUTE", "20"))
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", "3"))
+
+# Difusiones (/broadcast): envíos simultáneos (el ritmo lo marca el planificador) y
+# destinatarios por bloque; el progreso se guarda en la BD al empezar y al terminar cada bloque
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "25"))
+BROADCAST_PAGE_SIZE = int(os.environ.get("BROADCAST_PAGE_SIZE", "200"))
+
+# Retención (ver maintenance.py): respuestas más antiguas que RESPONSES_RETENTION_DAYS se agregan
+# en response_rollups y se borran para siempre; por defecto 0 = no tocar user_responses.
+# daily_progress se poda tras DAILY_PROGRESS_RETENTION_DAYS.
+# RETENTION_ARCHIVE_DIR (opcional) guarda antes las filas crudas en JSONL comprimido por mes.
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", "86400"))
+RESPONSES_RETENTION_DAYS = int(os.environ.get("RESPONSES_RETENTION_DAYS", "0"))
+DAILY_PROGRESS_RETENTION_DAYS = int(os.environ.get("DAILY_PROGRESS_RETENTION_DAYS", "30"))
+RETENTION_ARCHIVE_DIR = os.environ.get("RETENTION_ARCHIVE_DIR", "")
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "5000"))
+RETENTION_BATCH_PAUSE = float(os.environ.get("RETENTION_BATCH_PAUSE", "0.2"))
+
+# Trazas: updates más lentas que el umbral (segundos) se registran y se guardan para /admin
+TRACE_SLOW_THRESHOLD = float(os.environ.get("TRACE_SLOW_THRESHOLD", "2.0"))
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "50"))
+
+# Métricas Prometheus en http://METRICS_HOST:METRICS_PORT/metrics (0 = desactivado)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Recepción de updates: "polling" (por defecto) o "webhook"
+UPDATE_MODE = os.environ.get("UPDATE_MODE", "polling").lower()
+# URL pública base (https://bot.ejemplo.com); detrás de un proxy TLS el bot escucha en HTTP plano
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", os.environ.get("PORT", "8443")))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Solo si el bot termina TLS él mismo (sin proxy delante)
+WEBHOOK_CERT = os.environ.get("WEBHOOK_CERT", "")
+WEBHOOK_KEY = os.environ.get("WEBHOOK_KEY", "")
+
+# Updates de usuarios distintos en paralelo; las de un mismo usuario siempre en orden
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "32"))
+
+# Estadísticas del panel de admin: instantánea recalculada cada N segundos
+STATS_REFRESH_INTERVAL = float(os.environ.get("STATS_REFRESH_INTERVAL", "300"))
+
+# Análisis de casos (p, discriminación, distractores) cada N segundos (0 = desactivado)
+ANALYTICS_INTERVAL = float(os.environ.get("ANALYTICS_INTERVAL", "3600"))
@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
+import base64
+import csv
+import io
 import logging
+import random
+import re
+import select
+import threading
+import time
+from contextlib import contextmanager
 from typing import List, Tuple, Optional, Set, Dict
 from datetime import datetime
-from config import TZ, DATABASE_URL
+import bitmap
+from catalog import REJECTION_ATTEMPTS, case_catalog
+from config import TZ, DATABASE_URL, SENT_CASES_STORAGE, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +21,8 @@ USE_POSTGRES = bool(DATABASE_URL)
 
 if USE_POSTGRES:
     import psycopg2
+    import psycopg2.pool
+    import psycopg2.extras
     from psycopg2.extras import RealDictCursor
     logger.info("🐘 Usando PostgreSQL")
 else:
@@ -18,26 +31,228 @@ else:
 
 _conn_cache = {}
 
-def _get_conn():
-    global _conn_cache
-    
-    if USE_POSTGRES:
-        key = "postgres"
-        if key in _conn_cache:
-            return _conn_cache[key]
-        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+class _PgPool:
+    """Pool de conexiones PostgreSQL con verificación al prestar y reconexión"""
+
+    def __init__(self, dsn: str, minconn: int, maxconn: int, timeout: float, ping_after: float):
+        self._dsn = dsn
+        self._minconn = minconn
+        self._maxconn = maxconn
+        self._timeout = timeout
+        self._ping_after = ping_after
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, devuelta_en, generación)
+        self._size = 0
+        self._generation = 0
+        self._stats = {
+            "checkouts": 0, "waits": 0, "wait_time": 0.0, "max_wait": 0.0,
+            "created": 0, "discarded": 0, "reconnects": 0
+        }
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic(), self._generation))
+            self._size += 1
+            self._stats["created"] += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(self._dsn, cursor_factory=RealDictCursor)
         conn.autocommit = True
-        _conn_cache[key] = conn
         return conn
+
+    def _is_alive(self, conn, returned_at: float, stale: bool) -> bool:
+        if conn.closed:
+            return False
+        # Una conexión ociosa no debería tener nada que leer: si el socket está
+        # listo es que el servidor la cerró (reinicio, pg_terminate_backend...)
+        try:
+            readable, _, _ = select.select([conn.fileno()], [], [], 0)
+        except (OSError, ValueError, psycopg2.Error):
+            return False
+        if readable:
+            return False
+        if not stale and time.monotonic() - returned_at < self._ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._size -= 1
+        self._stats["discarded"] += 1
+        self._cond.notify()
+
+    def _refill(self):
+        """Repone conexiones hasta minconn tras descartar caídas (fuera del lock)"""
+        while True:
+            with self._cond:
+                if self._size >= self._minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                logger.warning(f"⚠️ No se pudo reponer el pool PostgreSQL: {e}")
+                return
+            with self._cond:
+                self._stats["created"] += 1
+                self._idle.append((conn, time.monotonic(), self._generation))
+                self._cond.notify()
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self._timeout
+        waited = False
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self._maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise psycopg2.pool.PoolError(f"Pool agotado ({self._maxconn} conexiones)")
+                    waited = True
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, returned_at, generation = self._idle.pop()
+                    stale = generation != self._generation
+                else:
+                    # Reservar el hueco antes de conectar fuera del lock
+                    conn = None
+                    self._size += 1
+
+            # Conectar y verificar fuera del lock para no frenar a otros hilos
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except psycopg2.Error:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+            elif not self._is_alive(conn, returned_at, stale):
+                logger.warning("🔌 Conexión PostgreSQL caída, reconectando")
+                with self._cond:
+                    self._discard(conn)
+                    self._stats["reconnects"] += 1
+                self._refill()
+                continue
+            break
+
+        wait_time = time.monotonic() - start
+        with self._cond:
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time"] += wait_time
+                self._stats["max_wait"] = max(self._stats["max_wait"], wait_time)
+        return conn
+
+    def putconn(self, conn, broken: bool = False):
+        if not broken and not conn.closed and not conn.autocommit:
+            # Fuera del lock: es una ida y vuelta al servidor y puede fallar si cayó
+            try:
+                conn.rollback()
+                conn.autocommit = True
+            except psycopg2.Error:
+                broken = True
+        with self._cond:
+            if not (broken or conn.closed):
+                self._idle.append((conn, time.monotonic(), self._generation))
+                self._cond.notify()
+                return
+            # Una caída suele afectar a todas: forzar ping en las ociosas
+            self._generation += 1
+            self._discard(conn)
+        self._refill()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(
+                self._stats,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                min=self._minconn,
+                max=self._maxconn
+            )
+
+    def closeall(self):
+        with self._cond:
+            for conn, _, _ in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle.clear()
+
+_pool_lock = threading.Lock()
+
+def _get_pool() -> _PgPool:
+    pool = _conn_cache.get("postgres")
+    if pool is None:
+        with _pool_lock:
+            pool = _conn_cache.get("postgres")
+            if pool is None:
+                pool = _PgPool(DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+                _conn_cache["postgres"] = pool
+    return pool
+
+@contextmanager
+def _get_conn():
+    if USE_POSTGRES:
+        pool = _get_pool()
+        conn = pool.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            pool.putconn(conn, broken=True)
+            raise
+        except BaseException:
+            pool.putconn(conn)
+            raise
+        else:
+            pool.putconn(conn)
     else:
         key = "sqlite"
-        if key in _conn_cache:
-            return _conn_cache[key]
-        conn = sqlite3.connect("casos.db", check_same_thread=False)
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-        _conn_cache[key] = conn
-        return conn
+        conn = _conn_cache.get(key)
+        if conn is None:
+            conn = sqlite3.connect("casos.db", check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            _conn_cache[key] = conn
+        yield conn
+
+@contextmanager
+def _transaction(conn):
+    """Agrupa varias sentencias en una sola transacción (un solo commit)"""
+    if USE_POSTGRES:
+        conn.autocommit = False
+    try:
+        yield
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if USE_POSTGRES:
+            conn.autocommit = True
+
+def pool_stats() -> dict:
+    if not USE_POSTGRES or "postgres" not in _conn_cache:
+        return {}
+    return _conn_cache["postgres"].stats()
+
+def close_pool():
+    pool = _conn_cache.pop("postgres", None)
+    if pool:
+        pool.closeall()
 
 _schema_postgres = """
 CREATE TABLE IF NOT EXISTS clinical_cases (
@@ -53,6 +268,31 @@ CREATE TABLE IF NOT EXISTS clinical_cases (
 );
 CREATE INDEX IF NOT EXISTS idx_cases_specialty ON clinical_cases(specialty);
 
+CREATE TABLE IF NOT EXISTS case_ordinals (
+  ordinal SERIAL PRIMARY KEY,
+  case_id TEXT UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_decks (
+  user_id BIGINT PRIMARY KEY,
+  seed BIGINT NOT NULL,
+  deck_size INTEGER NOT NULL,
+  deck_pos INTEGER DEFAULT 0,
+  late_start INTEGER,
+  late_end INTEGER,
+  late_drawn INTEGER DEFAULT 0,
+  deck_left INTEGER,
+  late_left INTEGER,
+  changes_seen INTEGER,
+  updated_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW())
+);
+
+CREATE TABLE IF NOT EXISTS catalog_changes (
+  seq SERIAL PRIMARY KEY,
+  ordinal INTEGER NOT NULL,
+  delta INTEGER NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS justifications (
   id SERIAL PRIMARY KEY,
   case_id TEXT NOT NULL,
@@ -85,6 +325,7 @@ CREATE TABLE IF NOT EXISTS user_responses (
 );
 CREATE INDEX IF NOT EXISTS idx_resp_user ON user_responses(user_id);
 CREATE INDEX IF NOT EXISTS idx_resp_case ON user_responses(case_id);
+CREATE INDEX IF NOT EXISTS idx_resp_time ON user_responses(timestamp);
 
 CREATE TABLE IF NOT EXISTS user_sent_cases (
   user_id BIGINT NOT NULL,
@@ -94,6 +335,18 @@ CREATE TABLE IF NOT EXISTS user_sent_cases (
 );
 CREATE INDEX IF NOT EXISTS idx_sent_user ON user_sent_cases(user_id);
 
+CREATE TABLE IF NOT EXISTS user_sent_bitmaps (
+  user_id BIGINT PRIMARY KEY,
+  bitmap BYTEA NOT NULL,
+  updated_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW())
+);
+
+CREATE TABLE IF NOT EXISTS user_sessions (
+  user_id BIGINT PRIMARY KEY,
+  data TEXT NOT NULL,
+  updated_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW())
+);
+
 CREATE TABLE IF NOT EXISTS case_stats (
   case_id TEXT,
   answer TEXT,
@@ -107,6 +360,70 @@ CREATE TABLE IF NOT EXISTS daily_progress (
   cases_solved INTEGER DEFAULT 0,
   PRIMARY KEY (user_id, date)
 );
+CREATE INDEX IF NOT EXISTS idx_progress_date ON daily_progress(date);
+
+CREATE TABLE IF NOT EXISTS response_rollups (
+  user_id BIGINT NOT NULL,
+  case_id TEXT NOT NULL,
+  day TEXT NOT NULL,
+  responses INTEGER NOT NULL,
+  correct INTEGER NOT NULL,
+  answers_a INTEGER DEFAULT 0,
+  answers_b INTEGER DEFAULT 0,
+  answers_c INTEGER DEFAULT 0,
+  answers_d INTEGER DEFAULT 0,
+  PRIMARY KEY (user_id, case_id, day)
+);
+CREATE TABLE IF NOT EXISTS case_analytics (
+  case_id TEXT PRIMARY KEY,
+  responses INTEGER NOT NULL,
+  p_value REAL,
+  discrimination REAL,
+  distractor_efficiency REAL,
+  answers_a INTEGER DEFAULT 0,
+  answers_b INTEGER DEFAULT 0,
+  answers_c INTEGER DEFAULT 0,
+  answers_d INTEGER DEFAULT 0,
+  updated_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW())
+);
+
+CREATE TABLE IF NOT EXISTS specialty_analytics (
+  specialty TEXT,
+  topic TEXT,
+  responses INTEGER NOT NULL,
+  correct INTEGER NOT NULL,
+  updated_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW()),
+  PRIMARY KEY (specialty, topic)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_state (
+  name TEXT PRIMARY KEY,
+  value BIGINT NOT NULL,
+  updated_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW())
+);
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+  id SERIAL PRIMARY KEY,
+  created_by BIGINT,
+  audience TEXT NOT NULL,
+  file_type TEXT NOT NULL,
+  file_id TEXT,
+  text TEXT,
+  status TEXT NOT NULL DEFAULT 'running',
+  total INTEGER DEFAULT 0,
+  claimed_user_id BIGINT,
+  done_user_id BIGINT,
+  sent INTEGER DEFAULT 0,
+  failed INTEGER DEFAULT 0,
+  blocked INTEGER DEFAULT 0,
+  created_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW()),
+  finished_at BIGINT
+);
+
+CREATE TABLE IF NOT EXISTS blocked_users (
+  user_id BIGINT PRIMARY KEY,
+  blocked_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW())
+);
 """
 
 _schema_sqlite = """
@@ -123,6 +440,31 @@ CREATE TABLE IF NOT EXISTS clinical_cases (
 );
 CREATE INDEX IF NOT EXISTS idx_cases_specialty ON clinical_cases(specialty);
 
+CREATE TABLE IF NOT EXISTS case_ordinals (
+  ordinal INTEGER PRIMARY KEY AUTOINCREMENT,
+  case_id TEXT UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_decks (
+  user_id INTEGER PRIMARY KEY,
+  seed INTEGER NOT NULL,
+  deck_size INTEGER NOT NULL,
+  deck_pos INTEGER DEFAULT 0,
+  late_start INTEGER,
+  late_end INTEGER,
+  late_drawn INTEGER DEFAULT 0,
+  deck_left INTEGER,
+  late_left INTEGER,
+  changes_seen INTEGER,
+  updated_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+
+CREATE TABLE IF NOT EXISTS catalog_changes (
+  seq INTEGER PRIMARY KEY AUTOINCREMENT,
+  ordinal INTEGER NOT NULL,
+  delta INTEGER NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS justifications (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   case_id TEXT NOT NULL,
@@ -155,6 +497,7 @@ CREATE TABLE IF NOT EXISTS user_responses (
 );
 CREATE INDEX IF NOT EXISTS idx_resp_user ON user_responses(user_id);
 CREATE INDEX IF NOT EXISTS idx_resp_case ON user_responses(case_id);
+CREATE INDEX IF NOT EXISTS idx_resp_time ON user_responses(timestamp);
 
 CREATE TABLE IF NOT EXISTS user_sent_cases (
   user_id INTEGER NOT NULL,
@@ -164,6 +507,18 @@ CREATE TABLE IF NOT EXISTS user_sent_cases (
 );
 CREATE INDEX IF NOT EXISTS idx_sent_user ON user_sent_cases(user_id);
 
+CREATE TABLE IF NOT EXISTS user_sent_bitmaps (
+  user_id INTEGER PRIMARY KEY,
+  bitmap BLOB NOT NULL,
+  updated_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+
+CREATE TABLE IF NOT EXISTS user_sessions (
+  user_id INTEGER PRIMARY KEY,
+  data TEXT NOT NULL,
+  updated_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+
 CREATE TABLE IF NOT EXISTS case_stats (
   case_id TEXT,
   answer TEXT,
@@ -177,19 +532,143 @@ CREATE TABLE IF NOT EXISTS daily_progress (
   cases_solved INTEGER DEFAULT 0,
   PRIMARY KEY (user_id, date)
 );
+CREATE INDEX IF NOT EXISTS idx_progress_date ON daily_progress(date);
+
+CREATE TABLE IF NOT EXISTS response_rollups (
+  user_id INTEGER NOT NULL,
+  case_id TEXT NOT NULL,
+  day TEXT NOT NULL,
+  responses INTEGER NOT NULL,
+  correct INTEGER NOT NULL,
+  answers_a INTEGER DEFAULT 0,
+  answers_b INTEGER DEFAULT 0,
+  answers_c INTEGER DEFAULT 0,
+  answers_d INTEGER DEFAULT 0,
+  PRIMARY KEY (user_id, case_id, day)
+);
+CREATE TABLE IF NOT EXISTS case_analytics (
+  case_id TEXT PRIMARY KEY,
+  responses INTEGER NOT NULL,
+  p_value REAL,
+  discrimination REAL,
+  distractor_efficiency REAL,
+  answers_a INTEGER DEFAULT 0,
+  answers_b INTEGER DEFAULT 0,
+  answers_c INTEGER DEFAULT 0,
+  answers_d INTEGER DEFAULT 0,
+  updated_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+
+CREATE TABLE IF NOT EXISTS specialty_analytics (
+  specialty TEXT,
+  topic TEXT,
+  responses INTEGER NOT NULL,
+  correct INTEGER NOT NULL,
+  updated_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+  PRIMARY KEY (specialty, topic)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_state (
+  name TEXT PRIMARY KEY,
+  value INTEGER NOT NULL,
+  updated_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  created_by INTEGER,
+  audience TEXT NOT NULL,
+  file_type TEXT NOT NULL,
+  file_id TEXT,
+  text TEXT,
+  status TEXT NOT NULL DEFAULT 'running',
+  total INTEGER DEFAULT 0,
+  claimed_user_id INTEGER,
+  done_user_id INTEGER,
+  sent INTEGER DEFAULT 0,
+  failed INTEGER DEFAULT 0,
+  blocked INTEGER DEFAULT 0,
+  created_at INTEGER DEFAULT (strftime('%s','now')),
+  finished_at INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS blocked_users (
+  user_id INTEGER PRIMARY KEY,
+  blocked_at INTEGER DEFAULT (strftime('%s','now'))
+);
 """
 
 def init_db():
-    conn = _get_conn()
-    schema = _schema_postgres if USE_POSTGRES else _schema_sqlite
+    with _get_conn() as conn:
+        schema = _schema_postgres if USE_POSTGRES else _schema_sqlite
+    
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(schema)
+        else:
+            conn.executescript(schema)
+            conn.commit()
+        _add_missing_columns(conn)
+        _backfill_case_ordinals(conn)
+        
+        migrate = SENT_CASES_STORAGE == "bitmap" and _needs_bitmap_migration(conn)
     
+    if migrate:
+        migrate_sent_cases_to_bitmaps()
+
+def _needs_bitmap_migration(conn) -> bool:
+    """Primera vez en modo bitmap: hay filas antiguas y ningún bitmap"""
+    query = "SELECT EXISTS (SELECT 1 FROM user_sent_cases) AS has_rows, EXISTS (SELECT 1 FROM user_sent_bitmaps) AS has_bitmaps"
+    if USE_POSTGRES:
+        with conn.cursor() as cur:
+            cur.execute(query)
+            row = cur.fetchone()
+            return row['has_rows'] and not row['has_bitmaps']
+    row = conn.execute(query).fetchone()
+    return bool(row[0]) and not row[1]
+
+# Columnas añadidas después de crear la tabla: (tabla, columna, tipo)
+_ADDED_COLUMNS = [
+    ("user_decks", "late_start", "INTEGER"),
+    ("user_decks", "late_end", "INTEGER"),
+    ("user_decks", "deck_left", "INTEGER"),
+    ("user_decks", "late_left", "INTEGER"),
+    ("user_decks", "changes_seen", "INTEGER"),
+]
+
+def _add_missing_columns(conn):
     if USE_POSTGRES:
         with conn.cursor() as cur:
-            cur.execute(schema)
+            for table, column, kind in _ADDED_COLUMNS:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {kind}")
     else:
-        conn.executescript(schema)
+        for table, column, kind in _ADDED_COLUMNS:
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
         conn.commit()
 
+_backfill_ordinals_sql = """
+INSERT INTO case_ordinals(case_id)
+SELECT case_id FROM clinical_cases c
+WHERE NOT EXISTS (SELECT 1 FROM case_ordinals o WHERE o.case_id=c.case_id)
+ORDER BY created_at, case_id
+"""
+
+def _backfill_case_ordinals(conn):
+    """Asigna ordinal a los casos anteriores a la tabla case_ordinals"""
+    if USE_POSTGRES:
+        with conn.cursor() as cur:
+            cur.execute(_backfill_ordinals_sql)
+    else:
+        conn.execute(_backfill_ordinals_sql)
+        conn.commit()
+
+# Marcas en el texto de un caso subido: ###CASE_<id> y la respuesta correcta #A#..#D#
+# (channels_handler.py e importer.py; aquí para que el importador no cargue los handlers)
+CASE_PATTERN = re.compile(r'###CASE[_\s]*([A-Z0-9_-]+)', re.IGNORECASE)
+CORRECT_PATTERN = re.compile(r'#([A-D])#', re.IGNORECASE)
+
 def parse_case_id(case_id: str) -> Dict[str, str]:
     parts = case_id.replace("###CASE_", "").split("_")
     
@@ -201,281 +680,1414 @@ def parse_case_id(case_id: str) -> Dict[str, str]:
         'subtopic': parts[3] if len(parts) > 3 else ''
     }
 
+# Cada alta o baja de un caso vivo queda en catalog_changes (ordinal, +1/-1) para que
+# los mazos (deck.py) ajusten sus recuentos de casos por sacar sin recorrer los borrados
+_log_revival_sql = """INSERT INTO catalog_changes(ordinal, delta)
+SELECT o.ordinal, 1 FROM case_ordinals o
+WHERE NOT EXISTS (SELECT 1 FROM clinical_cases c WHERE c.case_id=o.case_id) AND o.case_id="""
+
+_log_deletion_sql = """INSERT INTO catalog_changes(ordinal, delta)
+SELECT o.ordinal, -1 FROM case_ordinals o JOIN clinical_cases c ON c.case_id=o.case_id
+WHERE o.case_id="""
+
 def save_case(case_id: str, file_id: str, file_type: str, caption: str = "", correct_answer: str = ""):
     parsed = parse_case_id(case_id)
-    conn = _get_conn()
+    with _get_conn() as conn:
     
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(_log_revival_sql + "%s", (case_id,))
+                cur.execute(
+                    """INSERT INTO clinical_cases(case_id, file_id, file_type, caption, specialty, topic, subtopic, correct_answer) 
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s) 
+                       ON CONFLICT (case_id) DO UPDATE SET 
+                       file_id=EXCLUDED.file_id,
+                       file_type=EXCLUDED.file_type,
+                       caption=EXCLUDED.caption,
+                       correct_answer=EXCLUDED.correct_answer""",
+                    (case_id, file_id, file_type, caption, parsed['specialty'], parsed['topic'], parsed['subtopic'], correct_answer)
+                )
+        else:
+            conn.execute(_log_revival_sql + "?", (case_id,))
+            conn.execute(
+                """INSERT OR REPLACE INTO clinical_cases(case_id, file_id, file_type, caption, specialty, topic, subtopic, correct_answer) 
+                   VALUES (?,?,?,?,?,?,?,?)""",
+                (case_id, file_id, file_type, caption, parsed['specialty'], parsed['topic'], parsed['subtopic'], correct_answer)
+            )
+            conn.commit()
+        ordinal = _ensure_case_ordinal(conn, case_id)
+    case_catalog.add(case_id, ordinal)
+
+def _ensure_case_ordinal(conn, case_id: str) -> int:
+    """Ordinal denso y estable del caso; se conserva si el caso se borra y se vuelve a subir"""
     if USE_POSTGRES:
         with conn.cursor() as cur:
             cur.execute(
-                """INSERT INTO clinical_cases(case_id, file_id, file_type, caption, specialty, topic, subtopic, correct_answer) 
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s) 
-                   ON CONFLICT (case_id) DO UPDATE SET 
-                   file_id=EXCLUDED.file_id,
-                   file_type=EXCLUDED.file_type,
-                   caption=EXCLUDED.caption,
-                   correct_answer=EXCLUDED.correct_answer""",
-                (case_id, file_id, file_type, caption, parsed['specialty'], parsed['topic'], parsed['subtopic'], correct_answer)
+                """INSERT INTO case_ordinals(case_id) SELECT %s
+                   WHERE NOT EXISTS (SELECT 1 FROM case_ordinals WHERE case_id=%s)
+                   ON CONFLICT (case_id) DO NOTHING""",
+                (case_id, case_id)
             )
+            cur.execute("SELECT ordinal FROM case_ordinals WHERE case_id=%s", (case_id,))
+            return cur.fetchone()['ordinal']
     else:
+        # Sin OR IGNORE: con AUTOINCREMENT un conflicto ignorado también gasta un ordinal
         conn.execute(
-            """INSERT OR REPLACE INTO clinical_cases(case_id, file_id, file_type, caption, specialty, topic, subtopic, correct_answer) 
-               VALUES (?,?,?,?,?,?,?,?)""",
-            (case_id, file_id, file_type, caption, parsed['specialty'], parsed['topic'], parsed['subtopic'], correct_answer)
+            "INSERT INTO case_ordinals(case_id) SELECT ?1 WHERE NOT EXISTS (SELECT 1 FROM case_ordinals WHERE case_id=?1)",
+            (case_id,)
         )
         conn.commit()
+        return conn.execute("SELECT ordinal FROM case_ordinals WHERE case_id=?", (case_id,)).fetchone()[0]
 
 def delete_case(case_id: str):
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM clinical_cases WHERE case_id=%s", (case_id,))
-    else:
-        conn.execute("DELETE FROM clinical_cases WHERE case_id=?", (case_id,))
-        conn.commit()
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with _transaction(conn):
+                with conn.cursor() as cur:
+                    cur.execute(_log_deletion_sql + "%s", (case_id,))
+                    cur.execute("DELETE FROM clinical_cases WHERE case_id=%s", (case_id,))
+        else:
+            conn.execute(_log_deletion_sql + "?", (case_id,))
+            conn.execute("DELETE FROM clinical_cases WHERE case_id=?", (case_id,))
+            conn.commit()
+    case_catalog.discard(case_id)
 
 def save_justification(case_id: str, file_id: str, file_type: str, caption: str = ""):
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO justifications(case_id, file_id, file_type, caption) VALUES (%s, %s, %s, %s)", 
-                       (case_id, file_id, file_type, caption))
-    else:
-        conn.execute("INSERT INTO justifications(case_id, file_id, file_type, caption) VALUES (?,?,?,?)", 
-                    (case_id, file_id, file_type, caption))
-        conn.commit()
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("INSERT INTO justifications(case_id, file_id, file_type, caption) VALUES (%s, %s, %s, %s)", 
+                           (case_id, file_id, file_type, caption))
+        else:
+            conn.execute("INSERT INTO justifications(case_id, file_id, file_type, caption) VALUES (?,?,?,?)", 
+                        (case_id, file_id, file_type, caption))
+            conn.commit()
+
+_import_cases_columns = "case_id, file_id, file_type, caption, specialty, topic, subtopic, correct_answer"
+
+def _copy_rows(cur, table: str, columns: str, rows: List[tuple]):
+    buf = io.StringIO()
+    # Todo entre comillas: "" es texto vacío, no NULL
+    csv.writer(buf, quoting=csv.QUOTE_ALL).writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table}({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+
+def import_cases(cases: List[tuple], justifications: List[tuple]) -> Dict[str, int]:
+    """Importa en una sola transacción un lote de casos (case_id, file_id, file_type, caption,
+    correct_answer) y justificaciones (case_id, file_id, file_type, caption).
+    Idempotente: los casos idénticos no se reescriben y una justificación con el mismo
+    case_id y file_id no se vuelve a insertar."""
+    case_rows = []
+    for case_id, file_id, file_type, caption, correct_answer in cases:
+        parsed = parse_case_id(case_id)
+        case_rows.append((case_id, file_id, file_type, caption, parsed['specialty'], parsed['topic'], parsed['subtopic'], correct_answer))
+    
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    cur.execute("""CREATE TEMP TABLE import_cases
+                                   (seq SERIAL, case_id TEXT, file_id TEXT, file_type TEXT, caption TEXT,
+                                    specialty TEXT, topic TEXT, subtopic TEXT, correct_answer TEXT) ON COMMIT DROP""")
+                    cur.execute("""CREATE TEMP TABLE import_justifications
+                                   (seq SERIAL, case_id TEXT, file_id TEXT, file_type TEXT, caption TEXT) ON COMMIT DROP""")
+                    _copy_rows(cur, "import_cases", _import_cases_columns, case_rows)
+                    _copy_rows(cur, "import_justifications", "case_id, file_id, file_type, caption", justifications)
+                    
+                    cur.execute(
+                        """INSERT INTO catalog_changes(ordinal, delta)
+                           SELECT o.ordinal, 1 FROM case_ordinals o
+                           WHERE o.case_id IN (SELECT case_id FROM import_cases)
+                           AND NOT EXISTS (SELECT 1 FROM clinical_cases c WHERE c.case_id=o.case_id)"""
+                    )
+                    cur.execute(
+                        f"""INSERT INTO clinical_cases({_import_cases_columns})
+                            SELECT {_import_cases_columns} FROM import_cases ORDER BY seq
+                            ON CONFLICT (case_id) DO UPDATE SET
+                            file_id=EXCLUDED.file_id,
+                            file_type=EXCLUDED.file_type,
+                            caption=EXCLUDED.caption,
+                            specialty=EXCLUDED.specialty,
+                            topic=EXCLUDED.topic,
+                            subtopic=EXCLUDED.subtopic,
+                            correct_answer=EXCLUDED.correct_answer
+                            WHERE (clinical_cases.file_id, clinical_cases.file_type, clinical_cases.caption, clinical_cases.correct_answer)
+                                  IS DISTINCT FROM (EXCLUDED.file_id, EXCLUDED.file_type, EXCLUDED.caption, EXCLUDED.correct_answer)
+                            RETURNING (xmax = 0) AS inserted"""
+                    )
+                    written = [row['inserted'] for row in cur.fetchall()]
+                    cur.execute(
+                        """INSERT INTO case_ordinals(case_id)
+                           SELECT case_id FROM import_cases s
+                           WHERE NOT EXISTS (SELECT 1 FROM case_ordinals o WHERE o.case_id=s.case_id)
+                           ORDER BY seq
+                           ON CONFLICT (case_id) DO NOTHING"""
+                    )
+                    cur.execute(
+                        """INSERT INTO justifications(case_id, file_id, file_type, caption)
+                           SELECT case_id, file_id, file_type, caption FROM import_justifications s
+                           WHERE NOT EXISTS (SELECT 1 FROM justifications j WHERE j.case_id=s.case_id AND j.file_id=s.file_id)
+                           ORDER BY seq"""
+                    )
+                    added_justifications = cur.rowcount
+                inserted = sum(1 for flag in written if flag)
+                updated = len(written) - inserted
+            else:
+                ids = [row[0] for row in case_rows]
+                existing = set()
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    existing.update(row[0] for row in conn.execute(
+                        f"SELECT case_id FROM clinical_cases WHERE case_id IN ({placeholders})", chunk))
+                
+                conn.executemany(_log_revival_sql + "?", [(case_id,) for case_id in set(ids) - existing])
+                before = conn.total_changes
+                conn.executemany(
+                    f"""INSERT INTO clinical_cases({_import_cases_columns}) VALUES (?,?,?,?,?,?,?,?)
+                        ON CONFLICT(case_id) DO UPDATE SET
+                        file_id=excluded.file_id,
+                        file_type=excluded.file_type,
+                        caption=excluded.caption,
+                        specialty=excluded.specialty,
+                        topic=excluded.topic,
+                        subtopic=excluded.subtopic,
+                        correct_answer=excluded.correct_answer
+                        WHERE (clinical_cases.file_id, clinical_cases.file_type, clinical_cases.caption, clinical_cases.correct_answer)
+                              IS NOT (excluded.file_id, excluded.file_type, excluded.caption, excluded.correct_answer)""",
+                    case_rows
+                )
+                written = conn.total_changes - before
+                inserted = len(set(ids) - existing)
+                updated = written - inserted
+                conn.executemany(
+                    "INSERT INTO case_ordinals(case_id) SELECT ?1 WHERE NOT EXISTS (SELECT 1 FROM case_ordinals WHERE case_id=?1)",
+                    [(case_id,) for case_id in ids]
+                )
+                before = conn.total_changes
+                conn.executemany(
+                    """INSERT INTO justifications(case_id, file_id, file_type, caption)
+                       SELECT ?1, ?2, ?3, ?4
+                       WHERE NOT EXISTS (SELECT 1 FROM justifications WHERE case_id=?1 AND file_id=?2)""",
+                    justifications
+                )
+                added_justifications = conn.total_changes - before
+    
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": len(case_rows) - inserted - updated,
+        "justifications": added_justifications
+    }
+
+def load_catalog():
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT c.case_id, o.ordinal FROM clinical_cases c JOIN case_ordinals o ON o.case_id=c.case_id")
+                rows = [(row['case_id'], row['ordinal']) for row in cur.fetchall()]
+                cur.execute("SELECT COALESCE(MAX(ordinal), 0) AS max_ordinal FROM case_ordinals")
+                max_ordinal = cur.fetchone()['max_ordinal']
+        else:
+            rows = conn.execute("SELECT c.case_id, o.ordinal FROM clinical_cases c JOIN case_ordinals o ON o.case_id=c.case_id").fetchall()
+            max_ordinal = conn.execute("SELECT COALESCE(MAX(ordinal), 0) FROM case_ordinals").fetchone()[0]
+    case_catalog.load(rows, max_ordinal)
 
 def get_all_case_ids() -> List[str]:
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("SELECT case_id FROM clinical_cases ORDER BY case_id")
-            return [row['case_id'] for row in cur.fetchall()]
-    else:
-        cur = conn.execute("SELECT case_id FROM clinical_cases ORDER BY case_id")
-        return [row[0] for row in cur.fetchall()]
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT case_id FROM clinical_cases ORDER BY case_id")
+                return [row['case_id'] for row in cur.fetchall()]
+        else:
+            cur = conn.execute("SELECT case_id FROM clinical_cases ORDER BY case_id")
+            return [row[0] for row in cur.fetchall()]
 
 def get_case_by_id(case_id: str) -> Optional[Tuple]:
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("SELECT case_id, file_id, file_type, caption, correct_answer FROM clinical_cases WHERE case_id=%s", (case_id,))
-            row = cur.fetchone()
-            return (row['case_id'], row['file_id'], row['file_type'], row['caption'], row['correct_answer']) if row else None
-    else:
-        cur = conn.execute("SELECT case_id, file_id, file_type, caption, correct_answer FROM clinical_cases WHERE case_id=?", (case_id,))
-        return cur.fetchone()
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT case_id, file_id, file_type, caption, correct_answer FROM clinical_cases WHERE case_id=%s", (case_id,))
+                row = cur.fetchone()
+                return (row['case_id'], row['file_id'], row['file_type'], row['caption'], row['correct_answer']) if row else None
+        else:
+            cur = conn.execute("SELECT case_id, file_id, file_type, caption, correct_answer FROM clinical_cases WHERE case_id=?", (case_id,))
+            return cur.fetchone()
+
+def get_cases_by_ids(case_ids: List[str]) -> Dict[str, Tuple]:
+    """Varios casos en una consulta: {case_id: (case_id, file_id, file_type, caption, correct_answer)}"""
+    if not case_ids:
+        return {}
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT case_id, file_id, file_type, caption, correct_answer FROM clinical_cases WHERE case_id = ANY(%s)",
+                    (list(case_ids),)
+                )
+                return {
+                    row['case_id']: (row['case_id'], row['file_id'], row['file_type'], row['caption'], row['correct_answer'])
+                    for row in cur.fetchall()
+                }
+        else:
+            placeholders = ",".join("?" * len(case_ids))
+            cur = conn.execute(
+                f"SELECT case_id, file_id, file_type, caption, correct_answer FROM clinical_cases WHERE case_id IN ({placeholders})",
+                list(case_ids)
+            )
+            return {row[0]: tuple(row) for row in cur.fetchall()}
 
 def get_justifications_for_case(case_id: str) -> List[Tuple[str, str, str]]:
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("SELECT file_id, file_type, caption FROM justifications WHERE case_id=%s ORDER BY id", (case_id,))
-            return [(row['file_id'], row['file_type'], row['caption']) for row in cur.fetchall()]
-    else:
-        cur = conn.execute("SELECT file_id, file_type, caption FROM justifications WHERE case_id=? ORDER BY id", (case_id,))
-        return [(row[0], row[1], row[2]) for row in cur.fetchall()]
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT file_id, file_type, caption FROM justifications WHERE case_id=%s ORDER BY id", (case_id,))
+                return [(row['file_id'], row['file_type'], row['caption']) for row in cur.fetchall()]
+        else:
+            cur = conn.execute("SELECT file_id, file_type, caption FROM justifications WHERE case_id=? ORDER BY id", (case_id,))
+            return [(row[0], row[1], row[2]) for row in cur.fetchall()]
 
 def get_user_sent_cases(user_id: int) -> Set[str]:
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("SELECT case_id FROM user_sent_cases WHERE user_id=%s", (user_id,))
-            return {row['case_id'] for row in cur.fetchall()}
-    else:
-        cur = conn.execute("SELECT case_id FROM user_sent_cases WHERE user_id=?", (user_id,))
+    if SENT_CASES_STORAGE == "bitmap":
+        return _get_user_sent_cases_bitmap(user_id)
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT case_id FROM user_sent_cases WHERE user_id=%s", (user_id,))
+                return {row['case_id'] for row in cur.fetchall()}
+        else:
+            cur = conn.execute("SELECT case_id FROM user_sent_cases WHERE user_id=?", (user_id,))
+            return {row[0] for row in cur.fetchall()}
+
+def filter_sent_cases(user_id: int, case_ids: List[str]) -> Set[str]:
+    """Cuáles de `case_ids` ya se enviaron al usuario, sin cargar todo su historial"""
+    if not case_ids:
+        return set()
+    if SENT_CASES_STORAGE == "bitmap":
+        with _get_conn() as conn:
+            seen = _load_sent_bytes(conn, user_id)
+        return {case_id for case_id in case_ids if bitmap.contains_bytes(seen, case_catalog.ordinal(case_id) or 0)}
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT case_id FROM user_sent_cases WHERE user_id=%s AND case_id = ANY(%s)",
+                    (user_id, list(case_ids))
+                )
+                return {row['case_id'] for row in cur.fetchall()}
+        placeholders = ",".join("?" * len(case_ids))
+        cur = conn.execute(
+            f"SELECT case_id FROM user_sent_cases WHERE user_id=? AND case_id IN ({placeholders})",
+            (user_id, *case_ids)
+        )
         return {row[0] for row in cur.fetchall()}
 
+# Un caso por cada punto de partida: el primero vivo y no visto con ordinal >= start
+# (recorrido por el índice de case_ordinals), volviendo al principio si no queda ninguno detrás
+_next_unseen_sql = """SELECT o.case_id FROM case_ordinals o JOIN clinical_cases c ON c.case_id=o.case_id
+WHERE o.ordinal >= {start}
+AND NOT EXISTS (SELECT 1 FROM user_sent_cases s WHERE s.user_id=me.user_id AND s.case_id=o.case_id)
+ORDER BY o.ordinal LIMIT 1"""
+
+def _sample_unseen_sql(p: str, starts: int) -> str:
+    values = ", ".join([f"({p})"] * starts)
+    return f"""WITH me(user_id) AS (VALUES ({p})), starts(start) AS (VALUES {values})
+SELECT COALESCE(({_next_unseen_sql.format(start="starts.start")}), ({_next_unseen_sql.format(start="1")})) AS case_id
+FROM starts, me"""
+
+_count_sent_live_sql = """SELECT COUNT(*) AS n FROM user_sent_cases s
+JOIN clinical_cases c ON c.case_id=s.case_id WHERE s.user_id="""
+
+def sample_unseen_case_ids(user_id: int, count: int) -> Tuple[List[str], int]:
+    """Sortea en la BD hasta `count` casos que el usuario no ha visto.
+    Devuelve (ids elegidos, total de casos no vistos).
+    Nada recorre el catálogo: cada caso sale de un ordinal al azar por el índice y los
+    no vistos son el tamaño del catálogo menos lo visto (solo se cuenta lo visto)."""
+    if SENT_CASES_STORAGE == "bitmap":
+        return _sample_unseen_case_ids_bitmap(user_id, count)
+    max_ordinal = case_catalog.max_ordinal()
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(_count_sent_live_sql + "%s", (user_id,))
+                available = len(case_catalog) - cur.fetchone()['n']
+        else:
+            available = len(case_catalog) - conn.execute(_count_sent_live_sql + "?", (user_id,)).fetchone()[0]
+        if available <= 0 or max_ordinal <= 0:
+            return [], 0
+        
+        wanted = min(count, available)
+        chosen: List[str] = []
+        for _ in range(REJECTION_ATTEMPTS):
+            if len(chosen) >= wanted:
+                break
+            # Más puntos que casos pedidos: dos puntos en el mismo hueco dan el mismo caso
+            starts = [random.randint(1, max_ordinal) for _ in range(2 * (wanted - len(chosen)))]
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    cur.execute(_sample_unseen_sql("%s", len(starts)), (user_id, *starts))
+                    picked = [row['case_id'] for row in cur.fetchall()]
+            else:
+                picked = [row[0] for row in conn.execute(_sample_unseen_sql("?", len(starts)), (user_id, *starts))]
+            for case_id in picked:
+                if case_id and case_id not in chosen and len(chosen) < wanted:
+                    chosen.append(case_id)
+        
+        if len(chosen) < wanted:
+            # Quedan pocos sin ver y en huecos estrechos: anti-join exacto sobre el catálogo
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """SELECT c.case_id FROM clinical_cases c
+                           WHERE NOT EXISTS (SELECT 1 FROM user_sent_cases s WHERE s.user_id=%s AND s.case_id=c.case_id)
+                           AND c.case_id <> ALL(%s::text[]) ORDER BY random() LIMIT %s""",
+                        (user_id, chosen, wanted - len(chosen))
+                    )
+                    chosen.extend(row['case_id'] for row in cur.fetchall())
+            else:
+                placeholders = ",".join("?" * len(chosen))
+                cur = conn.execute(
+                    f"""SELECT c.case_id FROM clinical_cases c
+                        WHERE NOT EXISTS (SELECT 1 FROM user_sent_cases s WHERE s.user_id=? AND s.case_id=c.case_id)
+                        AND c.case_id NOT IN ({placeholders}) ORDER BY RANDOM() LIMIT ?""",
+                    (user_id, *chosen, wanted - len(chosen))
+                )
+                chosen.extend(row[0] for row in cur.fetchall())
+    return chosen, available
+
 def save_user_sent_case(user_id: int, case_id: str):
-    conn = _get_conn()
+    if SENT_CASES_STORAGE == "bitmap":
+        return _save_user_sent_case_bitmap(user_id, case_id)
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO user_sent_cases(user_id, case_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                    (user_id, case_id)
+                )
+        else:
+            conn.execute("INSERT OR IGNORE INTO user_sent_cases(user_id, case_id) VALUES (?,?)", (user_id, case_id))
+            conn.commit()
+
+def reset_user_sent_cases(user_id: int):
+    table = "user_sent_bitmaps" if SENT_CASES_STORAGE == "bitmap" else "user_sent_cases"
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {table} WHERE user_id=%s", (user_id,))
+        else:
+            conn.execute(f"DELETE FROM {table} WHERE user_id=?", (user_id,))
+            conn.commit()
+
+# ====== Casos enviados como bitmap (SENT_CASES_STORAGE=bitmap) ======
+
+def _load_sent_bytes(conn, user_id: int, for_update: bool = False) -> bytes:
     if USE_POSTGRES:
         with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO user_sent_cases(user_id, case_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
-                (user_id, case_id)
-            )
+            lock = " FOR UPDATE" if for_update else ""
+            cur.execute(f"SELECT bitmap FROM user_sent_bitmaps WHERE user_id=%s{lock}", (user_id,))
+            row = cur.fetchone()
+            return bitmap.decode_bytes(row['bitmap']) if row else b""
     else:
-        conn.execute("INSERT OR IGNORE INTO user_sent_cases(user_id, case_id) VALUES (?,?)", (user_id, case_id))
-        conn.commit()
+        row = conn.execute("SELECT bitmap FROM user_sent_bitmaps WHERE user_id=?", (user_id,)).fetchone()
+        return bitmap.decode_bytes(row[0]) if row else b""
 
-def save_user_response(user_id: int, case_id: str, answer: str, is_correct: int):
-    conn = _get_conn()
+def _load_sent_bitmap(conn, user_id: int, for_update: bool = False) -> int:
+    return int.from_bytes(_load_sent_bytes(conn, user_id, for_update), "little")
+
+def _store_sent_bitmap(conn, user_id: int, bits: int):
+    blob = bitmap.encode(bits)
     if USE_POSTGRES:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO user_responses(user_id, case_id, answer, is_correct) VALUES (%s, %s, %s, %s)",
-                (user_id, case_id, answer, is_correct)
+                """INSERT INTO user_sent_bitmaps(user_id, bitmap, updated_at) VALUES (%s, %s, EXTRACT(EPOCH FROM NOW()))
+                   ON CONFLICT(user_id) DO UPDATE SET bitmap=EXCLUDED.bitmap, updated_at=EXCLUDED.updated_at""",
+                (user_id, blob)
             )
     else:
         conn.execute(
-            "INSERT INTO user_responses(user_id, case_id, answer, is_correct) VALUES (?,?,?,?)",
-            (user_id, case_id, answer, is_correct)
+            """INSERT INTO user_sent_bitmaps(user_id, bitmap, updated_at) VALUES (?,?,strftime('%s','now'))
+               ON CONFLICT(user_id) DO UPDATE SET bitmap=excluded.bitmap, updated_at=excluded.updated_at""",
+            (user_id, blob)
         )
-        conn.commit()
+
+def _get_user_sent_cases_bitmap(user_id: int) -> Set[str]:
+    with _get_conn() as conn:
+        seen = _load_sent_bytes(conn, user_id)
+    # Los casos borrados del catálogo no se devuelven
+    return {case_id for case_id in map(case_catalog.by_ordinal, bitmap.ordinals(seen)) if case_id}
+
+def _sample_unseen_case_ids_bitmap(user_id: int, count: int) -> Tuple[List[str], int]:
+    with _get_conn() as conn:
+        seen = _load_sent_bytes(conn, user_id)
+    chosen, available = case_catalog.sample_unseen(seen, count)
+    return [case_id for case_id in map(case_catalog.by_ordinal, chosen) if case_id], available
+
+def _save_user_sent_case_bitmap(user_id: int, case_id: str):
+    ordinal = case_catalog.ordinal(case_id)
+    if ordinal is None:
+        logger.warning(f"⚠️ Caso {case_id} sin ordinal, no se marca como enviado")
+        return
+    with _get_conn() as conn:
+        with _transaction(conn):
+            bits = _load_sent_bitmap(conn, user_id, for_update=True)
+            if not bitmap.contains(bits, ordinal):
+                _store_sent_bitmap(conn, user_id, bitmap.add(bits, ordinal))
+
+def migrate_sent_cases_to_bitmaps() -> int:
+    """Vuelca user_sent_cases a user_sent_bitmaps uniendo con lo ya migrado.
+    Idempotente; devuelve el número de usuarios migrados."""
+    query = """SELECT s.user_id, o.ordinal FROM user_sent_cases s
+               JOIN case_ordinals o ON o.case_id=s.case_id ORDER BY s.user_id"""
+    migrated = 0
+    
+    def flush(conn, user_id, bits):
+        _store_sent_bitmap(conn, user_id, _load_sent_bitmap(conn, user_id, for_update=True) | bits)
+    
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                rows_cur = conn.cursor(name="migrate_sent_cases")
+                rows_cur.itersize = 5000
+                rows_cur.execute(query)
+                rows = ((row['user_id'], row['ordinal']) for row in rows_cur)
+            else:
+                # Cursor independiente: las escrituras de flush usan conn.execute
+                rows_cur = conn.cursor()
+                rows = rows_cur.execute(query)
+            
+            current_user, bits = None, 0
+            for user_id, ordinal in rows:
+                if user_id != current_user:
+                    if current_user is not None:
+                        flush(conn, current_user, bits)
+                        migrated += 1
+                    current_user, bits = user_id, 0
+                bits = bitmap.add(bits, ordinal)
+            if current_user is not None:
+                flush(conn, current_user, bits)
+                migrated += 1
+            rows_cur.close()
+    
+    logger.info(f"🧮 Casos enviados migrados a bitmap: {migrated} usuarios")
+    return migrated
+
+_DECK_COLUMNS = ("seed", "deck_size", "deck_pos", "late_start", "late_end", "late_drawn", "deck_left", "late_left", "changes_seen")
+
+def _deck_row(row) -> dict:
+    deck = dict(row)
+    if deck["late_start"] is None:
+        # Mazos anteriores a los tramos barajados: los tardíos ya sacados salían en orden
+        deck["late_start"] = deck["deck_size"] + 1
+        deck["late_end"] = deck["deck_size"] + deck["late_drawn"]
+    return deck
+
+def get_user_deck(user_id: int) -> Optional[dict]:
+    """Mazo del usuario y, en "changes", las altas y bajas del catálogo (ordinal, delta)
+    posteriores a changes_seen; "last_change" es el último cambio registrado"""
+    query = f"SELECT {', '.join(_DECK_COLUMNS)} FROM user_decks WHERE user_id="
+    changes_query = "SELECT seq, ordinal, delta FROM catalog_changes WHERE seq>"
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(query + "%s", (user_id,))
+                row = cur.fetchone()
+                if not row:
+                    return None
+                deck = _deck_row(row)
+                cur.execute(changes_query + "%s ORDER BY seq", (deck["changes_seen"] or 0,))
+                changes = [(r['seq'], r['ordinal'], r['delta']) for r in cur.fetchall()]
+        else:
+            row = conn.execute(query + "?", (user_id,)).fetchone()
+            if not row:
+                return None
+            deck = _deck_row(zip(_DECK_COLUMNS, row))
+            changes = conn.execute(changes_query + "? ORDER BY seq", (deck["changes_seen"] or 0,)).fetchall()
+    deck["changes"] = [(ordinal, delta) for _, ordinal, delta in changes]
+    deck["last_change"] = changes[-1][0] if changes else deck["changes_seen"] or 0
+    return deck
+
+def get_last_catalog_change() -> int:
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COALESCE(MAX(seq), 0) AS seq FROM catalog_changes")
+                return cur.fetchone()['seq']
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM catalog_changes").fetchone()[0]
+
+def save_user_deck(user_id: int, deck: dict):
+    """Guarda las columnas de _DECK_COLUMNS de `deck`"""
+    columns = ", ".join(_DECK_COLUMNS)
+    values = (user_id,) + tuple(deck[column] for column in _DECK_COLUMNS)
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            updates = ", ".join(f"{column}=EXCLUDED.{column}" for column in _DECK_COLUMNS)
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""INSERT INTO user_decks(user_id, {columns}, updated_at)
+                        VALUES ({', '.join(['%s'] * len(values))}, EXTRACT(EPOCH FROM NOW()))
+                        ON CONFLICT(user_id) DO UPDATE SET {updates}, updated_at=EXCLUDED.updated_at""",
+                    values
+                )
+        else:
+            updates = ", ".join(f"{column}=excluded.{column}" for column in _DECK_COLUMNS)
+            conn.execute(
+                f"""INSERT INTO user_decks(user_id, {columns}, updated_at)
+                    VALUES ({', '.join('?' * len(values))}, strftime('%s','now'))
+                    ON CONFLICT(user_id) DO UPDATE SET {updates}, updated_at=excluded.updated_at""",
+                values
+            )
+            conn.commit()
+
+def load_session(user_id: int, max_age: int) -> Optional[str]:
+    min_ts = int(time.time()) - max_age
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT data FROM user_sessions WHERE user_id=%s AND updated_at>=%s", (user_id, min_ts))
+                row = cur.fetchone()
+                return row['data'] if row else None
+        else:
+            row = conn.execute("SELECT data FROM user_sessions WHERE user_id=? AND updated_at>=?", (user_id, min_ts)).fetchone()
+            return row[0] if row else None
+
+def save_sessions(items: List[Tuple[int, str]]):
+    """Upsert en lote de sesiones ya codificadas, en una sola transacción"""
+    now = int(time.time())
+    rows = [(user_id, data, now) for user_id, data in items]
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    cur.executemany(
+                        """INSERT INTO user_sessions(user_id, data, updated_at) VALUES (%s, %s, %s)
+                           ON CONFLICT(user_id) DO UPDATE SET data=EXCLUDED.data, updated_at=EXCLUDED.updated_at""",
+                        rows
+                    )
+            else:
+                conn.executemany(
+                    """INSERT INTO user_sessions(user_id, data, updated_at) VALUES (?,?,?)
+                       ON CONFLICT(user_id) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at""",
+                    rows
+                )
+
+def delete_sessions(user_ids: List[int]):
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM user_sessions WHERE user_id = ANY(%s)", (list(user_ids),))
+            else:
+                conn.executemany("DELETE FROM user_sessions WHERE user_id=?", [(uid,) for uid in user_ids])
+
+def purge_expired_sessions(max_age: int) -> int:
+    min_ts = int(time.time()) - max_age
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM user_sessions WHERE updated_at<%s", (min_ts,))
+                return cur.rowcount
+        else:
+            cur = conn.execute("DELETE FROM user_sessions WHERE updated_at<?", (min_ts,))
+            conn.commit()
+            return cur.rowcount
+
+def save_user_response(user_id: int, case_id: str, answer: str, is_correct: int):
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO user_responses(user_id, case_id, answer, is_correct) VALUES (%s, %s, %s, %s)",
+                    (user_id, case_id, answer, is_correct)
+                )
+        else:
+            conn.execute(
+                "INSERT INTO user_responses(user_id, case_id, answer, is_correct) VALUES (?,?,?,?)",
+                (user_id, case_id, answer, is_correct)
+            )
+            conn.commit()
 
 def increment_case_stat(case_id: str, answer: str):
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute(
-                """INSERT INTO case_stats(case_id, answer, count) VALUES (%s, %s, 1) 
-                   ON CONFLICT(case_id, answer) DO UPDATE SET count=case_stats.count+1""",
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """INSERT INTO case_stats(case_id, answer, count) VALUES (%s, %s, 1) 
+                       ON CONFLICT(case_id, answer) DO UPDATE SET count=case_stats.count+1""",
+                    (case_id, answer)
+                )
+        else:
+            conn.execute(
+                """INSERT INTO case_stats(case_id, answer, count) VALUES (?,?,1) 
+                   ON CONFLICT(case_id, answer) DO UPDATE SET count=count+1""",
                 (case_id, answer)
             )
-    else:
-        conn.execute(
-            """INSERT INTO case_stats(case_id, answer, count) VALUES (?,?,1) 
-               ON CONFLICT(case_id, answer) DO UPDATE SET count=count+1""",
-            (case_id, answer)
-        )
-        conn.commit()
+            conn.commit()
 
 def get_case_stats(case_id: str) -> dict:
-    conn = _get_conn()
+    with _get_conn() as conn:
+        stats = {"A": 0, "B": 0, "C": 0, "D": 0}
+    
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT answer, count FROM case_stats WHERE case_id=%s", (case_id,))
+                for row in cur.fetchall():
+                    stats[row['answer']] = row['count']
+        else:
+            cur = conn.execute("SELECT answer, count FROM case_stats WHERE case_id=?", (case_id,))
+            for answer, count in cur.fetchall():
+                stats[answer] = count
+    
+        return stats
+
+def record_answer(user_id: int, case_id: str, answer: str, is_correct: int, update_case_stats: bool = True) -> Optional[dict]:
+    """Registra una respuesta (user_responses, case_stats, users) y devuelve
+    las estadísticas del caso ya actualizadas, todo en una transacción.
+    Con update_case_stats=False no toca case_stats y devuelve None."""
+    if not update_case_stats:
+        return _record_answer_without_stats(user_id, case_id, answer, is_correct)
+    
     stats = {"A": 0, "B": 0, "C": 0, "D": 0}
     
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("SELECT answer, count FROM case_stats WHERE case_id=%s", (case_id,))
-            for row in cur.fetchall():
-                stats[row['answer']] = row['count']
-    else:
-        cur = conn.execute("SELECT answer, count FROM case_stats WHERE case_id=?", (case_id,))
-        for answer, count in cur.fetchall():
-            stats[answer] = count
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            # Un solo viaje: CTE que escribe las tres tablas y devuelve el reparto
+            with conn.cursor() as cur:
+                cur.execute(
+                    """WITH resp AS (
+                         INSERT INTO user_responses(user_id, case_id, answer, is_correct)
+                         VALUES (%(user_id)s, %(case_id)s, %(answer)s, %(is_correct)s)
+                       ), stat AS (
+                         INSERT INTO case_stats(case_id, answer, count) VALUES (%(case_id)s, %(answer)s, 1)
+                         ON CONFLICT(case_id, answer) DO UPDATE SET count=case_stats.count+1
+                         RETURNING answer, count
+                       ), usr AS (
+                         UPDATE users SET total_cases=total_cases+1, correct_answers=correct_answers+%(is_correct)s
+                         WHERE user_id=%(user_id)s
+                       )
+                       SELECT answer, count FROM case_stats WHERE case_id=%(case_id)s AND answer<>%(answer)s
+                       UNION ALL
+                       SELECT answer, count FROM stat""",
+                    {"user_id": user_id, "case_id": case_id, "answer": answer, "is_correct": is_correct}
+                )
+                for row in cur.fetchall():
+                    stats[row['answer']] = row['count']
+        else:
+            with _transaction(conn):
+                conn.execute(
+                    "INSERT INTO user_responses(user_id, case_id, answer, is_correct) VALUES (?,?,?,?)",
+                    (user_id, case_id, answer, is_correct)
+                )
+                conn.execute(
+                    """INSERT INTO case_stats(case_id, answer, count) VALUES (?,?,1) 
+                       ON CONFLICT(case_id, answer) DO UPDATE SET count=count+1""",
+                    (case_id, answer)
+                )
+                conn.execute(
+                    "UPDATE users SET total_cases=total_cases+1, correct_answers=correct_answers+? WHERE user_id=?",
+                    (is_correct, user_id)
+                )
+                cur = conn.execute("SELECT answer, count FROM case_stats WHERE case_id=?", (case_id,))
+                for row_answer, count in cur.fetchall():
+                    stats[row_answer] = count
     
     return stats
 
+def _record_answer_without_stats(user_id: int, case_id: str, answer: str, is_correct: int):
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """WITH resp AS (
+                         INSERT INTO user_responses(user_id, case_id, answer, is_correct)
+                         VALUES (%(user_id)s, %(case_id)s, %(answer)s, %(is_correct)s)
+                       )
+                       UPDATE users SET total_cases=total_cases+1, correct_answers=correct_answers+%(is_correct)s
+                       WHERE user_id=%(user_id)s""",
+                    {"user_id": user_id, "case_id": case_id, "answer": answer, "is_correct": is_correct}
+                )
+        else:
+            with _transaction(conn):
+                conn.execute(
+                    "INSERT INTO user_responses(user_id, case_id, answer, is_correct) VALUES (?,?,?,?)",
+                    (user_id, case_id, answer, is_correct)
+                )
+                conn.execute(
+                    "UPDATE users SET total_cases=total_cases+1, correct_answers=correct_answers+? WHERE user_id=?",
+                    (is_correct, user_id)
+                )
+    return None
+
+def add_case_stats(increments: List[Tuple[str, str, int]]):
+    """Suma en lote incrementos (case_id, answer, delta) a case_stats en una transacción"""
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    cur.executemany(
+                        """INSERT INTO case_stats(case_id, answer, count) VALUES (%s, %s, %s)
+                           ON CONFLICT(case_id, answer) DO UPDATE SET count=case_stats.count+EXCLUDED.count""",
+                        increments
+                    )
+            else:
+                conn.executemany(
+                    """INSERT INTO case_stats(case_id, answer, count) VALUES (?,?,?)
+                       ON CONFLICT(case_id, answer) DO UPDATE SET count=count+excluded.count""",
+                    increments
+                )
+
 def get_or_create_user(user_id: int, username: str = "", first_name: str = "") -> dict:
-    conn = _get_conn()
+    with _get_conn() as conn:
     
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT user_id, username, first_name, is_subscriber, daily_limit, total_cases, correct_answers FROM users WHERE user_id=%s",
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT user_id, username, first_name, is_subscriber, daily_limit, total_cases, correct_answers FROM users WHERE user_id=%s",
+                    (user_id,)
+                )
+                row = cur.fetchone()
+                if row:
+                    return dict(row)
+            
+                cur.execute(
+                    "INSERT INTO users(user_id, username, first_name) VALUES (%s, %s, %s)",
+                    (user_id, username, first_name)
+                )
+        else:
+            cur = conn.execute(
+                "SELECT user_id, username, first_name, is_subscriber, daily_limit, total_cases, correct_answers FROM users WHERE user_id=?",
                 (user_id,)
             )
             row = cur.fetchone()
             if row:
-                return dict(row)
-            
-            cur.execute(
-                "INSERT INTO users(user_id, username, first_name) VALUES (%s, %s, %s)",
-                (user_id, username, first_name)
-            )
-    else:
-        cur = conn.execute(
-            "SELECT user_id, username, first_name, is_subscriber, daily_limit, total_cases, correct_answers FROM users WHERE user_id=?",
-            (user_id,)
-        )
-        row = cur.fetchone()
-        if row:
-            return {
-                "user_id": row[0], "username": row[1], "first_name": row[2],
-                "is_subscriber": row[3], "daily_limit": row[4],
-                "total_cases": row[5], "correct_answers": row[6]
-            }
+                return {
+                    "user_id": row[0], "username": row[1], "first_name": row[2],
+                    "is_subscriber": row[3], "daily_limit": row[4],
+                    "total_cases": row[5], "correct_answers": row[6]
+                }
         
-        conn.execute("INSERT INTO users(user_id, username, first_name) VALUES (?,?,?)", (user_id, username, first_name))
-        conn.commit()
+            conn.execute("INSERT INTO users(user_id, username, first_name) VALUES (?,?,?)", (user_id, username, first_name))
+            conn.commit()
     
-    return {
-        "user_id": user_id, "username": username, "first_name": first_name,
-        "is_subscriber": 0, "daily_limit": 5, "total_cases": 0, "correct_answers": 0
-    }
+        return {
+            "user_id": user_id, "username": username, "first_name": first_name,
+            "is_subscriber": 0, "daily_limit": 5, "total_cases": 0, "correct_answers": 0
+        }
 
 def get_daily_progress(user_id: int) -> int:
     today = datetime.now(tz=TZ).strftime("%Y-%m-%d")
-    conn = _get_conn()
+    with _get_conn() as conn:
     
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("SELECT cases_solved FROM daily_progress WHERE user_id=%s AND date=%s", (user_id, today))
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT cases_solved FROM daily_progress WHERE user_id=%s AND date=%s", (user_id, today))
+                row = cur.fetchone()
+                return row['cases_solved'] if row else 0
+        else:
+            cur = conn.execute("SELECT cases_solved FROM daily_progress WHERE user_id=? AND date=?", (user_id, today))
             row = cur.fetchone()
-            return row['cases_solved'] if row else 0
-    else:
-        cur = conn.execute("SELECT cases_solved FROM daily_progress WHERE user_id=? AND date=?", (user_id, today))
-        row = cur.fetchone()
-        return row[0] if row else 0
+            return row[0] if row else 0
 
 def increment_daily_progress(user_id: int):
     today = datetime.now(tz=TZ).strftime("%Y-%m-%d")
-    conn = _get_conn()
+    with _get_conn() as conn:
     
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute(
-                """INSERT INTO daily_progress(user_id, date, cases_solved) VALUES (%s, %s, 1) 
-                   ON CONFLICT(user_id, date) DO UPDATE SET cases_solved=daily_progress.cases_solved+1""",
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """INSERT INTO daily_progress(user_id, date, cases_solved) VALUES (%s, %s, 1) 
+                       ON CONFLICT(user_id, date) DO UPDATE SET cases_solved=daily_progress.cases_solved+1""",
+                    (user_id, today)
+                )
+        else:
+            conn.execute(
+                """INSERT INTO daily_progress(user_id, date, cases_solved) VALUES (?,?,1) 
+                   ON CONFLICT(user_id, date) DO UPDATE SET cases_solved=cases_solved+1""",
                 (user_id, today)
             )
-    else:
-        conn.execute(
-            """INSERT INTO daily_progress(user_id, date, cases_solved) VALUES (?,?,1) 
-               ON CONFLICT(user_id, date) DO UPDATE SET cases_solved=cases_solved+1""",
-            (user_id, today)
-        )
-        conn.commit()
+            conn.commit()
 
 def set_user_limit(user_id: int, limit: int):
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("UPDATE users SET daily_limit=%s WHERE user_id=%s", (limit, user_id))
-    else:
-        conn.execute("UPDATE users SET daily_limit=? WHERE user_id=?", (limit, user_id))
-        conn.commit()
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE users SET daily_limit=%s WHERE user_id=%s", (limit, user_id))
+        else:
+            conn.execute("UPDATE users SET daily_limit=? WHERE user_id=?", (limit, user_id))
+            conn.commit()
 
 def set_user_subscriber(user_id: int, is_sub: int):
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
-            cur.execute("UPDATE users SET is_subscriber=%s WHERE user_id=%s", (is_sub, user_id))
-    else:
-        conn.execute("UPDATE users SET is_subscriber=? WHERE user_id=?", (is_sub, user_id))
-        conn.commit()
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE users SET is_subscriber=%s WHERE user_id=%s", (is_sub, user_id))
+        else:
+            conn.execute("UPDATE users SET is_subscriber=? WHERE user_id=?", (is_sub, user_id))
+            conn.commit()
 
 def update_user_stats(user_id: int, is_correct: int):
-    conn = _get_conn()
-    if USE_POSTGRES:
-        with conn.cursor() as cur:
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                if is_correct:
+                    cur.execute("UPDATE users SET total_cases=total_cases+1, correct_answers=correct_answers+1 WHERE user_id=%s", (user_id,))
+                else:
+                    cur.execute("UPDATE users SET total_cases=total_cases+1 WHERE user_id=%s", (user_id,))
+        else:
             if is_correct:
-                cur.execute("UPDATE users SET total_cases=total_cases+1, correct_answers=correct_answers+1 WHERE user_id=%s", (user_id,))
+                conn.execute("UPDATE users SET total_cases=total_cases+1, correct_answers=correct_answers+1 WHERE user_id=?", (user_id,))
             else:
-                cur.execute("UPDATE users SET total_cases=total_cases+1 WHERE user_id=%s", (user_id,))
-    else:
-        if is_correct:
-            conn.execute("UPDATE users SET total_cases=total_cases+1, correct_answers=correct_answers+1 WHERE user_id=?", (user_id,))
+                conn.execute("UPDATE users SET total_cases=total_cases+1 WHERE user_id=?", (user_id,))
+            conn.commit()
+
+def get_all_users() -> List[int]:
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT user_id FROM users")
+                return [row['user_id'] for row in cur.fetchall()]
+        else:
+            cur = conn.execute("SELECT user_id FROM users")
+            return [row[0] for row in cur.fetchall()]
+
+def get_subscribers() -> List[int]:
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT user_id FROM users WHERE is_subscriber=1")
+                return [row['user_id'] for row in cur.fetchall()]
+        else:
+            cur = conn.execute("SELECT user_id FROM users WHERE is_subscriber=1")
+            return [row[0] for row in cur.fetchall()]
+
+def count_cases() -> int:
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) as cnt FROM clinical_cases")
+                return cur.fetchone()['cnt']
         else:
-            conn.execute("UPDATE users SET total_cases=total_cases+1 WHERE user_id=?", (user_id,))
+            cur = conn.execute("SELECT COUNT(*) FROM clinical_cases")
+            return cur.fetchone()[0]
+
+_admin_stats_queries = {
+    "users": "SELECT COUNT(*) AS total, COALESCE(SUM(is_subscriber), 0) AS subscribers FROM users",
+    "cases": "SELECT COALESCE(NULLIF(specialty, ''), '-') AS specialty, COUNT(*) AS n FROM clinical_cases GROUP BY 1 ORDER BY 2 DESC",
+    "today": """SELECT COUNT(*) AS answers, COUNT(DISTINCT user_id) AS active, COALESCE(SUM(is_correct), 0) AS correct
+                FROM user_responses WHERE timestamp >= {p}""",
+    "week": "SELECT COUNT(*) AS answers, COUNT(DISTINCT user_id) AS active FROM user_responses WHERE timestamp >= {p}",
+}
+
+def get_admin_stats(day_start: int, week_start: int) -> dict:
+    """Agregados para el panel de admin: solo COUNT/SUM/GROUP BY, nada de listas de ids"""
+    q = _admin_stats_queries
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(q["users"])
+                users = cur.fetchone()
+                users_total, subscribers = users['total'], users['subscribers']
+                cur.execute(q["cases"])
+                by_specialty = [(row['specialty'], row['n']) for row in cur.fetchall()]
+                cur.execute(q["today"].format(p="%s"), (day_start,))
+                today = cur.fetchone()
+                answers_today, active_today, correct_today = today['answers'], today['active'], today['correct']
+                cur.execute(q["week"].format(p="%s"), (week_start,))
+                week = cur.fetchone()
+                answers_week, active_week = week['answers'], week['active']
+        else:
+            users_total, subscribers = conn.execute(q["users"]).fetchone()
+            by_specialty = conn.execute(q["cases"]).fetchall()
+            answers_today, active_today, correct_today = conn.execute(q["today"].format(p="?"), (day_start,)).fetchone()
+            answers_week, active_week = conn.execute(q["week"].format(p="?"), (week_start,)).fetchone()
+    
+    return {
+        "users": users_total,
+        "subscribers": int(subscribers),
+        "cases": sum(n for _, n in by_specialty),
+        "cases_by_specialty": [(specialty, n) for specialty, n in by_specialty],
+        "answers_today": answers_today,
+        "active_today": active_today,
+        "correct_today": int(correct_today),
+        "answers_week": answers_week,
+        "active_week": active_week,
+    }
+
+# ====== Análisis de casos ======
+
+def get_responses_after(after_id: int, limit: int) -> List[tuple]:
+    """Bloque de user_responses por id creciente: (id, user_id, case_id, answer, is_correct)"""
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            # Cursor de tuplas: evita construir un dict por fila en bloques grandes
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(
+                    "SELECT id, user_id, case_id, answer, is_correct FROM user_responses WHERE id > %s ORDER BY id LIMIT %s",
+                    (after_id, limit)
+                )
+                return cur.fetchall()
+        return conn.execute(
+            "SELECT id, user_id, case_id, answer, is_correct FROM user_responses WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit)
+        ).fetchall()
+
+def get_correct_answers() -> Dict[str, str]:
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT case_id, correct_answer FROM clinical_cases")
+                return {row['case_id']: row['correct_answer'] for row in cur.fetchall()}
+        return dict(conn.execute("SELECT case_id, correct_answer FROM clinical_cases").fetchall())
+
+_watermark_upsert = """INSERT INTO analytics_state(name, value, updated_at) VALUES ('watermark', {p}, {p})
+ON CONFLICT(name) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at"""
+
+def save_analytics(case_rows: List[tuple], specialty_rows: List[tuple], watermark: Optional[int] = None):
+    """Reemplaza las tablas de resumen en una transacción.
+    case_rows: (case_id, responses, p_value, discrimination, distractor_efficiency, a, b, c, d)
+    specialty_rows: (specialty, topic, responses, correct)
+    watermark: último id de user_responses leído por el análisis del bot (lo usa maintenance.py)"""
+    now = int(time.time())
+    case_rows = [row + (now,) for row in case_rows]
+    specialty_rows = [row + (now,) for row in specialty_rows]
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM case_analytics")
+                    cur.execute("DELETE FROM specialty_analytics")
+                    psycopg2.extras.execute_values(
+                        cur,
+                        """INSERT INTO case_analytics(case_id, responses, p_value, discrimination, distractor_efficiency,
+                           answers_a, answers_b, answers_c, answers_d, updated_at) VALUES %s""",
+                        case_rows, page_size=1000
+                    )
+                    psycopg2.extras.execute_values(
+                        cur,
+                        "INSERT INTO specialty_analytics(specialty, topic, responses, correct, updated_at) VALUES %s",
+                        specialty_rows, page_size=1000
+                    )
+                    if watermark is not None:
+                        cur.execute(_watermark_upsert.format(p="%s"), (watermark, now))
+            else:
+                conn.execute("DELETE FROM case_analytics")
+                conn.execute("DELETE FROM specialty_analytics")
+                conn.executemany(
+                    """INSERT INTO case_analytics(case_id, responses, p_value, discrimination, distractor_efficiency,
+                       answers_a, answers_b, answers_c, answers_d, updated_at) VALUES (?,?,?,?,?,?,?,?,?,?)""",
+                    case_rows
+                )
+                conn.executemany(
+                    "INSERT INTO specialty_analytics(specialty, topic, responses, correct, updated_at) VALUES (?,?,?,?,?)",
+                    specialty_rows
+                )
+                if watermark is not None:
+                    conn.execute(_watermark_upsert.format(p="?"), (watermark, now))
+
+def get_analytics_watermark() -> Optional[int]:
+    """Marca de agua guardada por el último análisis del bot, o None si nunca corrió"""
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT value FROM analytics_state WHERE name='watermark'")
+                row = cur.fetchone()
+                return row['value'] if row else None
+        row = conn.execute("SELECT value FROM analytics_state WHERE name='watermark'").fetchone()
+        return row[0] if row else None
+
+def get_case_analytics(order_by: str, limit: int, min_responses: int) -> List[dict]:
+    """Casos del resumen ordenados por 'p_value' (más difíciles primero) o 'discrimination' (peor primero)"""
+    if order_by not in ("p_value", "discrimination"):
+        raise ValueError(order_by)
+    query = f"""SELECT case_id, responses, p_value, discrimination, distractor_efficiency FROM case_analytics
+                WHERE responses >= {{p}} AND {order_by} IS NOT NULL ORDER BY {order_by} LIMIT {{p}}"""
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(query.format(p="%s"), (min_responses, limit))
+                return [dict(row) for row in cur.fetchall()]
+        cur = conn.execute(query.format(p="?"), (min_responses, limit))
+        columns = [col[0] for col in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+def get_specialty_analytics() -> List[tuple]:
+    """(especialidad, tema, respuestas, correctas)"""
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT specialty, topic, responses, correct FROM specialty_analytics ORDER BY specialty, topic")
+                return [(row['specialty'], row['topic'], row['responses'], row['correct']) for row in cur.fetchall()]
+        return conn.execute("SELECT specialty, topic, responses, correct FROM specialty_analytics ORDER BY specialty, topic").fetchall()
+
+# ====== Retención ======
+
+def get_responses_before(cutoff: int, after_id: int, max_id: Optional[int], limit: int) -> List[tuple]:
+    """Bloque de respuestas más antiguas que `cutoff` con after_id < id <= max_id, por id creciente:
+    (id, user_id, case_id, answer, is_correct, timestamp)"""
+    query = """SELECT id, user_id, case_id, answer, is_correct, timestamp FROM user_responses
+               WHERE id > {p} AND id <= {p} AND timestamp < {p} ORDER BY id LIMIT {p}"""
+    params = (after_id, max_id if max_id is not None else (1 << 62), cutoff, limit)
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(query.format(p="%s"), params)
+                return cur.fetchall()
+        return conn.execute(query.format(p="?"), params).fetchall()
+
+_rollup_upsert = """INSERT INTO response_rollups(user_id, case_id, day, responses, correct, answers_a, answers_b, answers_c, answers_d)
+VALUES {values}
+ON CONFLICT (user_id, case_id, day) DO UPDATE SET
+responses=response_rollups.responses+excluded.responses,
+correct=response_rollups.correct+excluded.correct,
+answers_a=response_rollups.answers_a+excluded.answers_a,
+answers_b=response_rollups.answers_b+excluded.answers_b,
+answers_c=response_rollups.answers_c+excluded.answers_c,
+answers_d=response_rollups.answers_d+excluded.answers_d"""
+
+def apply_response_rollup(rollup_rows: List[tuple], first_id: int, last_id: int, cutoff: int) -> int:
+    """Suma el bloque agregado a response_rollups y borra esas respuestas, en una transacción.
+    rollup_rows: (user_id, case_id, day, responses, correct, a, b, c, d)"""
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    psycopg2.extras.execute_values(cur, _rollup_upsert.format(values="%s"), rollup_rows, page_size=1000)
+                    cur.execute(
+                        "DELETE FROM user_responses WHERE id BETWEEN %s AND %s AND timestamp < %s",
+                        (first_id, last_id, cutoff)
+                    )
+                    return cur.rowcount
+            conn.executemany(_rollup_upsert.format(values="(?,?,?,?,?,?,?,?,?)"), rollup_rows)
+            cur = conn.execute(
+                "DELETE FROM user_responses WHERE id BETWEEN ? AND ? AND timestamp < ?", (first_id, last_id, cutoff)
+            )
+            return cur.rowcount
+
+def purge_daily_progress(before_date: str, limit: int) -> int:
+    """Borra hasta `limit` filas de daily_progress anteriores a `before_date` (YYYY-MM-DD)"""
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """DELETE FROM daily_progress WHERE ctid IN
+                       (SELECT ctid FROM daily_progress WHERE date < %s LIMIT %s)""",
+                    (before_date, limit)
+                )
+                return cur.rowcount
+        cur = conn.execute(
+            "DELETE FROM daily_progress WHERE rowid IN (SELECT rowid FROM daily_progress WHERE date < ? LIMIT ?)",
+            (before_date, limit)
+        )
         conn.commit()
+        return cur.rowcount
 
-def get_all_users() -> List[int]:
-    conn = _get_conn()
-    if USE_POSTGRES:
+def get_response_rollups_after(after: Optional[tuple], limit: int) -> List[tuple]:
+    """Bloque de response_rollups por clave (user_id, case_id, day) creciente:
+    (user_id, case_id, day, responses, correct, a, b, c, d)"""
+    where = "WHERE (user_id, case_id, day) > ({p}, {p}, {p})" if after else ""
+    query = f"""SELECT user_id, case_id, day, responses, correct, answers_a, answers_b, answers_c, answers_d
+                FROM response_rollups {where} ORDER BY user_id, case_id, day LIMIT {{p}}"""
+    params = tuple(after or ()) + (limit,)
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(query.format(p="%s"), params)
+                return cur.fetchall()
+        return conn.execute(query.format(p="?"), params).fetchall()
+
+# ====== Difusiones ======
+
+_BROADCAST_COLUMNS = (
+    "id, created_by, audience, file_type, file_id, text, status, total, "
+    "claimed_user_id, done_user_id, sent, failed, blocked, created_at, finished_at"
+)
+
+_recipients_sql = """SELECT user_id FROM users u
+WHERE user_id > {p} {audience}
+AND NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.user_id=u.user_id)
+ORDER BY user_id LIMIT {p}"""
+
+_count_recipients_sql = """SELECT COUNT(*) AS n FROM users u
+WHERE TRUE {audience}
+AND NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.user_id=u.user_id)"""
+
+def _audience_filter(audience: str) -> str:
+    if audience not in ("all", "subscribers"):
+        raise ValueError(audience)
+    return "AND is_subscriber=1" if audience == "subscribers" else ""
+
+def create_broadcast(created_by: int, audience: str, file_type: str, file_id: Optional[str], text: Optional[str]) -> int:
+    count_sql = _count_recipients_sql.format(audience=_audience_filter(audience))
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(count_sql)
+                total = cur.fetchone()['n']
+                cur.execute(
+                    """INSERT INTO broadcasts(created_by, audience, file_type, file_id, text, total)
+                       VALUES (%s, %s, %s, %s, %s, %s) RETURNING id""",
+                    (created_by, audience, file_type, file_id, text, total)
+                )
+                return cur.fetchone()['id']
+        total = conn.execute(count_sql).fetchone()[0]
+        cur = conn.execute(
+            "INSERT INTO broadcasts(created_by, audience, file_type, file_id, text, total) VALUES (?, ?, ?, ?, ?, ?)",
+            (created_by, audience, file_type, file_id, text, total)
+        )
+        conn.commit()
+        return cur.lastrowid
+
+def _broadcast_rows(query: str, params: tuple) -> List[dict]:
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(query.format(p="%s"), params)
+                return [dict(row) for row in cur.fetchall()]
+        cur = conn.execute(query.format(p="?"), params)
+        columns = [col[0] for col in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+def get_broadcast(broadcast_id: int) -> Optional[dict]:
+    rows = _broadcast_rows(f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts WHERE id={{p}}", (broadcast_id,))
+    return rows[0] if rows else None
+
+def get_latest_broadcast() -> Optional[dict]:
+    rows = _broadcast_rows(f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts ORDER BY id DESC LIMIT 1", ())
+    return rows[0] if rows else None
+
+def get_running_broadcasts() -> List[dict]:
+    return _broadcast_rows(f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts WHERE status='running' ORDER BY id", ())
+
+def get_broadcast_recipients(audience: str, after_user_id: int, limit: int) -> List[int]:
+    """Siguiente bloque de destinatarios por user_id creciente (recorre el índice de la PK, sin OFFSET)"""
+    query = _recipients_sql.format(p="%s" if USE_POSTGRES else "?", audience=_audience_filter(audience))
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(query, (after_user_id, limit))
+                return [row[0] for row in cur.fetchall()]
+        return [row[0] for row in conn.execute(query, (after_user_id, limit)).fetchall()]
+
+def claim_broadcast_page(broadcast_id: int, last_user_id: int):
+    """Se guarda ANTES de enviar el bloque: al reanudar no se repite nada de él"""
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE broadcasts SET claimed_user_id=%s WHERE id=%s", (last_user_id, broadcast_id))
+        else:
+            conn.execute("UPDATE broadcasts SET claimed_user_id=? WHERE id=?", (last_user_id, broadcast_id))
+            conn.commit()
+
+def finish_broadcast_page(broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked_ids: List[int]) -> str:
+    """Cierra un bloque: contadores, marca de bloque terminado y usuarios que bloquearon el bot.
+    Devuelve el estado actual de la difusión (para detectar una cancelación)."""
+    blocked_rows = [(user_id,) for user_id in blocked_ids]
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    if blocked_rows:
+                        psycopg2.extras.execute_values(
+                            cur, "INSERT INTO blocked_users(user_id) VALUES %s ON CONFLICT (user_id) DO NOTHING", blocked_rows
+                        )
+                    cur.execute(
+                        """UPDATE broadcasts SET done_user_id=%s, sent=sent+%s, failed=failed+%s, blocked=blocked+%s
+                           WHERE id=%s RETURNING status""",
+                        (last_user_id, sent, failed, len(blocked_ids), broadcast_id)
+                    )
+                    return cur.fetchone()['status']
+            conn.executemany("INSERT OR IGNORE INTO blocked_users(user_id) VALUES (?)", blocked_rows)
+            conn.execute(
+                "UPDATE broadcasts SET done_user_id=?, sent=sent+?, failed=failed+?, blocked=blocked+? WHERE id=?",
+                (last_user_id, sent, failed, len(blocked_ids), broadcast_id)
+            )
+            return conn.execute("SELECT status FROM broadcasts WHERE id=?", (broadcast_id,)).fetchone()[0]
+
+def set_broadcast_status(broadcast_id: int, status: str):
+    finished_at = None if status == "running" else int(time.time())
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE broadcasts SET status=%s, finished_at=%s WHERE id=%s", (status, finished_at, broadcast_id)
+                )
+        else:
+            conn.execute("UPDATE broadcasts SET status=?, finished_at=? WHERE id=?", (status, finished_at, broadcast_id))
+            conn.commit()
+
+def unblock_user(user_id: int):
+    """El usuario volvió a escribir al bot: vuelve a recibir difusiones"""
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM blocked_users WHERE user_id=%s", (user_id,))
+        else:
+            conn.execute("DELETE FROM blocked_users WHERE user_id=?", (user_id,))
+            conn.commit()
+
+# ====== Copia de seguridad ======
+
+BACKUP_TABLES = [
+    "clinical_cases", "case_ordinals", "justifications", "users", "user_responses",
+    "user_sent_cases", "user_sent_bitmaps", "user_decks", "user_sessions", "case_stats", "daily_progress",
+    "blocked_users", "broadcasts", "response_rollups", "catalog_changes"
+]
+# Columnas autoincrementales: tras restaurar, la secuencia debe seguir al máximo
+_SERIAL_COLUMNS = {"case_ordinals": "ordinal", "justifications": "id", "user_responses": "id", "broadcasts": "id", "catalog_changes": "seq"}
+_BINARY_COLUMNS = {("user_sent_bitmaps", "bitmap")}
+
+def _backup_value(table: str, column: str, value):
+    if (table, column) in _BINARY_COLUMNS and value is not None:
+        return base64.b64encode(bytes(value)).decode("ascii")
+    return value
+
+def iter_table_chunks(tables: List[str], chunk_size: int = 5000):
+    """Genera (tabla, columnas, filas) leyendo en bloques con cursor de servidor.
+    En PostgreSQL todas las tablas salen de la misma instantánea."""
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                with conn.cursor() as cur:
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            else:
+                conn.execute("BEGIN")
+            for table in tables:
+                if USE_POSTGRES:
+                    cur = conn.cursor(name=f"backup_{table}")
+                    cur.itersize = chunk_size
+                else:
+                    cur = conn.cursor()
+                cur.execute(f"SELECT * FROM {table}")
+                columns = None
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if columns is None:
+                        # Un cursor con nombre solo describe las columnas tras el primer fetch
+                        columns = [col[0] for col in cur.description]
+                    if not rows:
+                        break
+                    if USE_POSTGRES:
+                        rows = [[row[col] for col in columns] for row in rows]
+                    yield table, columns, [
+                        {col: _backup_value(table, col, value) for col, value in zip(columns, row)}
+                        for row in rows
+                    ]
+                cur.close()
+
+def table_columns(table: str) -> List[str]:
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT * FROM {table} LIMIT 0")
+                return [col[0] for col in cur.description]
+        cur = conn.execute(f"SELECT * FROM {table} LIMIT 0")
+        return [col[0] for col in cur.description]
+
+def restore_rows(table: str, columns: List[str], rows: List[dict]) -> int:
+    """Inserta un bloque de filas; las que ya existen (misma clave) se omiten"""
+    values = []
+    for row in rows:
+        item = []
+        for col in columns:
+            value = row.get(col)
+            if (table, col) in _BINARY_COLUMNS and value is not None:
+                value = base64.b64decode(value)
+                value = psycopg2.Binary(value) if USE_POSTGRES else value
+            item.append(value)
+        values.append(tuple(item))
+    column_list = ", ".join(columns)
+    
+    with _get_conn() as conn:
+        with _transaction(conn):
+            if USE_POSTGRES:
+                inserted = 0
+                with conn.cursor() as cur:
+                    # rowcount de execute_values solo refleja la última página: paginar a mano
+                    for i in range(0, len(values), 1000):
+                        psycopg2.extras.execute_values(
+                            cur,
+                            f"INSERT INTO {table}({column_list}) VALUES %s ON CONFLICT DO NOTHING",
+                            values[i:i + 1000], page_size=1000
+                        )
+                        inserted += cur.rowcount
+                return inserted
+            before = conn.total_changes
+            placeholders = ",".join("?" * len(columns))
+            conn.executemany(f"INSERT OR IGNORE INTO {table}({column_list}) VALUES ({placeholders})", values)
+            return conn.total_changes - before
+
+def reset_sequences():
+    """Tras una restauración con ids explícitos, alinea las secuencias SERIAL de PostgreSQL"""
+    if not USE_POSTGRES:
+        return  # AUTOINCREMENT de SQLite ya sigue al mayor id insertado
+    with _get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT user_id FROM users")
-            return [row['user_id'] for row in cur.fetchall()]
-    else:
-        cur = conn.execute("SELECT user_id FROM users")
-        return [row[0] for row in cur.fetchall()]
+            for table, column in _SERIAL_COLUMNS.items():
+                cur.execute(
+                    f"""SELECT setval(pg_get_serial_sequence('{table}', '{column}'),
+                                      COALESCE(MAX({column}), 1), MAX({column}) IS NOT NULL) FROM {table}"""
+                )
 
-def get_subscribers() -> List[int]:
-    conn = _get_conn()
-    if USE_POSTGRES:
+# ====== Migración SQLite → PostgreSQL ======
+
+def _copy_text_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def migration_progress() -> Dict[str, dict]:
+    """Progreso guardado de la migración: tabla -> {last_rowid, rows, done}"""
+    with _get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT user_id FROM users WHERE is_subscriber=1")
-            return [row['user_id'] for row in cur.fetchall()]
-    else:
-        cur = conn.execute("SELECT user_id FROM users WHERE is_subscriber=1")
-        return [row[0] for row in cur.fetchall()]
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS sqlite_migration (
+                     table_name TEXT PRIMARY KEY,
+                     last_rowid BIGINT NOT NULL DEFAULT 0,
+                     rows_copied BIGINT NOT NULL DEFAULT 0,
+                     done BOOLEAN NOT NULL DEFAULT FALSE
+                   )"""
+            )
+            cur.execute("SELECT table_name, last_rowid, rows_copied, done FROM sqlite_migration")
+            return {
+                row['table_name']: {"last_rowid": row['last_rowid'], "rows": row['rows_copied'], "done": row['done']}
+                for row in cur.fetchall()
+            }
 
-def count_cases() -> int:
-    conn = _get_conn()
-    if USE_POSTGRES:
+def copy_migration_chunk(table: str, columns: List[str], rows: List[tuple], last_rowid: int):
+    """COPY de un bloque y avance del progreso en la misma transacción:
+    si el proceso se corta, el bloque entra entero o no entra"""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_text_value(value) for value in row))
+        buf.write("\n")
+    buf.seek(0)
+    with _get_conn() as conn:
+        with _transaction(conn):
+            with conn.cursor() as cur:
+                cur.copy_expert(f"COPY {table}({', '.join(columns)}) FROM STDIN", buf)
+                cur.execute(
+                    """INSERT INTO sqlite_migration(table_name, last_rowid, rows_copied) VALUES (%s, %s, %s)
+                       ON CONFLICT(table_name) DO UPDATE SET
+                       last_rowid=EXCLUDED.last_rowid,
+                       rows_copied=sqlite_migration.rows_copied+EXCLUDED.rows_copied""",
+                    (table, last_rowid, len(rows))
+                )
+
+def finish_migration_table(table: str):
+    with _get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) as cnt FROM clinical_cases")
-            return cur.fetchone()['cnt']
-    else:
-        cur = conn.execute("SELECT COUNT(*) FROM clinical_cases")
-        return cur.fetchone()[0]
+            cur.execute(
+                """INSERT INTO sqlite_migration(table_name, done) VALUES (%s, TRUE)
+                   ON CONFLICT(table_name) DO UPDATE SET done=TRUE""",
+                (table,)
+            )
+
+def count_rows(table: str) -> int:
+    with _get_conn() as conn:
+        if USE_POSTGRES:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT COUNT(*) AS n FROM {table}")
+                return cur.fetchone()['n']
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
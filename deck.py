@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Mazo barajado por usuario
+Cada usuario guarda solo (semilla, tamaño, cursores y casos vivos por
+sacar): la permutación se recalcula al vuelo, así que sacar N casos cuesta
+O(N) y rebarajar es reiniciar el cursor. Los borrados se descuentan una
+vez, al leer el mazo tras el borrado (catalog_changes), no en cada sorteo.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+from typing import List, Optional, Tuple
+
+from catalog import case_catalog
+from storage import (
+    get_user_deck, get_last_catalog_change, save_user_deck, filter_sent_cases, reset_user_sent_cases
+)
+
+logger = logging.getLogger(__name__)
+
+FEISTEL_ROUNDS = 4
+
+def _round(value: int, seed: int, rnd: int, bits: int) -> int:
+    digest = hashlib.blake2b(f"{seed}:{rnd}:{value}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") & ((1 << bits) - 1)
+
+def _half(size: int) -> int:
+    return max(1, ((size - 1).bit_length() + 1) // 2)
+
+def permute(index: int, size: int, seed: int) -> int:
+    """Biyección pseudoaleatoria de [0, size) en O(1): red Feistel con cycle-walking"""
+    half = _half(size)
+    mask = (1 << half) - 1
+    value = index
+    while True:
+        left, right = value >> half, value & mask
+        for rnd in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ _round(right, seed, rnd, half)
+        value = (left << half) | right
+        if value < size:
+            return value
+
+def unpermute(value: int, size: int, seed: int) -> int:
+    """Inversa de permute: en qué posición del mazo sale `value`"""
+    half = _half(size)
+    mask = (1 << half) - 1
+    index = value
+    while True:
+        left, right = index >> half, index & mask
+        for rnd in reversed(range(FEISTEL_ROUNDS)):
+            left, right = right ^ _round(left, seed, rnd, half), left
+        index = (left << half) | right
+        if index < size:
+            return index
+
+def _late_seed(deck: dict) -> int:
+    # Cada tramo de casos tardíos se baraja con su propia clave
+    return deck["seed"] ^ (deck["late_start"] << 1)
+
+def _new_deck(last_change: int) -> dict:
+    size = case_catalog.max_ordinal()
+    return {
+        "seed": random.getrandbits(62),
+        "deck_size": size,
+        "deck_pos": 0,
+        # Tramo de casos tardíos en curso: ordinales late_start..late_end, barajados
+        "late_start": size + 1,
+        "late_end": size,
+        "late_drawn": 0,
+        # Casos vivos por sacar del mazo y del tramo; se ajustan con catalog_changes
+        "deck_left": case_catalog.live_between(1, size),
+        "late_left": 0,
+        "changes_seen": last_change
+    }
+
+def _live_left(first: int, last: int, drawn: int, seed: int) -> int:
+    """Casos vivos aún por sacar de la permutación de [first, last] con `drawn` cartas sacadas.
+    Recorre todos los borrados: solo para mazos guardados sin recuentos."""
+    size = last - first + 1
+    if drawn >= size:
+        return 0
+    holes = case_catalog.holes()
+    pending_holes = sum(
+        1 for ordinal in holes
+        if first <= ordinal <= last and unpermute(ordinal - first, size, seed) >= drawn
+    )
+    return size - drawn - pending_holes
+
+def _recount(deck: dict):
+    deck["deck_left"] = _live_left(1, deck["deck_size"], deck["deck_pos"], deck["seed"])
+    deck["late_left"] = _live_left(deck["late_start"], deck["late_end"], deck["late_drawn"], _late_seed(deck))
+    deck["changes_seen"] = deck["last_change"]
+
+def _apply_changes(deck: dict):
+    """Ajusta los recuentos con las altas y bajas posteriores a changes_seen: cada una
+    cuenta solo si su carta está aún por sacar (una permutación inversa por cambio)"""
+    late_size = deck["late_end"] - deck["late_start"] + 1
+    for ordinal, delta in deck["changes"]:
+        if 1 <= ordinal <= deck["deck_size"]:
+            if unpermute(ordinal - 1, deck["deck_size"], deck["seed"]) >= deck["deck_pos"]:
+                deck["deck_left"] += delta
+        elif deck["late_start"] <= ordinal <= deck["late_end"]:
+            if unpermute(ordinal - deck["late_start"], late_size, _late_seed(deck)) >= deck["late_drawn"]:
+                deck["late_left"] += delta
+        # Por encima de late_end: live_between los cuenta al vuelo
+    deck["changes_seen"] = deck["last_change"]
+
+def _pending_late(deck: dict) -> int:
+    # Subidos después de empezar el tramo en curso: entran en el siguiente
+    return case_catalog.live_between(deck["late_end"] + 1, case_catalog.max_ordinal())
+
+def _next_late(deck: dict) -> Optional[int]:
+    if deck["late_left"] <= 0:
+        # Tramo agotado (o solo quedan huecos): los subidos desde entonces forman el siguiente
+        if deck["late_end"] >= case_catalog.max_ordinal():
+            return None
+        deck["late_start"] = deck["late_end"] + 1
+        deck["late_end"] = case_catalog.max_ordinal()
+        deck["late_drawn"] = 0
+        deck["late_left"] = case_catalog.live_between(deck["late_start"], deck["late_end"])
+    size = deck["late_end"] - deck["late_start"] + 1
+    if deck["late_drawn"] >= size:
+        return None
+    ordinal = deck["late_start"] + permute(deck["late_drawn"], size, _late_seed(deck))
+    deck["late_drawn"] += 1
+    return ordinal
+
+def _draw(deck: dict, count: int) -> List[str]:
+    """Saca hasta `count` casos vivos del mazo, avanzando cursores y recuentos en `deck`.
+
+    Los ordinales 1..deck_size forman el mazo barajado. Los casos subidos
+    después (ordinal > deck_size) se barajan aparte, por tramos, y se
+    intercalan al azar con las cartas restantes, con probabilidad
+    proporcional a cuántos casos vivos quedan de cada lado.
+    """
+    rng = random.Random()
+    pending = _pending_late(deck)
+    drawn = []
+
+    while len(drawn) < count:
+        late_left = deck["late_left"] + pending
+        total = deck["deck_left"] + late_left
+        if total <= 0:
+            break
+        late = rng.randrange(total) < late_left
+        # Los huecos son casos borrados: se saltan sin coste extra de BD
+        case_id = None
+        while case_id is None:
+            if late:
+                ordinal = _next_late(deck)
+                if ordinal is None:
+                    break
+            else:
+                if deck["deck_pos"] >= deck["deck_size"]:
+                    break
+                ordinal = permute(deck["deck_pos"], deck["deck_size"], deck["seed"]) + 1
+                deck["deck_pos"] += 1
+            case_id = case_catalog.by_ordinal(ordinal)
+        pending = _pending_late(deck)
+        side = "late_left" if late else "deck_left"
+        if case_id is None:
+            # El recuento iba por delante del catálogo: ese lado ya no tiene cartas vivas
+            deck[side] = 0
+            continue
+        drawn.append(case_id)
+        deck[side] -= 1
+
+    return drawn
+
+def _remaining(deck: dict) -> int:
+    return deck["deck_left"] + deck["late_left"] + _pending_late(deck)
+
+async def _draw_unsent(user_id: int, deck: dict, count: int) -> List[str]:
+    """_draw saltando los casos ya enviados en sesiones filtradas: se consumen como huecos"""
+    selected: List[str] = []
+    while len(selected) < count:
+        batch = _draw(deck, count - len(selected))
+        if not batch:
+            break
+        sent = await filter_sent_cases(user_id, batch)
+        selected.extend(case_id for case_id in batch if case_id not in sent)
+    return selected
+
+async def _reshuffle(user_id: int, last_change: int) -> dict:
+    # Mazo agotado: nueva semilla y cursor a cero. El historial de enviados se vacía
+    # con él, para que los filtros empiecen la misma vuelta que el mazo
+    logger.info(f"🔀 Rebarajando mazo del usuario {user_id}")
+    await reset_user_sent_cases(user_id)
+    return _new_deck(last_change)
+
+async def draw_from_deck(user_id: int, count: int) -> Tuple[List[str], int, bool]:
+    """Misma firma que select_cases: (seleccionados, disponibles, si hubo reset).
+    `disponibles` cuenta también los casos vistos en sesiones filtradas que el mazo
+    aún no ha alcanzado: se descubren al sacarlos."""
+    deck = await get_user_deck(user_id)
+    if deck is None:
+        deck = _new_deck(await get_last_catalog_change())
+    elif deck["deck_left"] is None:
+        # Mazo guardado antes de llevar recuentos: se cuentan una vez, fuera del event loop
+        await asyncio.to_thread(_recount, deck)
+    else:
+        _apply_changes(deck)
+
+    available = _remaining(deck)
+    was_reset = False
+
+    selected = await _draw_unsent(user_id, deck, count) if available else []
+    if not selected:
+        # Sin casos vivos por sacar, o solo quedaban los ya vistos con filtro
+        deck = await _reshuffle(user_id, deck["changes_seen"])
+        available = 0
+        was_reset = True
+        selected = _draw(deck, count)
+
+    await save_user_deck(user_id, deck)
+    return selected, available, was_reset
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Importador masivo de casos y justificaciones
+
+  python importer.py casos.jsonl
+  python importer.py casos.csv --batch-size 2000
+
+JSONL: un caso por línea
+  {"case_id": "CASE_0001_CARDIO", "file_id": "...", "file_type": "photo", "caption": "...",
+   "correct_answer": "B", "justifications": [{"file_id": "...", "file_type": "document", "caption": ""}]}
+
+CSV: columnas case_id, file_id, file_type, caption, correct_answer, justifications
+  (justifications: lista JSON como la de arriba, o "tipo:file_id" separados por ";")
+
+Igual que con el uploader: si falta correct_answer se toma de #X# en el caption
+(o "A"), y un caso de texto sin file_id usa "text_<case_id>". Repetir la
+importación no duplica nada. Con el bot en marcha, usar /refresh_catalog después.
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from database import CASE_PATTERN, CORRECT_PATTERN, init_db, import_cases
+
+logger = logging.getLogger(__name__)
+
+FILE_TYPES = {"document", "photo", "video", "audio", "voice", "text"}
+ANSWERS = {"A", "B", "C", "D"}
+
+class ManifestError(ValueError):
+    pass
+
+def normalize_case_id(raw: str) -> str:
+    raw = (raw or "").strip()
+    match = CASE_PATTERN.search(raw)
+    if match:
+        return f"###CASE_{match.group(1)}"
+    if raw.upper().startswith("CASE_"):
+        raw = raw[5:]
+    if not raw:
+        raise ManifestError("case_id vacío")
+    return f"###CASE_{raw}"
+
+def _parse_justifications(value) -> List[dict]:
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    value = value.strip()
+    if value.startswith("["):
+        return json.loads(value)
+    items = []
+    for part in value.split(";"):
+        file_type, _, file_id = part.strip().partition(":")
+        if not file_id:
+            raise ManifestError(f"justificación inválida: {part!r} (se espera tipo:file_id)")
+        items.append({"file_type": file_type, "file_id": file_id})
+    return items
+
+def parse_record(record: dict) -> Tuple[tuple, List[tuple]]:
+    case_id = normalize_case_id(record.get("case_id"))
+    caption = record.get("caption") or ""
+    correct_answer = (record.get("correct_answer") or "").strip().upper()
+    if not correct_answer:
+        correct_match = CORRECT_PATTERN.search(caption)
+        correct_answer = correct_match.group(1).upper() if correct_match else "A"
+    caption = CORRECT_PATTERN.sub('', CASE_PATTERN.sub('', caption)).strip()
+
+    file_type = (record.get("file_type") or "").strip().lower()
+    file_id = (record.get("file_id") or "").strip()
+    if file_type == "text" and not file_id:
+        file_id = f"text_{case_id}"
+    if file_type not in FILE_TYPES:
+        raise ManifestError(f"file_type inválido: {file_type!r}")
+    if not file_id:
+        raise ManifestError("file_id vacío")
+    if correct_answer not in ANSWERS:
+        raise ManifestError(f"correct_answer inválida: {correct_answer!r}")
+
+    justifications = []
+    for item in _parse_justifications(record.get("justifications")):
+        just_type = (item.get("file_type") or "").strip().lower()
+        just_id = (item.get("file_id") or "").strip()
+        if just_type not in FILE_TYPES or not just_id:
+            raise ManifestError(f"justificación inválida: {item!r}")
+        justifications.append((case_id, just_id, just_type, item.get("caption") or ""))
+
+    return (case_id, file_id, file_type, caption, correct_answer), justifications
+
+def read_manifest(path: str) -> Iterator[Tuple[int, dict]]:
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            # Línea 1 = cabecera
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                yield line_no, row
+        else:
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        yield line_no, json.loads(line)
+                    except json.JSONDecodeError as e:
+                        yield line_no, {"_error": str(e)}
+
+def _write_batch(cases: Dict[str, tuple], justifications: Dict[tuple, tuple], totals: Dict[str, int]):
+    result = import_cases(list(cases.values()), list(justifications.values()))
+    for key, value in result.items():
+        totals[key] += value
+    cases.clear()
+    justifications.clear()
+
+def run_import(path: str, batch_size: int = 1000) -> Dict[str, int]:
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0, "justifications": 0, "errors": 0}
+    cases: Dict[str, tuple] = {}
+    justifications: Dict[tuple, tuple] = {}
+    seen = 0
+    started = time.perf_counter()
+
+    for line_no, record in read_manifest(path):
+        try:
+            if "_error" in record:
+                raise ManifestError(f"JSON inválido: {record['_error']}")
+            case, case_justifications = parse_record(record)
+        except (ManifestError, ValueError, AttributeError) as e:
+            totals["errors"] += 1
+            logger.warning(f"⚠️ Línea {line_no} omitida: {e}")
+            continue
+
+        # El mismo caso repetido en el lote: gana la última aparición
+        cases[case[0]] = case
+        for just in case_justifications:
+            justifications.setdefault((just[0], just[1]), just)
+        seen += 1
+
+        if len(cases) >= batch_size:
+            _write_batch(cases, justifications, totals)
+            elapsed = time.perf_counter() - started
+            logger.info(f"📦 {seen} casos procesados ({seen / elapsed:.0f}/s)")
+
+    if cases:
+        _write_batch(cases, justifications, totals)
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"✅ Importación terminada en {elapsed:.1f}s: {totals['inserted']} nuevos, "
+        f"{totals['updated']} actualizados, {totals['unchanged']} sin cambios, "
+        f"{totals['justifications']} justificaciones añadidas, {totals['errors']} líneas con error"
+    )
+    return totals
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Importa casos y justificaciones desde un manifiesto CSV o JSONL")
+    parser.add_argument("manifest")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Casos por transacción")
+    args = parser.parse_args()
+
+    init_db()
+    totals = run_import(args.manifest, args.batch_size)
+    logger.info("💡 Si el bot está en marcha, ejecuta /refresh_catalog para ver los casos nuevos")
+    sys.exit(1 if totals["errors"] else 0)
+
+if __name__ == "__main__":
+    main()
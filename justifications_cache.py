@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Caché LRU de justificaciones por caso
+Se precarga en segundo plano al responder, para que el botón
+"Ver justificación" empiece a enviar sin esperar a la BD.
+"""
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from typing import Dict, List, Tuple
+
+from config import JUSTIFICATION_CACHE_SIZE
+import storage
+
+logger = logging.getLogger(__name__)
+
+class JustificationCache:
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._cache: "OrderedDict[str, List[Tuple[str, str, str]]]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._versions: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def get(self, case_id: str) -> List[Tuple[str, str, str]]:
+        cached = self._cache.get(case_id)
+        if cached is not None:
+            self._cache.move_to_end(case_id)
+            return cached
+        task = self._loading.get(case_id) or self._start(case_id)
+        return await asyncio.shield(task)
+
+    def prefetch(self, case_id: str):
+        if case_id not in self._cache and case_id not in self._loading:
+            self._start(case_id)
+
+    def invalidate(self, case_id: str):
+        self._versions[case_id] += 1
+        self._cache.pop(case_id, None)
+        self._loading.pop(case_id, None)
+
+    def clear(self):
+        for case_id in list(self._cache):
+            self.invalidate(case_id)
+
+    def _start(self, case_id: str) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(self._load(case_id, self._versions[case_id]))
+        task.add_done_callback(self._log_failure)
+        self._loading[case_id] = task
+        return task
+
+    async def _load(self, case_id: str, version: int) -> List[Tuple[str, str, str]]:
+        try:
+            justifications = await storage.get_justifications_for_case(case_id)
+        finally:
+            if self._versions[case_id] == version:
+                self._loading.pop(case_id, None)
+
+        # Si se subió una justificación mientras cargábamos, no guardar lo viejo
+        if self._versions[case_id] == version:
+            self._cache[case_id] = justifications
+            self._cache.move_to_end(case_id)
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+        return justifications
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"❌ Error precargando justificaciones: {task.exception()}")
+
+justification_cache = JustificationCache(JUSTIFICATION_CACHE_SIZE)
+
+async def save_justification(case_id: str, file_id: str, file_type: str, caption: str = ""):
+    """Como storage.save_justification, invalidando la caché del caso"""
+    await storage.save_justification(case_id, file_id, file_type, caption)
+    justification_cache.invalidate(case_id)
@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
 import logging
-import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.error import TelegramError
 
-from database import get_justifications_for_case, increment_daily_progress
+from outbound import PRIORITY_NORMAL
+from justifications_cache import justification_cache
+from sessions import session_store
+from storage import increment_daily_progress
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
+@traced
 async def handle_justification_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -20,7 +24,7 @@ async def handle_justification_request(update: Update, context: ContextTypes.DEF
     case_id = data.replace("just_", "")
     user_id = query.from_user.id
     
-    justifications = get_justifications_for_case(case_id)
+    justifications = await justification_cache.get(case_id)
     
     if not justifications:
         await query.edit_message_text("❌ Justificación no disponible")
@@ -31,18 +35,17 @@ async def handle_justification_request(update: Update, context: ContextTypes.DEF
             logger.info(f"📤 Enviando justificación ({file_type}) con file_id")
             
             if file_type == "document":
-                await context.bot.send_document(chat_id=user_id, document=file_id, caption=caption if caption else None, protect_content=True)
+                await context.bot.send_document(chat_id=user_id, document=file_id, caption=caption if caption else None, protect_content=True, rate_limit_args=PRIORITY_NORMAL)
             elif file_type == "photo":
-                await context.bot.send_photo(chat_id=user_id, photo=file_id, caption=caption if caption else None, protect_content=True)
+                await context.bot.send_photo(chat_id=user_id, photo=file_id, caption=caption if caption else None, protect_content=True, rate_limit_args=PRIORITY_NORMAL)
             elif file_type == "video":
-                await context.bot.send_video(chat_id=user_id, video=file_id, caption=caption if caption else None, protect_content=True)
+                await context.bot.send_video(chat_id=user_id, video=file_id, caption=caption if caption else None, protect_content=True, rate_limit_args=PRIORITY_NORMAL)
             elif file_type == "audio":
-                await context.bot.send_audio(chat_id=user_id, audio=file_id, caption=caption if caption else None, protect_content=True)
+                await context.bot.send_audio(chat_id=user_id, audio=file_id, caption=caption if caption else None, protect_content=True, rate_limit_args=PRIORITY_NORMAL)
             elif file_type == "text":
-                await context.bot.send_message(chat_id=user_id, text=caption, protect_content=True)
+                await context.bot.send_message(chat_id=user_id, text=caption, protect_content=True, rate_limit_args=PRIORITY_NORMAL)
             
             logger.info(f"✅ Justificación enviada exitosamente")
-            await asyncio.sleep(0.3)
             
         except TelegramError as e:
             logger.error(f"❌ Error enviando justificación: {e}")
@@ -53,18 +56,19 @@ async def handle_justification_request(update: Update, context: ContextTypes.DEF
     except:
         motivational_text = "📚 Justificación enviada"
     
-    from cases_handler import user_sessions
-    session = user_sessions.get(user_id)
+    session = await session_store.get(user_id)
     
     if session:
         session["current_index"] += 1
-        increment_daily_progress(user_id)
+        session_store.mark_dirty(user_id)
+        await increment_daily_progress(user_id)
         
         keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Siguiente caso ➡️", callback_data="next_case")]])
         await context.bot.send_message(user_id, motivational_text, reply_markup=keyboard)
     else:
         await context.bot.send_message(user_id, motivational_text)
 
+@traced
 async def handle_next_case(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -3,19 +3,42 @@ import logging
 from telegram import Update
 from telegram.ext import Application, MessageHandler, CommandHandler, CallbackQueryHandler, filters, ContextTypes
 
-from config import BOT_TOKEN, CASES_UPLOADER_ID
-from database import init_db, count_cases
-from cases_handler import cmd_random_cases, handle_answer
+from config import (
+    BOT_TOKEN, CASES_UPLOADER_ID, PAUSE, SESSION_FLUSH_INTERVAL, CASE_STATS_FLUSH_INTERVAL,
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_GROUP_PER_MINUTE, OUTBOUND_MAX_RETRIES,
+    METRICS_HOST, METRICS_PORT, UPDATE_MODE, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT,
+    WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_CERT, WEBHOOK_KEY,
+    MAX_CONCURRENT_UPDATES, STATS_REFRESH_INTERVAL, ANALYTICS_INTERVAL, RETENTION_INTERVAL
+)
+from catalog import case_catalog
+from database import init_db, load_catalog, pool_stats
+from storage import shutdown as shutdown_storage, unblock_user
+from sessions import session_store, flush_sessions_job, purge_sessions_job
+from case_stats_cache import case_stats_cache, flush_case_stats_job
+from stats_snapshot import refresh_stats_job
+from analytics import refresh_analytics_job
+from maintenance import retention_job
+from justifications_cache import justification_cache
+from outbound import OutboundScheduler
+from update_processor import PerUserUpdateProcessor
+from cases_handler import cmd_random_cases, handle_answer, deleted_cases_cache
 from justifications_handler import handle_justification_request, handle_next_case
 from channels_handler import handle_uploader_message, cmd_refresh_catalog, cmd_replace_caso
-from admin_panel import cmd_admin, cmd_set_limit, cmd_set_sub, handle_admin_callback
+from admin_panel import (
+    cmd_admin, cmd_set_limit, cmd_set_sub, handle_admin_callback,
+    cmd_broadcast, cmd_broadcast_status, cmd_broadcast_cancel
+)
+from broadcast import broadcaster, resume_broadcasts_job
+from tracing import traced
+import metrics
 
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 init_db()
+load_catalog()
 
-total_cases = count_cases()
+total_cases = len(case_catalog)
 if total_cases == 0:
     logger.warning("⚠️ No hay casos en la base de datos")
     logger.info(f"📤 ID del uploader autorizado: {CASES_UPLOADER_ID}")
@@ -23,6 +46,7 @@ if total_cases == 0:
 else:
     logger.info(f"📚 {total_cases} casos disponibles")
 
+@traced
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
@@ -37,6 +61,9 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(text)
         return
     
+    # Si había bloqueado el bot, vuelve a recibir difusiones
+    await unblock_user(user_id)
+    
     text = (
         "👋 Bienvenido a Casos Clínicos Bot\n\n"
         "🎯 Comandos disponibles\n"
@@ -46,18 +73,22 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(text)
 
+@traced
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (
         "🤖 Comandos disponibles\n\n"
         "📚 Para usuarios\n"
         "• /start - Iniciar bot\n"
         "• /random_cases - 5 casos aleatorios\n"
+        "• /random_cases PED - solo de una especialidad\n"
+        "• /random_cases INFECTO DENGUE - especialidad y tema\n"
         "• /help - Ver esta ayuda\n\n"
         "⏰ Límite: 5 casos por día\n"
         "🔄 Reset: 12:00 AM diario"
     )
     await update.message.reply_text(text)
 
+@traced
 async def handle_private_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -73,6 +104,7 @@ async def handle_private_message(update: Update, context: ContextTypes.DEFAULT_T
         await handle_answer(update, context)
         return
 
+@traced
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
@@ -87,8 +119,47 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.exception("Error", exc_info=context.error)
 
-def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+def register_gauges(scheduler: OutboundScheduler, processor: PerUserUpdateProcessor):
+    registry = metrics.registry
+    registry.gauge("bot_update_users_active", "Usuarios con updates en curso o en espera", processor.active_users)
+    registry.gauge("bot_sessions_cached", "Sesiones de casos en memoria", lambda: len(session_store))
+    registry.gauge("bot_deleted_cases_cache_size", "Casos marcados como borrados en memoria", lambda: len(deleted_cases_cache))
+    registry.gauge("bot_catalog_cases", "Casos en el catálogo en memoria", lambda: len(case_catalog))
+    registry.gauge("bot_justification_cache_size", "Casos con justificaciones en caché", lambda: len(justification_cache))
+    registry.gauge("bot_outbound", "Planificador de envíos: enviados, RetryAfter, fallidos, en cola y ritmo",
+                   scheduler.stats, label="stat")
+    registry.gauge("bot_db_pool", "Pool de conexiones PostgreSQL", pool_stats, label="stat")
+
+async def post_init(app: Application):
+    if METRICS_PORT:
+        await metrics.start_server(METRICS_HOST, METRICS_PORT)
+
+async def post_shutdown(app: Application):
+    await broadcaster.stop()
+    await metrics.stop_server()
+    await session_store.flush()
+    await case_stats_cache.flush()
+    shutdown_storage()
+
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+def build_application(request=None) -> Application:
+    """Construye la aplicación con todos los handlers; `request` permite otro backend HTTP"""
+    scheduler = OutboundScheduler(
+        global_rate=OUTBOUND_GLOBAL_RATE,
+        chat_interval=PAUSE,
+        group_per_minute=OUTBOUND_GROUP_PER_MINUTE,
+        max_retries=OUTBOUND_MAX_RETRIES
+    )
+    processor = PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES)
+    register_gauges(scheduler, processor)
+    builder = (
+        Application.builder().token(BOT_TOKEN).rate_limiter(scheduler).concurrent_updates(processor)
+        .post_init(post_init).post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    app = builder.build()
     
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("help", cmd_help))
@@ -97,6 +168,9 @@ def main():
     app.add_handler(CommandHandler("admin", cmd_admin))
     app.add_handler(CommandHandler("set_limit", cmd_set_limit))
     app.add_handler(CommandHandler("set_sub", cmd_set_sub))
+    app.add_handler(CommandHandler("broadcast", cmd_broadcast))
+    app.add_handler(CommandHandler("broadcast_status", cmd_broadcast_status))
+    app.add_handler(CommandHandler("broadcast_cancel", cmd_broadcast_cancel))
     app.add_handler(CommandHandler("refresh_catalog", cmd_refresh_catalog))
     app.add_handler(CommandHandler("replace_caso", cmd_replace_caso))
     
@@ -106,8 +180,46 @@ def main():
     
     app.add_error_handler(on_error)
     
+    app.job_queue.run_repeating(flush_sessions_job, interval=SESSION_FLUSH_INTERVAL, first=SESSION_FLUSH_INTERVAL)
+    app.job_queue.run_repeating(purge_sessions_job, interval=3600, first=60)
+    if CASE_STATS_FLUSH_INTERVAL > 0:
+        app.job_queue.run_repeating(flush_case_stats_job, interval=CASE_STATS_FLUSH_INTERVAL, first=CASE_STATS_FLUSH_INTERVAL)
+    app.job_queue.run_repeating(refresh_stats_job, interval=STATS_REFRESH_INTERVAL, first=10)
+    if ANALYTICS_INTERVAL > 0:
+        app.job_queue.run_repeating(refresh_analytics_job, interval=ANALYTICS_INTERVAL, first=60)
+    app.job_queue.run_once(resume_broadcasts_job, when=5)
+    if RETENTION_INTERVAL > 0:
+        app.job_queue.run_repeating(retention_job, interval=RETENTION_INTERVAL, first=600)
+    return app
+
+def run_webhook(app: Application, webhook_url: str = None):
+    """Servidor webhook de PTB; detrás de un proxy TLS escucha en HTTP y se registra la URL pública"""
+    if not WEBHOOK_SECRET:
+        logger.warning("⚠️ Webhook sin WEBHOOK_SECRET: cualquiera que conozca la URL puede enviar updates")
+    logger.info(f"🌐 Webhook escuchando en {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+    app.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=webhook_url,
+        secret_token=WEBHOOK_SECRET or None,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        cert=WEBHOOK_CERT or None,
+        key=WEBHOOK_KEY or None,
+        allowed_updates=ALLOWED_UPDATES,
+        drop_pending_updates=True
+    )
+
+def main():
+    app = build_application()
+    
     logger.info("🚀 Bot iniciado")
-    app.run_polling(allowed_updates=["message", "callback_query"], drop_pending_updates=True)
+    if UPDATE_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise SystemExit("❌ UPDATE_MODE=webhook requiere WEBHOOK_URL (URL pública https)")
+        run_webhook(app, f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}")
+    else:
+        app.run_polling(allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
 
 if __name__ == "__main__":
     main()
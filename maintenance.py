@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Retención de user_responses y daily_progress
+Un job (RETENTION_INTERVAL) agrega las respuestas más antiguas que
+RESPONSES_RETENTION_DAYS en response_rollups (usuario, caso, día) y borra las
+filas crudas; después poda daily_progress. Todo va por bloques de
+RETENTION_BATCH_SIZE, cada uno en su propia transacción corta y con una pausa
+entre bloques, así que nunca bloquea las tablas calientes mucho tiempo.
+Borrar respuestas es irreversible: está desactivado salvo que se configure
+RESPONSES_RETENTION_DAYS (mejor con RETENTION_ARCHIVE_DIR).
+
+analytics.py carga response_rollups al arrancar, así que el análisis de casos
+no pierde historia. Mientras el bot corre, solo se agregan respuestas que el
+análisis ya leyó (id <= su marca de agua).
+
+  python maintenance.py                 # una pasada hasta la marca de agua guardada por el bot
+  python maintenance.py --max-id 12345  # hasta un id concreto (p. ej. con el bot detenido)
+
+Desde la línea de comandos, por defecto solo se agregan respuestas que el
+análisis del bot ya leyó según analytics_state: las de después saldrían de
+sus estadísticas hasta el siguiente reinicio.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    TZ, ANALYTICS_INTERVAL, RESPONSES_RETENTION_DAYS, DAILY_PROGRESS_RETENTION_DAYS,
+    RETENTION_ARCHIVE_DIR, RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE
+)
+from analytics import item_analytics
+from storage import get_responses_before, apply_response_rollup, purge_daily_progress, get_analytics_watermark
+
+logger = logging.getLogger(__name__)
+
+# Las estadísticas de /admin leen los últimos 7 días de user_responses
+MIN_RESPONSES_RETENTION_DAYS = 8
+# daily_progress de hoy es el límite diario en curso
+MIN_DAILY_PROGRESS_RETENTION_DAYS = 2
+
+ANSWERS = "ABCD"
+
+def rollup(rows: List[tuple]) -> List[tuple]:
+    """(id, user_id, case_id, answer, is_correct, timestamp) → (user_id, case_id, día, respuestas, correctas, a, b, c, d)"""
+    groups: Dict[Tuple[int, str, str], List[int]] = defaultdict(lambda: [0] * 6)
+    for _, user_id, case_id, answer, is_correct, timestamp in rows:
+        day = datetime.fromtimestamp(timestamp, tz=TZ).strftime("%Y-%m-%d")
+        counts = groups[(user_id, case_id, day)]
+        counts[0] += 1
+        counts[1] += 1 if is_correct == 1 else 0
+        # Mismo criterio que analytics.py: solo cuenta una letra A-D exacta
+        if answer and len(answer) == 1 and answer in ANSWERS:
+            counts[2 + ANSWERS.index(answer)] += 1
+    return [key + tuple(counts) for key, counts in groups.items()]
+
+def archive(directory: str, rows: List[tuple]):
+    """Añade las filas crudas a user_responses-AAAA-MM.jsonl.gz (un miembro gzip por bloque)"""
+    os.makedirs(directory, exist_ok=True)
+    by_month: Dict[str, List[tuple]] = defaultdict(list)
+    for row in rows:
+        by_month[datetime.fromtimestamp(row[5], tz=TZ).strftime("%Y-%m")].append(row)
+    for month, month_rows in by_month.items():
+        path = os.path.join(directory, f"user_responses-{month}.jsonl.gz")
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            for row_id, user_id, case_id, answer, is_correct, timestamp in month_rows:
+                f.write(json.dumps({
+                    "id": row_id, "user_id": user_id, "case_id": case_id, "answer": answer,
+                    "is_correct": is_correct, "timestamp": timestamp
+                }, ensure_ascii=False, separators=(",", ":")))
+                f.write("\n")
+
+async def rollup_old_responses(retention_days: int, max_id: Optional[int] = None) -> int:
+    days = max(retention_days, MIN_RESPONSES_RETENTION_DAYS)
+    cutoff = int((datetime.now(tz=TZ) - timedelta(days=days)).timestamp())
+    moved, after_id = 0, 0
+    while True:
+        rows = await get_responses_before(cutoff, after_id, max_id, RETENTION_BATCH_SIZE)
+        if not rows:
+            break
+        after_id = rows[-1][0]
+        # Primero el archivo: si algo falla después, como mucho se archiva dos veces, nunca se pierde
+        if RETENTION_ARCHIVE_DIR:
+            await asyncio.to_thread(archive, RETENTION_ARCHIVE_DIR, rows)
+        moved += await apply_response_rollup(rollup(rows), rows[0][0], after_id, cutoff)
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+    return moved
+
+async def prune_daily_progress(retention_days: int) -> int:
+    days = max(retention_days, MIN_DAILY_PROGRESS_RETENTION_DAYS)
+    before = (datetime.now(tz=TZ) - timedelta(days=days)).strftime("%Y-%m-%d")
+    removed = 0
+    while True:
+        deleted = await purge_daily_progress(before, RETENTION_BATCH_SIZE)
+        removed += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            break
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+    return removed
+
+async def run_retention(max_id: Optional[int] = None) -> dict:
+    started = time.perf_counter()
+    result = {"responses": 0, "daily_progress": 0}
+    if RESPONSES_RETENTION_DAYS > 0:
+        result["responses"] = await rollup_old_responses(RESPONSES_RETENTION_DAYS, max_id)
+    if DAILY_PROGRESS_RETENTION_DAYS > 0:
+        result["daily_progress"] = await prune_daily_progress(DAILY_PROGRESS_RETENTION_DAYS)
+    logger.info(
+        f"🧹 Retención: {result['responses']} respuestas agregadas en response_rollups, "
+        f"{result['daily_progress']} filas de daily_progress borradas en {time.perf_counter() - started:.1f}s"
+    )
+    return result
+
+async def retention_job(context):
+    try:
+        # Con el análisis activo, no agregar respuestas que aún no ha leído
+        max_id = item_analytics.watermark if ANALYTICS_INTERVAL > 0 else None
+        await run_retention(max_id)
+    except Exception as e:
+        logger.error(f"❌ Error en la retención: {e}")
+
+async def _cli_max_id(explicit: Optional[int]) -> Optional[int]:
+    if explicit is not None:
+        return explicit
+    if ANALYTICS_INTERVAL <= 0:
+        # Sin análisis no hay nada que desincronizar
+        return None
+    watermark = await get_analytics_watermark()
+    if watermark is None:
+        logger.warning(
+            "⚠️ El análisis del bot aún no guardó su marca de agua: no se agregan respuestas "
+            "(usa --max-id con el bot detenido)"
+        )
+        return 0
+    logger.info(f"🔖 Agregando solo respuestas con id <= {watermark} (marca de agua del análisis)")
+    return watermark
+
+async def _main(explicit_max_id: Optional[int]):
+    await run_retention(await _cli_max_id(explicit_max_id))
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Agrega respuestas antiguas y poda daily_progress")
+    parser.add_argument(
+        "--max-id", type=int, default=None,
+        help="Último id de user_responses que se puede agregar (por defecto, la marca de agua del análisis del bot)"
+    )
+    args = parser.parse_args()
+    from database import init_db
+    from storage import shutdown
+    init_db()
+    asyncio.run(_main(args.max_id))
+    shutdown()
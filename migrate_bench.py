@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Ida y vuelta de migrate_to_postgres.py contra bases de datos desechables
+
+  DATABASE_URL=postgresql://... python migrate_bench.py --rows 50000 --chunk-size 500 --kill-after 25
+
+Siembra un casos.db sintético (todas las tablas de BACKUP_TABLES, con user_id
+negativos, NULLs, tabuladores, saltos de línea, barras y emoji) y lo migra dos
+veces, cada una a una base de datos nueva creada con DATABASE_URL y borrada
+al final (la base de DATABASE_URL no se toca):
+
+  1. de una vez;
+  2. matando el proceso (SIGKILL) tras --kill-after bloques y relanzando el
+     mismo comando, que debe seguir donde se quedó.
+
+En ambos casos comprueba, tabla por tabla y con consultas propias, número
+de filas y checksum independiente del orden frente al SQLite, y que las
+secuencias SERIAL quedan por encima del máximo migrado. Sale con código 1
+si algo no cuadra.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterator, List
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+import bitmap
+import database
+from database import BACKUP_TABLES, _SERIAL_COLUMNS
+from migrate_to_postgres import TableChecksum
+
+logger = logging.getLogger(__name__)
+
+MIGRATE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrate_to_postgres.py")
+
+# Tablas grandes (--rows filas); el resto lleva una décima parte
+_LARGE_TABLES = {"user_responses", "user_sent_cases", "case_stats"}
+
+def _text(column: str, i: int) -> str:
+    return f"{column} {i}\t— ñ 🩺\\n\n{'x' * (i % 5)}"
+
+def _value(column: str, kind: str, notnull: bool, pk: int, i: int):
+    if not notnull and not pk and i % 11 == 0:
+        return None
+    if column == "user_id":
+        # rowid 0 y negativos cuando user_id es INTEGER PRIMARY KEY
+        return i - 3 if pk == 1 else i % 97
+    if kind == "BLOB":
+        return bitmap.encode(bitmap.from_ordinals(range(i % 50, i % 50 + 200, 3)))
+    if kind == "INTEGER":
+        return i
+    return _text(column, i)
+
+def seed_sqlite(path: str, rows: int) -> dict:
+    conn = sqlite3.connect(path)
+    conn.executescript(database._schema_sqlite)
+    counts = {}
+    for table in BACKUP_TABLES:
+        info = list(conn.execute(f"PRAGMA table_info({table})"))
+        columns = [row[1] for row in info]
+        total = rows if table in _LARGE_TABLES else max(1, rows // 10)
+        values = (
+            tuple(_value(column, kind, bool(notnull), pk, i) for _, column, kind, notnull, _, pk in info)
+            for i in range(total)
+        )
+        conn.executemany(
+            f"INSERT INTO {table}({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", values
+        )
+        counts[table] = total
+    conn.commit()
+    conn.close()
+    return counts
+
+@contextmanager
+def scratch_database(admin_url: str) -> Iterator[str]:
+    name = f"migrate_bench_{os.getpid()}_{int(time.time() * 1000) % 10**8}"
+    admin = psycopg2.connect(admin_url)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE DATABASE {name} ENCODING 'UTF8' TEMPLATE template0")
+    try:
+        yield psycopg2.extensions.make_dsn(admin_url, dbname=name)
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+        admin.close()
+
+def run_migration(sqlite_path: str, url: str, chunk_size: int) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=url)
+    return subprocess.Popen(
+        [sys.executable, MIGRATE_SCRIPT, "--sqlite", sqlite_path, "--chunk-size", str(chunk_size)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+
+def progress(url: str) -> dict:
+    """tabla -> (filas confirmadas, terminada) según sqlite_migration"""
+    conn = psycopg2.connect(url)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT table_name, rows_copied, done FROM sqlite_migration")
+            return {table: (copied, done) for table, copied, done in cur.fetchall()}
+    except psycopg2.errors.UndefinedTable:
+        return {}
+    finally:
+        conn.close()
+
+def rows_copied(url: str) -> int:
+    return sum(copied for copied, _ in progress(url).values())
+
+def kill_midway(sqlite_path: str, url: str, chunk_size: int, kill_after: int):
+    proc = run_migration(sqlite_path, url, chunk_size)
+    copied = 0
+    while proc.poll() is None and copied < kill_after * chunk_size:
+        time.sleep(0.01)
+        copied = rows_copied(url)
+    if proc.poll() is not None:
+        print(f"⚠️ La migración terminó antes del corte ({copied} filas): sube --rows o baja --kill-after")
+        return
+    proc.kill()
+    proc.wait()
+    state = progress(url)
+    partial = [f"{table} ({rows} filas)" for table, (rows, done) in state.items() if not done]
+    print(f"🔪 Proceso matado con {sum(rows for rows, _ in state.values())} filas confirmadas; "
+          f"a medias: {', '.join(partial) or 'ninguna tabla'}. Se relanza el mismo comando")
+
+def _columns(sqlite_conn: sqlite3.Connection, pg_conn, table: str) -> List[str]:
+    with pg_conn.cursor() as cur:
+        cur.execute(f"SELECT * FROM {table} LIMIT 0")
+        target = {col[0] for col in cur.description}
+    return [row[1] for row in sqlite_conn.execute(f"PRAGMA table_info({table})") if row[1] in target]
+
+def verify(sqlite_path: str, url: str) -> bool:
+    src = sqlite3.connect(sqlite_path)
+    dst = psycopg2.connect(url)
+    ok = True
+    for table in BACKUP_TABLES:
+        columns = _columns(src, dst, table)
+        select = f"SELECT {', '.join(columns)} FROM {table}"
+        source, target = TableChecksum(), TableChecksum()
+        for row in src.execute(select):
+            source.add(row)
+        with dst.cursor(name=f"verify_{table}") as cur:
+            cur.itersize = 5000
+            cur.execute(select)
+            for row in cur:
+                target.add(row)
+        match = source.rows == target.rows and source.total == target.total
+        ok = ok and match
+        if not match:
+            print(f"  ❌ {table}: SQLite {source.rows} / {source.total:016x} ≠ PostgreSQL {target.rows} / {target.total:016x}")
+
+    with dst.cursor() as cur:
+        for table, column in _SERIAL_COLUMNS.items():
+            cur.execute(f"SELECT last_value FROM {table}_{column}_seq")
+            last_value = cur.fetchone()[0]
+            cur.execute(f"SELECT coalesce(max({column}), 0) FROM {table}")
+            if last_value < cur.fetchone()[0]:
+                print(f"  ❌ Secuencia {table}.{column} por debajo del máximo migrado")
+                ok = False
+    src.close()
+    dst.close()
+    return ok
+
+def bench(rows: int, chunk_size: int, kill_after: int) -> bool:
+    admin_url = os.environ["DATABASE_URL"]
+    ok = True
+    with tempfile.TemporaryDirectory() as workdir:
+        sqlite_path = os.path.join(workdir, "casos.db")
+        counts = seed_sqlite(sqlite_path, rows)
+        print(f"🌱 casos.db sintético: {sum(counts.values())} filas en {len(counts)} tablas")
+
+        for label, cut in (("de una vez", 0), ("cortada y reanudada", kill_after)):
+            with scratch_database(admin_url) as url:
+                started = time.perf_counter()
+                if cut:
+                    kill_midway(sqlite_path, url, chunk_size, cut)
+                proc = run_migration(sqlite_path, url, chunk_size)
+                _, stderr = proc.communicate()
+                elapsed = time.perf_counter() - started
+                if proc.returncode != 0:
+                    print(f"❌ Migración {label}: código {proc.returncode}\n{stderr[-2000:]}")
+                    ok = False
+                    continue
+                verified = verify(sqlite_path, url)
+                ok = ok and verified
+                print(f"{'✅' if verified else '❌'} Migración {label} en {elapsed:.1f}s: "
+                      f"filas, checksums y secuencias {'cuadran' if verified else 'NO cuadran'}")
+    return ok
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Migración SQLite → PostgreSQL con corte y reanudación")
+    parser.add_argument("--rows", type=int, default=50000, help="Filas de las tablas grandes")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--kill-after", type=int, default=25, help="Bloques confirmados antes de matar el proceso")
+    args = parser.parse_args()
+    if not database.USE_POSTGRES:
+        sys.exit("migrate_bench.py necesita DATABASE_URL (PostgreSQL)")
+    if not bench(args.rows, args.chunk_size, args.kill_after):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
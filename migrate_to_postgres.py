@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Migración de casos.db (SQLite) a PostgreSQL
+
+  DATABASE_URL=postgresql://... python migrate_to_postgres.py [--sqlite casos.db]
+
+Copia tabla por tabla en bloques con COPY FROM STDIN, recorriendo SQLite por
+rowid. Cada bloque se confirma junto con su progreso (tabla sqlite_migration),
+así que si se interrumpe basta con volver a ejecutar el mismo comando: sigue
+donde se quedó. Al final alinea las secuencias SERIAL y compara, por tabla,
+número de filas y un checksum independiente del orden.
+
+El bot debe estar detenido mientras dura la migración.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import sqlite3
+import sys
+import time
+from typing import Iterable, List
+
+import database
+from database import (
+    BACKUP_TABLES, init_db, table_columns, count_rows, iter_table_chunks, reset_sequences,
+    migration_progress, copy_migration_chunk, finish_migration_table
+)
+
+logger = logging.getLogger(__name__)
+
+_MIN_ROWID = -(1 << 63)
+
+def _sqlite_columns(src: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in src.execute(f"PRAGMA table_info({table})")]
+
+def _sqlite_tables(src: sqlite3.Connection) -> set:
+    return {row[0] for row in src.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+def _checksum_value(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    return value
+
+class TableChecksum:
+    """Suma de hashes por fila: no depende del orden de lectura"""
+    def __init__(self):
+        self.total = 0
+        self.rows = 0
+
+    def add(self, values: Iterable):
+        data = json.dumps([_checksum_value(v) for v in values], ensure_ascii=False, separators=(",", ":"))
+        digest = hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest()
+        self.total = (self.total + int.from_bytes(digest, "big")) % (1 << 64)
+        self.rows += 1
+
+def copy_table(src: sqlite3.Connection, table: str, columns: List[str], state: dict, chunk_size: int) -> int:
+    # rowid puede ser 0 o negativo cuando la PK es INTEGER PRIMARY KEY (p. ej. user_id)
+    last_rowid = state.get("last_rowid", _MIN_ROWID)
+    copied = state.get("rows", 0)
+    started = time.perf_counter()
+    select = f"SELECT rowid, {', '.join(columns)} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?"
+    while True:
+        rows = src.execute(select, (last_rowid, chunk_size)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        copy_migration_chunk(table, columns, [row[1:] for row in rows], last_rowid)
+        copied += len(rows)
+        logger.info(f"📦 {table}: {copied} filas ({len(rows) / max(time.perf_counter() - started, 1e-6):.0f}/s)")
+        started = time.perf_counter()
+    finish_migration_table(table)
+    return copied
+
+def verify_table(src: sqlite3.Connection, table: str, columns: List[str], chunk_size: int) -> bool:
+    source = TableChecksum()
+    cur = src.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            source.add(row)
+
+    target = TableChecksum()
+    for _, _, rows in iter_table_chunks([table], chunk_size):
+        for row in rows:
+            target.add(row[col] for col in columns)
+
+    ok = source.rows == target.rows and source.total == target.total
+    if ok:
+        logger.info(f"✅ {table}: {target.rows} filas, checksum {target.total:016x}")
+    else:
+        logger.error(
+            f"❌ {table}: SQLite {source.rows} filas / {source.total:016x} "
+            f"≠ PostgreSQL {target.rows} filas / {target.total:016x}"
+        )
+    return ok
+
+def migrate(sqlite_path: str, chunk_size: int = 5000) -> bool:
+    if not database.USE_POSTGRES:
+        raise SystemExit("❌ Define DATABASE_URL con el PostgreSQL de destino")
+
+    src = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+    progress = migration_progress()
+    if not progress:
+        # Solo en la primera ejecución: al reanudar, el backfill de ordinales de init_db
+        # chocaría con los que aún faltan por copiar
+        init_db()
+
+    source_tables = _sqlite_tables(src)
+    tables = [t for t in BACKUP_TABLES if t in source_tables]
+    plan = {}
+    for table in tables:
+        target = set(table_columns(table))
+        columns = [col for col in _sqlite_columns(src, table) if col in target]
+        missing = set(_sqlite_columns(src, table)) - target
+        if missing:
+            logger.warning(f"⚠️ {table}: columnas sin equivalente en PostgreSQL: {sorted(missing)}")
+        plan[table] = columns
+
+        state = progress.get(table, {})
+        if not state and count_rows(table):
+            raise SystemExit(f"❌ La tabla {table} ya tiene datos en PostgreSQL y no hay migración en curso")
+
+    for table in tables:
+        state = progress.get(table, {})
+        if state.get("done"):
+            logger.info(f"⏭ {table}: ya migrada ({state['rows']} filas)")
+            continue
+        copy_table(src, table, plan[table], state, chunk_size)
+
+    reset_sequences()
+    logger.info("🔢 Secuencias alineadas")
+
+    ok = all([verify_table(src, table, plan[table], chunk_size) for table in tables])
+    src.close()
+    if ok:
+        logger.info("🎉 Migración completa y verificada. Arranca el bot con DATABASE_URL")
+    return ok
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Migra casos.db (SQLite) a PostgreSQL (DATABASE_URL)")
+    parser.add_argument("--sqlite", default="casos.db", help="Ruta del archivo SQLite de origen")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+    sys.exit(0 if migrate(args.sqlite, args.chunk_size) else 1)
+
+if __name__ == "__main__":
+    main()
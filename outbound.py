@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Planificador de envíos a Telegram
+Todas las peticiones de envío del bot pasan por aquí (rate limiter de PTB):
+cubeta de tokens global, intervalo mínimo por chat, prioridad y
+adaptación automática cuando Telegram responde RetryAfter.
+"""
+import asyncio
+import datetime as dt
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+import metrics
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Menor número = sale antes. Se pasa como rate_limit_args=PRIORITY_...
+PRIORITY_HIGH = 0     # respuestas del quiz (por defecto)
+PRIORITY_NORMAL = 5   # material pesado pedido por el usuario (justificaciones)
+PRIORITY_BULK = 10    # difusiones masivas
+
+# Solo los métodos que envían o editan mensajes cuentan para los límites
+_LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+
+class OutboundScheduler(BaseRateLimiter[int]):
+    def __init__(self, global_rate: float = 30, chat_interval: float = 0.3,
+                 group_per_minute: int = 20, max_retries: int = 3):
+        self._max_rate = global_rate
+        self._rate = global_rate
+        self._min_rate = max(1.0, global_rate / 10)
+        self._tokens = global_rate
+        self._last_refill = time.monotonic()
+        self._chat_interval = chat_interval
+        self._group_interval = 60 / group_per_minute
+        self._max_retries = max_retries
+
+        self._next_chat_slot: Dict[Union[int, str], float] = {}
+        self._waiters: List = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats = {"sent": 0, "retry_after": 0, "failed": 0}
+
+    async def initialize(self) -> None:
+        # PTB lo llama dos veces (Application y Updater inicializan el mismo bot)
+        if self._dispatcher and not self._dispatcher.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        for _, _, fut in self._waiters:
+            fut.cancel()
+        self._waiters.clear()
+
+    def stats(self) -> dict:
+        return dict(self._stats, queued=len(self._waiters), rate=round(self._rate, 2))
+
+    # ====== Cubeta global ======
+
+    def _refill(self, now: float):
+        self._tokens = min(self._max_rate, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _delay(self) -> float:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        return max(0.001, (1 - self._tokens) / self._rate)
+
+    async def _acquire(self, priority: int):
+        if not self._waiters and self._take_token():
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._wakeup.set()
+        await fut
+
+    async def _dispatch(self):
+        while True:
+            # Descartar esperas canceladas antes de gastar un token
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                self._wakeup.clear()
+                self._prune_chat_slots()
+                await self._wakeup.wait()
+                continue
+            if self._take_token():
+                _, _, fut = heapq.heappop(self._waiters)
+                fut.set_result(None)
+                continue
+            await asyncio.sleep(self._delay())
+
+    # ====== Límite por chat ======
+
+    async def _wait_chat(self, chat_id):
+        if chat_id is None:
+            return
+        group = isinstance(chat_id, str) or chat_id < 0
+        interval = self._group_interval if group else self._chat_interval
+        now = time.monotonic()
+        slot = max(now, self._next_chat_slot.get(chat_id, 0.0))
+        self._next_chat_slot[chat_id] = slot + interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _prune_chat_slots(self):
+        now = time.monotonic()
+        for chat_id in [cid for cid, slot in self._next_chat_slot.items() if slot < now]:
+            del self._next_chat_slot[chat_id]
+
+    # ====== Adaptación ======
+
+    def _on_success(self):
+        self._stats["sent"] += 1
+        if self._rate < self._max_rate:
+            self._rate = min(self._max_rate, self._rate + 0.1)
+
+    def _on_retry_after(self, retry_after: float):
+        self._stats["retry_after"] += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        self._rate = max(self._min_rate, self._rate / 2)
+        logger.warning(f"⚠️ RetryAfter {retry_after}s: pausa global y ritmo bajado a {self._rate:.1f} msg/s")
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if not endpoint.startswith(_LIMITED_PREFIXES):
+            try:
+                with span("telegram", endpoint):
+                    return await callback(*args, **kwargs)
+            except TelegramError as exc:
+                metrics.telegram_errors.inc(type(exc).__name__)
+                raise
+
+        priority = PRIORITY_HIGH if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+
+        attempt = 0
+        while True:
+            with span("throttle", endpoint):
+                await self._wait_chat(chat_id)
+                await self._acquire(priority)
+            try:
+                with span("telegram", endpoint):
+                    result = await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                metrics.telegram_errors.inc("RetryAfter")
+                retry_after = exc.retry_after
+                if isinstance(retry_after, dt.timedelta):
+                    retry_after = retry_after.total_seconds()
+                self._on_retry_after(float(retry_after))
+                attempt += 1
+                if attempt > self._max_retries:
+                    self._stats["failed"] += 1
+                    raise
+                continue
+            except TelegramError as exc:
+                metrics.telegram_errors.inc(type(exc).__name__)
+                raise
+            self._on_success()
+            return result
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Banco de pruebas del pool PostgreSQL matando backends con pg_terminate_backend
+
+  DATABASE_URL=postgresql://... python pool_bench.py --seconds 20 --kill-every 1
+
+DB_POOL_MAX hilos (como el ejecutor de storage.py) hacen consultas, sueltas
+y en transacción, por database.py mientras otro hilo termina cada
+--kill-every segundos todos los backends del pool. Solo se matan los que se
+conectaron con application_name pool_bench (PGAPPNAME), nunca los de un bot
+en marcha contra la misma BD.
+
+Comprueba que:
+  - ninguna petición se queda esperando un hueco (PoolError por timeout);
+  - devolver una conexión muerta con una transacción abierta no pierde el hueco;
+  - al terminar no hay huecos perdidos (size == idle) y el pool vuelve a minconn.
+Las consultas que estaban en vuelo al matar su backend fallan (se cuentan
+aparte); la siguiente ya sale por una conexión nueva. Sale con código 1 si
+alguna comprobación falla.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+APP_NAME = "pool_bench"
+os.environ["PGAPPNAME"] = APP_NAME
+
+import psycopg2
+import psycopg2.pool
+
+import database
+from config import DB_POOL_MAX
+from database import USE_POSTGRES, DATABASE_URL, init_db, count_cases, pool_stats
+
+logger = logging.getLogger(__name__)
+
+def terminate_backends() -> int:
+    conn = psycopg2.connect(DATABASE_URL, application_name=f"{APP_NAME}_killer")
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT count(pg_terminate_backend(pid)) FROM pg_stat_activity "
+                "WHERE application_name=%s AND pid <> pg_backend_pid()",
+                (APP_NAME,)
+            )
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+def query_in_transaction():
+    with database._get_conn() as conn:
+        with database._transaction(conn):
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) AS n FROM case_ordinals")
+                cur.fetchone()
+
+def worker(stop: threading.Event, results: Counter, latencies: list):
+    calls = [count_cases, query_in_transaction]
+    i = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            calls[i % len(calls)]()
+            results["ok"] += 1
+            latencies.append(time.perf_counter() - started)
+        except psycopg2.pool.PoolError:
+            results["pool_timeout"] += 1
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            results["killed_in_flight"] += 1
+        i += 1
+
+def killer(stop: threading.Event, every: float, kills: Counter):
+    while not stop.wait(every):
+        kills["rounds"] += 1
+        kills["backends"] += terminate_backends()
+
+def check_dead_rollback() -> bool:
+    """Devuelve al pool una conexión con transacción abierta cuyo backend ya no existe"""
+    pool = database._get_pool()
+    before = pool.stats()
+    conn = pool.getconn()
+    conn.autocommit = False
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    terminate_backends()
+    time.sleep(0.1)
+    try:
+        pool.putconn(conn)
+    except psycopg2.Error as e:
+        print(f"❌ putconn con el backend muerto lanzó {type(e).__name__}: {e}")
+        return False
+    after = pool.stats()
+    ok = after["in_use"] == 0 and after["size"] >= after["min"] and after["discarded"] > before["discarded"]
+    print(f"{'✅' if ok else '❌'} Rollback sobre conexión muerta: descartada y repuesta "
+          f"(size {after['size']}, idle {after['idle']}, descartadas {after['discarded'] - before['discarded']})")
+    return ok
+
+def bench(threads: int, seconds: float, kill_every: float) -> bool:
+    ok = check_dead_rollback()
+
+    stop = threading.Event()
+    results: Counter = Counter()
+    kills: Counter = Counter()
+    latencies: list = []
+    workers = [threading.Thread(target=worker, args=(stop, results, latencies)) for _ in range(threads)]
+    killer_thread = threading.Thread(target=killer, args=(stop, kill_every, kills))
+    for thread in workers + [killer_thread]:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in workers + [killer_thread]:
+        thread.join()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1e3 if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e3 if latencies else 0
+    print(f"🔪 {kills['rounds']} rondas, {kills['backends']} backends terminados")
+    print(f"📊 {results['ok']} consultas ok (p50 {p50:.1f} ms, p99 {p99:.1f} ms), "
+          f"{results['killed_in_flight']} cortadas en vuelo, {results['pool_timeout']} timeouts del pool")
+    if results["pool_timeout"]:
+        print("❌ Hubo peticiones sin hueco en el pool")
+        ok = False
+
+    # Tras la última ronda la primera consulta de cada conexión detecta la caída y reconecta
+    for _ in range(threads * 2):
+        count_cases()
+    stats = pool_stats()
+    print(f"🏊 Pool final: {stats}")
+    if stats["in_use"] != 0 or stats["size"] != stats["idle"]:
+        print("❌ Huecos perdidos: size no coincide con las conexiones ociosas")
+        ok = False
+    if not stats["min"] <= stats["size"] <= stats["max"]:
+        print("❌ El pool no volvió a minconn o superó maxconn")
+        ok = False
+    if ok:
+        print("✅ Sin huecos perdidos ni esperas infinitas")
+    return ok
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.ERROR)
+    parser = argparse.ArgumentParser(description="Pool PostgreSQL bajo pg_terminate_backend")
+    parser.add_argument("--threads", type=int, default=DB_POOL_MAX, help="Más que DB_POOL_MAX mide también las esperas")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--kill-every", type=float, default=1.0)
+    args = parser.parse_args()
+    if not USE_POSTGRES:
+        sys.exit("pool_bench.py necesita DATABASE_URL (PostgreSQL)")
+
+    init_db()
+    ok = bench(args.threads, args.seconds, args.kill_every)
+    database.close_pool()
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
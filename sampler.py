@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Muestreo ponderado de casos sin pasar por todo el catálogo
+Un árbol de Fenwick por especialidad guarda el peso de cada caso: sortear,
+cambiar un peso, añadir o quitar un caso cuestan O(log n). La especialidad se
+elige primero (por cuota, o por su peso total), después el caso dentro de ella.
+
+Sin reemplazo y excluyendo lo ya visto: cada caso sorteado o visto se pone a
+peso 0 durante la petición y se restaura al terminar, así que nunca se
+rechaza dos veces el mismo caso.
+
+Pesos (todos opcionales, ver config.py):
+- SAMPLER_SPECIALTY_QUOTAS: "CARDIO:3,NEURO:1" reparte los sorteos por especialidad
+- SAMPLER_DIFFICULTY_BIAS: más peso a casos con p bajo (según analytics.py)
+- SAMPLER_RECENCY_HALF_LIFE: el peso se duplica cada N casos subidos después
+"""
+import logging
+import math
+import random
+import threading
+from typing import Collection, Dict, List, Optional, Tuple
+
+from config import SAMPLER_SPECIALTY_QUOTAS, SAMPLER_DIFFICULTY_BIAS, SAMPLER_RECENCY_HALF_LIFE
+from catalog import case_catalog
+from database import parse_case_id
+
+logger = logging.getLogger(__name__)
+
+_EPSILON = 1e-9
+# Exponente máximo de recencia antes de re-basar todos los pesos (evita desbordes)
+_MAX_RECENCY_EXPONENT = 60
+
+class FenwickTree:
+    """Sumas prefijas de pesos con actualización y búsqueda en O(log n)"""
+    def __init__(self, weights: Optional[List[float]] = None):
+        self._weights = list(weights or [])
+        self._tree = [0.0] * (len(self._weights) + 1)
+        self.total = 0.0
+        self._build()
+
+    def _build(self):
+        n = len(self._weights)
+        tree = [0.0] + self._weights[:]
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self.total = math.fsum(self._weights)
+
+    def __len__(self) -> int:
+        return len(self._weights)
+
+    def weight(self, pos: int) -> float:
+        return self._weights[pos]
+
+    def append(self, weight: float) -> int:
+        self._weights.append(0.0)
+        self._tree.append(0.0)
+        n = len(self._weights)
+        # El nodo nuevo cubre (n - lowbit(n), n]: sumar los hijos ya existentes
+        child = n - 1
+        low = n - (n & -n)
+        while child > low:
+            self._tree[n] += self._tree[child]
+            child -= child & -child
+        pos = n - 1
+        self.set(pos, weight)
+        return pos
+
+    def set(self, pos: int, weight: float):
+        delta = weight - self._weights[pos]
+        if not delta:
+            return
+        self._weights[pos] = weight
+        self.total += delta
+        i = pos + 1
+        n = len(self._weights)
+        while i <= n:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, value: float) -> int:
+        """Posición cuyo intervalo acumulado contiene `value` (0 <= value < total)"""
+        pos = 0
+        n = len(self._weights)
+        step = 1 << n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= n and self._tree[nxt] <= value:
+                value -= self._tree[nxt]
+                pos = nxt
+            step >>= 1
+        return min(pos, n - 1)
+
+    def rebuild(self):
+        """Recalcula desde los pesos para eliminar el error de coma flotante acumulado"""
+        self._build()
+
+def _parse_quotas(raw: str) -> Dict[str, float]:
+    quotas = {}
+    for part in raw.split(","):
+        name, _, value = part.partition(":")
+        if name.strip():
+            quotas[name.strip().upper()] = float(value or 1)
+    return quotas
+
+class WeightedSampler:
+    def __init__(self, quotas: Dict[str, float], difficulty_bias: float, recency_half_life: float):
+        self._lock = threading.Lock()
+        self._quotas = quotas
+        self._difficulty_bias = difficulty_bias
+        self._half_life = recency_half_life
+        self._recency_base = 0
+        self._difficulty: Dict[str, float] = {}
+        self._trees: Dict[str, FenwickTree] = {}
+        self._slots: Dict[str, Tuple[str, int]] = {}     # case_id -> (especialidad, posición)
+        self._cases: Dict[str, List[Optional[str]]] = {}  # especialidad -> posición -> case_id
+        self._free: Dict[str, List[int]] = {}             # posiciones libres por especialidad
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # ====== Pesos ======
+
+    @staticmethod
+    def _specialty(case_id: str) -> str:
+        return (parse_case_id(case_id)['specialty'] or "-").upper()
+
+    def _weight(self, case_id: str, ordinal: int) -> float:
+        weight = 1.0
+        if self._difficulty_bias:
+            p_value = self._difficulty.get(case_id, 0.5)
+            weight *= 1 + self._difficulty_bias * (1 - p_value)
+        if self._half_life:
+            weight *= 2 ** ((ordinal - self._recency_base) / self._half_life)
+        return weight
+
+    def _needs_rebase(self, ordinal: int) -> bool:
+        return bool(self._half_life) and (ordinal - self._recency_base) / self._half_life > _MAX_RECENCY_EXPONENT
+
+    # ====== Mantenimiento (lo llama el catálogo) ======
+
+    def on_load(self, rows: Collection[Tuple[str, int]]):
+        with self._lock:
+            self._rebuild(rows)
+        logger.info(f"🎲 Muestreador ponderado: {len(self._slots)} casos en {len(self._trees)} especialidades")
+
+    def _rebuild(self, rows: Collection[Tuple[str, int]]):
+        if self._half_life and rows:
+            # Que el caso más nuevo tenga exponente 0: los viejos tienden a 0, nunca a infinito
+            self._recency_base = max(ordinal for _, ordinal in rows)
+        by_specialty: Dict[str, List[Tuple[str, int]]] = {}
+        for case_id, ordinal in rows:
+            by_specialty.setdefault(self._specialty(case_id), []).append((case_id, ordinal))
+        self._trees, self._slots, self._cases, self._free = {}, {}, {}, {}
+        for specialty, items in by_specialty.items():
+            self._trees[specialty] = FenwickTree([self._weight(case_id, ordinal) for case_id, ordinal in items])
+            self._cases[specialty] = [case_id for case_id, _ in items]
+            self._free[specialty] = []
+            for pos, (case_id, _) in enumerate(items):
+                self._slots[case_id] = (specialty, pos)
+
+    def _live_rows(self) -> List[Tuple[str, int]]:
+        return [(case_id, case_catalog.ordinal(case_id) or 0) for case_id in self._slots]
+
+    def on_add(self, case_id: str, ordinal: int):
+        with self._lock:
+            if case_id in self._slots:
+                return
+            if self._needs_rebase(ordinal):
+                self._rebuild(self._live_rows() + [(case_id, ordinal)])
+                return
+            specialty = self._specialty(case_id)
+            tree = self._trees.get(specialty)
+            if tree is None:
+                tree = self._trees[specialty] = FenwickTree()
+                self._cases[specialty] = []
+                self._free[specialty] = []
+            weight = self._weight(case_id, ordinal)
+            if self._free[specialty]:
+                pos = self._free[specialty].pop()
+                tree.set(pos, weight)
+                self._cases[specialty][pos] = case_id
+            else:
+                pos = tree.append(weight)
+                self._cases[specialty].append(case_id)
+            self._slots[case_id] = (specialty, pos)
+
+    def on_discard(self, case_id: str, ordinal: int):
+        with self._lock:
+            slot = self._slots.pop(case_id, None)
+            if slot is None:
+                return
+            specialty, pos = slot
+            self._trees[specialty].set(pos, 0.0)
+            self._cases[specialty][pos] = None
+            self._free[specialty].append(pos)
+
+    def update_difficulty(self, p_values: Dict[str, Optional[float]]):
+        """Nuevos p por caso (analytics.py); solo cambia los pesos si hay sesgo por dificultad"""
+        if not self._difficulty_bias:
+            return
+        with self._lock:
+            self._difficulty = {case_id: p for case_id, p in p_values.items() if p is not None}
+            for case_id, (specialty, pos) in self._slots.items():
+                self._trees[specialty].set(pos, self._weight(case_id, case_catalog.ordinal(case_id) or 0))
+            for tree in self._trees.values():
+                tree.rebuild()
+
+    # ====== Sorteo ======
+
+    def _pick_specialty(self, rng: random.Random) -> Optional[str]:
+        candidates = []
+        for specialty, tree in self._trees.items():
+            if tree.total > _EPSILON:
+                share = self._quotas.get(specialty, 1.0) if self._quotas else tree.total
+                if share > 0:
+                    candidates.append((specialty, share))
+        if not candidates:
+            return None
+        value = rng.random() * sum(share for _, share in candidates)
+        for specialty, share in candidates:
+            value -= share
+            if value < 0:
+                return specialty
+        return candidates[-1][0]
+
+    def sample(self, count: int, exclude: Collection[str] = (), rng: Optional[random.Random] = None) -> List[str]:
+        """Hasta `count` casos distintos, ponderados, que no estén en `exclude`"""
+        rng = rng or random
+        selected: List[str] = []
+        zeroed: List[Tuple[FenwickTree, int, float]] = []
+        with self._lock:
+            try:
+                while len(selected) < count:
+                    specialty = self._pick_specialty(rng)
+                    if specialty is None:
+                        break
+                    tree = self._trees[specialty]
+                    pos = tree.find(rng.random() * tree.total)
+                    weight = tree.weight(pos)
+                    if weight <= 0:
+                        # Residuo de coma flotante: el árbol está en realidad vacío
+                        tree.rebuild()
+                        continue
+                    zeroed.append((tree, pos, weight))
+                    tree.set(pos, 0.0)
+                    case_id = self._cases[specialty][pos]
+                    if case_id not in exclude:
+                        selected.append(case_id)
+            finally:
+                for tree, pos, weight in reversed(zeroed):
+                    tree.set(pos, weight)
+        return selected
+
+case_sampler = WeightedSampler(
+    _parse_quotas(SAMPLER_SPECIALTY_QUOTAS), SAMPLER_DIFFICULTY_BIAS, SAMPLER_RECENCY_HALF_LIFE
+)
+case_catalog.subscribe(case_sampler)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Banco de pruebas del muestreo de casos, en memoria y sin BD
+
+  python sampler_bench.py --cases 20000 50000 --seen 0 1000 10000 --count 10
+
+Compara, por tamaño de catálogo y de historial visto, el modo "memory"
+(diferencia de conjuntos + random.sample) con sampler.WeightedSampler sin pesos
+y con cuotas, dificultad y recencia activadas. También mide el coste de
+save_case/delete_case sobre el muestreador (mantenimiento incremental).
+"""
+import argparse
+import logging
+import random
+import time
+from collections import Counter
+from typing import Callable, List, Tuple
+
+from sampler import WeightedSampler
+
+SPECIALTIES = ["CARDIO", "NEURO", "PEDIA", "GINECO", "NEFRO", "INFECTO", "ENDOCRINO", "NEUMO"]
+
+def synthetic_catalog(size: int) -> List[Tuple[str, int]]:
+    rows = []
+    for ordinal in range(1, size + 1):
+        specialty = SPECIALTIES[ordinal % len(SPECIALTIES)]
+        rows.append((f"###CASE_{ordinal:06d}_{specialty}_TEMA{ordinal % 40}", ordinal))
+    return rows
+
+def timed(fn: Callable, repeat: int) -> float:
+    """Microsegundos por llamada"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def bench(sizes: List[int], seen_sizes: List[int], count: int, repeat: int):
+    rng = random.Random(7)
+    print(f"{'casos':>7} {'vistos':>7} {'set-difference':>15} {'uniforme':>10} {'ponderado':>10}  (µs por petición)")
+    for size in sizes:
+        rows = synthetic_catalog(size)
+        all_cases = frozenset(case_id for case_id, _ in rows)
+        uniform = WeightedSampler({}, 0, 0)
+        uniform.on_load(rows)
+        weighted = WeightedSampler({"CARDIO": 3, "NEURO": 2}, 2.0, size / 4)
+        weighted._difficulty = {case_id: rng.random() for case_id, _ in rows}
+        weighted.on_load(rows)
+
+        for seen_size in seen_sizes:
+            if seen_size >= size:
+                continue
+            seen = set(rng.sample(sorted(all_cases), seen_size))
+
+            def set_difference():
+                available = all_cases - seen
+                random.sample(list(available), min(count, len(available)))
+
+            print(
+                f"{size:>7} {seen_size:>7} "
+                f"{timed(set_difference, repeat):>15.1f} "
+                f"{timed(lambda: uniform.sample(count, seen, rng), repeat):>10.1f} "
+                f"{timed(lambda: weighted.sample(count, seen, rng), repeat):>10.1f}"
+            )
+
+        removed = rows[:repeat]
+        discard = timed(lambda: weighted.on_discard(*removed.pop()), len(removed))
+        readd = iter(rows[:repeat])
+        add = timed(lambda: weighted.on_add(*next(readd)), repeat)
+        print(f"{'':>7} mantenimiento: delete_case {discard:.1f} µs · save_case {add:.1f} µs")
+
+        # Comprobación de reparto: CARDIO 3, NEURO 2 y el resto 1 → CARDIO ≈ 3/11 (27%), NEURO ≈ 18%
+        draws = Counter(
+            case_id.split("_")[2] for _ in range(2000) for case_id in weighted.sample(count, rng=rng)
+        )
+        total = sum(draws.values())
+        share = ", ".join(f"{name} {n / total:.0%}" for name, n in draws.most_common(3))
+        print(f"{'':>7} reparto ponderado: {share}")
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Compara set-difference con el muestreo ponderado")
+    parser.add_argument("--cases", type=int, nargs="+", default=[5000, 20000, 100000])
+    parser.add_argument("--seen", type=int, nargs="+", default=[0, 1000, 4000])
+    parser.add_argument("--count", type=int, default=10, help="Casos por petición (/random_cases)")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    bench(args.cases, args.seen, args.count, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Almacén de sesiones de casos
+Caché LRU/TTL en memoria con escritura diferida (write-behind) a la BD:
+las sesiones sobreviven a reinicios sin una escritura síncrona por respuesta.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import SESSION_CACHE_SIZE, SESSION_TTL, SESSION_MAX_AGE
+from storage import get_cases_by_ids, load_session, save_sessions, delete_sessions, purge_expired_sessions
+
+logger = logging.getLogger(__name__)
+
+# Claves cortas para la forma persistida
+_COMPACT_KEYS = {
+    "cases": "c",
+    "current_index": "i",
+    "correct_count": "k",
+    "current_case": "cc",
+    "correct_answer": "a",
+}
+_EXPANDED_KEYS = {v: k for k, v in _COMPACT_KEYS.items()}
+
+# Datos derivados que no se persisten: se recargan al restaurar la sesión
+_TRANSIENT_KEYS = {"rows"}
+
+def encode_session(session: dict) -> str:
+    compact = {_COMPACT_KEYS.get(k, k): v for k, v in session.items() if k not in _TRANSIENT_KEYS}
+    return json.dumps(compact, separators=(",", ":"), ensure_ascii=False)
+
+def decode_session(data: str) -> dict:
+    return {_EXPANDED_KEYS.get(k, k): v for k, v in json.loads(data).items()}
+
+class SessionStore:
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._cache: "OrderedDict[int, list]" = OrderedDict()  # user_id -> [sesión, último acceso]
+        self._dirty = set()
+        self._pending: Dict[int, str] = {}  # desalojadas sucias, aún sin escribir
+        self._deleted = set()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        entry = self._cache.get(user_id)
+        now = time.monotonic()
+        if entry is not None:
+            if now - entry[1] <= self._ttl:
+                entry[1] = now
+                self._cache.move_to_end(user_id)
+                return entry[0]
+            self._evict(user_id)
+
+        if user_id in self._deleted:
+            return None
+        data = self._pending.get(user_id)
+        if data is None:
+            data = await load_session(user_id, SESSION_MAX_AGE)
+        if data is None:
+            return None
+
+        session = decode_session(data)
+        session["rows"] = await get_cases_by_ids(session["cases"][session["current_index"]:])
+        if user_id in self._cache:
+            # Otra corrutina la restauró mientras esperábamos
+            return self._cache[user_id][0]
+        self._insert(user_id, session)
+        return session
+
+    def put(self, user_id: int, session: dict):
+        self._deleted.discard(user_id)
+        self._insert(user_id, session)
+        self._dirty.add(user_id)
+
+    def mark_dirty(self, user_id: int):
+        if user_id in self._cache:
+            self._dirty.add(user_id)
+
+    def delete(self, user_id: int):
+        self._cache.pop(user_id, None)
+        self._dirty.discard(user_id)
+        self._pending.pop(user_id, None)
+        self._deleted.add(user_id)
+
+    def _insert(self, user_id: int, session: dict):
+        self._cache[user_id] = [session, time.monotonic()]
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self._max_size:
+            oldest = next(iter(self._cache))
+            self._evict(oldest)
+
+    def _evict(self, user_id: int):
+        session, _ = self._cache.pop(user_id)
+        if user_id in self._dirty:
+            self._dirty.discard(user_id)
+            self._pending[user_id] = encode_session(session)
+
+    def _sweep(self):
+        now = time.monotonic()
+        expired = [uid for uid, (_, last) in self._cache.items() if now - last > self._ttl]
+        for user_id in expired:
+            self._evict(user_id)
+
+    async def flush(self):
+        """Escribe en lote las sesiones modificadas y borra las terminadas"""
+        self._sweep()
+        batch = dict(self._pending)
+        for user_id in self._dirty:
+            batch[user_id] = encode_session(self._cache[user_id][0])
+        deleted = list(self._deleted)
+        self._pending.clear()
+        self._dirty.clear()
+        self._deleted.clear()
+
+        try:
+            if batch:
+                await save_sessions(list(batch.items()))
+            if deleted:
+                await delete_sessions(deleted)
+        except Exception:
+            # Reintentar en el siguiente ciclo sin pisar cambios más recientes
+            for user_id, data in batch.items():
+                if user_id not in self._dirty and user_id not in self._deleted:
+                    self._pending.setdefault(user_id, data)
+            self._deleted.update(uid for uid in deleted if uid not in self._cache)
+            raise
+
+        if batch or deleted:
+            logger.info(f"💾 Sesiones guardadas: {len(batch)}, cerradas: {len(deleted)}")
+
+session_store = SessionStore(SESSION_CACHE_SIZE, SESSION_TTL)
+
+async def flush_sessions_job(context):
+    try:
+        await session_store.flush()
+    except Exception as e:
+        logger.error(f"❌ Error guardando sesiones: {e}")
+
+async def purge_sessions_job(context):
+    removed = await purge_expired_sessions(SESSION_MAX_AGE)
+    if removed:
+        logger.info(f"🧹 Sesiones caducadas eliminadas: {removed}")
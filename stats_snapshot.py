@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Instantánea de estadísticas para el panel de admin
+Un job la recalcula cada STATS_REFRESH_INTERVAL segundos con consultas
+agregadas; el panel solo lee la última, sin tocar la BD.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from config import TZ
+from storage import get_admin_stats
+
+logger = logging.getLogger(__name__)
+
+class StatsSnapshot:
+    def __init__(self):
+        self.data: Optional[dict] = None
+        self.updated_at = 0.0
+
+    async def refresh(self) -> dict:
+        today = datetime.now(tz=TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+        day_start = int(today.timestamp())
+        week_start = int((today - timedelta(days=6)).timestamp())
+        started = time.perf_counter()
+        self.data = await get_admin_stats(day_start, week_start)
+        self.updated_at = time.time()
+        logger.info(f"📊 Estadísticas de admin recalculadas en {time.perf_counter() - started:.2f}s")
+        return self.data
+
+    async def get(self) -> dict:
+        if self.data is None:
+            return await self.refresh()
+        return self.data
+
+    def age(self) -> float:
+        return time.time() - self.updated_at
+
+stats_snapshot = StatsSnapshot()
+
+async def refresh_stats_job(context):
+    try:
+        await stats_snapshot.refresh()
+    except Exception as e:
+        logger.error(f"❌ Error recalculando estadísticas: {e}")
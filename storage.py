@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Capa asíncrona sobre database.py
+Cada función ejecuta la llamada síncrona en un pool de hilos acotado
+para no bloquear el event loop de PTB.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Tuple, Optional, Set
+
+import database
+import metrics
+from config import DB_WORKERS
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# SQLite comparte una sola conexión: un único hilo serializa las escrituras
+_executor = ThreadPoolExecutor(
+    max_workers=DB_WORKERS if database.USE_POSTGRES else 1,
+    thread_name_prefix="db"
+)
+
+async def _run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    name = func.__name__
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        with span("db", name):
+            return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        metrics.db_queries.inc(name, status)
+        metrics.db_latency.observe(time.perf_counter() - start, name)
+
+def shutdown():
+    _executor.shutdown(wait=True)
+    database.close_pool()
+
+async def save_case(case_id: str, file_id: str, file_type: str, caption: str = "", correct_answer: str = ""):
+    return await _run(database.save_case, case_id, file_id, file_type, caption, correct_answer)
+
+async def delete_case(case_id: str):
+    return await _run(database.delete_case, case_id)
+
+async def save_justification(case_id: str, file_id: str, file_type: str, caption: str = ""):
+    return await _run(database.save_justification, case_id, file_id, file_type, caption)
+
+async def load_catalog():
+    return await _run(database.load_catalog)
+
+async def get_all_case_ids() -> List[str]:
+    return await _run(database.get_all_case_ids)
+
+async def get_case_by_id(case_id: str) -> Optional[Tuple]:
+    return await _run(database.get_case_by_id, case_id)
+
+async def get_cases_by_ids(case_ids: List[str]) -> Dict[str, Tuple]:
+    return await _run(database.get_cases_by_ids, case_ids)
+
+async def get_justifications_for_case(case_id: str) -> List[Tuple[str, str, str]]:
+    return await _run(database.get_justifications_for_case, case_id)
+
+async def get_user_sent_cases(user_id: int) -> Set[str]:
+    return await _run(database.get_user_sent_cases, user_id)
+
+async def sample_unseen_case_ids(user_id: int, count: int) -> Tuple[List[str], int]:
+    return await _run(database.sample_unseen_case_ids, user_id, count)
+
+async def filter_sent_cases(user_id: int, case_ids: List[str]) -> Set[str]:
+    return await _run(database.filter_sent_cases, user_id, case_ids)
+
+async def save_user_sent_case(user_id: int, case_id: str):
+    return await _run(database.save_user_sent_case, user_id, case_id)
+
+async def reset_user_sent_cases(user_id: int):
+    return await _run(database.reset_user_sent_cases, user_id)
+
+async def get_user_deck(user_id: int) -> Optional[dict]:
+    return await _run(database.get_user_deck, user_id)
+
+async def get_last_catalog_change() -> int:
+    return await _run(database.get_last_catalog_change)
+
+async def save_user_deck(user_id: int, deck: dict):
+    return await _run(database.save_user_deck, user_id, deck)
+
+async def load_session(user_id: int, max_age: int) -> Optional[str]:
+    return await _run(database.load_session, user_id, max_age)
+
+async def save_sessions(items: List[Tuple[int, str]]):
+    return await _run(database.save_sessions, items)
+
+async def delete_sessions(user_ids: List[int]):
+    return await _run(database.delete_sessions, user_ids)
+
+async def purge_expired_sessions(max_age: int) -> int:
+    return await _run(database.purge_expired_sessions, max_age)
+
+async def save_user_response(user_id: int, case_id: str, answer: str, is_correct: int):
+    return await _run(database.save_user_response, user_id, case_id, answer, is_correct)
+
+async def increment_case_stat(case_id: str, answer: str):
+    return await _run(database.increment_case_stat, case_id, answer)
+
+async def get_case_stats(case_id: str) -> dict:
+    return await _run(database.get_case_stats, case_id)
+
+async def record_answer(user_id: int, case_id: str, answer: str, is_correct: int, update_case_stats: bool = True) -> Optional[dict]:
+    return await _run(database.record_answer, user_id, case_id, answer, is_correct, update_case_stats)
+
+async def add_case_stats(increments: List[Tuple[str, str, int]]):
+    return await _run(database.add_case_stats, increments)
+
+async def get_or_create_user(user_id: int, username: str = "", first_name: str = "") -> dict:
+    return await _run(database.get_or_create_user, user_id, username, first_name)
+
+async def get_daily_progress(user_id: int) -> int:
+    return await _run(database.get_daily_progress, user_id)
+
+async def increment_daily_progress(user_id: int):
+    return await _run(database.increment_daily_progress, user_id)
+
+async def set_user_limit(user_id: int, limit: int):
+    return await _run(database.set_user_limit, user_id, limit)
+
+async def set_user_subscriber(user_id: int, is_sub: int):
+    return await _run(database.set_user_subscriber, user_id, is_sub)
+
+async def update_user_stats(user_id: int, is_correct: int):
+    return await _run(database.update_user_stats, user_id, is_correct)
+
+async def get_all_users() -> List[int]:
+    return await _run(database.get_all_users)
+
+async def get_subscribers() -> List[int]:
+    return await _run(database.get_subscribers)
+
+async def count_cases() -> int:
+    return await _run(database.count_cases)
+
+async def get_admin_stats(day_start: int, week_start: int) -> dict:
+    return await _run(database.get_admin_stats, day_start, week_start)
+
+async def get_responses_after(after_id: int, limit: int) -> List[tuple]:
+    return await _run(database.get_responses_after, after_id, limit)
+
+async def get_correct_answers() -> Dict[str, str]:
+    return await _run(database.get_correct_answers)
+
+async def save_analytics(case_rows: List[tuple], specialty_rows: List[tuple], watermark: Optional[int] = None):
+    return await _run(database.save_analytics, case_rows, specialty_rows, watermark)
+
+async def get_analytics_watermark() -> Optional[int]:
+    return await _run(database.get_analytics_watermark)
+
+async def get_case_analytics(order_by: str, limit: int = 5, min_responses: int = 10) -> List[dict]:
+    return await _run(database.get_case_analytics, order_by, limit, min_responses)
+
+async def get_specialty_analytics() -> List[tuple]:
+    return await _run(database.get_specialty_analytics)
+
+async def create_broadcast(created_by: int, audience: str, file_type: str, file_id: Optional[str], text: Optional[str]) -> int:
+    return await _run(database.create_broadcast, created_by, audience, file_type, file_id, text)
+
+async def get_broadcast(broadcast_id: int) -> Optional[dict]:
+    return await _run(database.get_broadcast, broadcast_id)
+
+async def get_latest_broadcast() -> Optional[dict]:
+    return await _run(database.get_latest_broadcast)
+
+async def get_running_broadcasts() -> List[dict]:
+    return await _run(database.get_running_broadcasts)
+
+async def get_broadcast_recipients(audience: str, after_user_id: int, limit: int) -> List[int]:
+    return await _run(database.get_broadcast_recipients, audience, after_user_id, limit)
+
+async def claim_broadcast_page(broadcast_id: int, last_user_id: int):
+    return await _run(database.claim_broadcast_page, broadcast_id, last_user_id)
+
+async def finish_broadcast_page(broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked_ids: List[int]) -> str:
+    return await _run(database.finish_broadcast_page, broadcast_id, last_user_id, sent, failed, blocked_ids)
+
+async def set_broadcast_status(broadcast_id: int, status: str):
+    return await _run(database.set_broadcast_status, broadcast_id, status)
+
+async def unblock_user(user_id: int):
+    return await _run(database.unblock_user, user_id)
+
+async def get_responses_before(cutoff: int, after_id: int, max_id: Optional[int], limit: int) -> List[tuple]:
+    return await _run(database.get_responses_before, cutoff, after_id, max_id, limit)
+
+async def apply_response_rollup(rollup_rows: List[tuple], first_id: int, last_id: int, cutoff: int) -> int:
+    return await _run(database.apply_response_rollup, rollup_rows, first_id, last_id, cutoff)
+
+async def purge_daily_progress(before_date: str, limit: int) -> int:
+    return await _run(database.purge_daily_progress, before_date, limit)
+
+async def get_response_rollups_after(after: Optional[tuple], limit: int) -> List[tuple]:
+    return await _run(database.get_response_rollups_after, after, limit)
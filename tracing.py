@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Trazas ligeras por update
+@traced abre una traza por update (o un span hijo si ya hay una abierta);
+storage.py y outbound.py añaden spans de BD y de la Bot API. Cada llamada
+cuenta además en las métricas de handlers (metrics.py). Las updates
+lentas se registran en el log con el desglose y quedan en un buffer
+circular que los admins pueden ver desde /admin.
+"""
+import functools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from config import TRACE_SLOW_THRESHOLD, TRACE_BUFFER_SIZE
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_SPANS_PER_TRACE = 200
+
+# Tipos de span que entran en el desglose (los "handler" anidados no, para no contar doble)
+BREAKDOWN_KINDS = ("db", "telegram", "throttle")
+_KIND_LABELS = {"db": "BD", "telegram": "Telegram", "throttle": "espera envío"}
+
+class Trace:
+    def __init__(self, name: str, user_id: Optional[int]):
+        self.name = name
+        self.user_id = user_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration = 0.0
+        self.spans: List[tuple] = []  # (tipo, nombre, segundos)
+        self.dropped = 0
+
+    def add(self, kind: str, name: str, duration: float):
+        if len(self.spans) < MAX_SPANS_PER_TRACE:
+            self.spans.append((kind, name, duration))
+        else:
+            self.dropped += 1
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def breakdown(self) -> dict:
+        totals = {kind: [0.0, 0] for kind in BREAKDOWN_KINDS}
+        for kind, _, duration in self.spans:
+            if kind in totals:
+                totals[kind][0] += duration
+                totals[kind][1] += 1
+        return totals
+
+    def summary(self) -> str:
+        totals = self.breakdown()
+        accounted = sum(total for total, _ in totals.values())
+        parts = [f"{_KIND_LABELS[kind]} {total:.2f}s ({count})" for kind, (total, count) in totals.items() if count]
+        parts.append(f"propio {max(0.0, self.duration - accounted):.2f}s")
+        return f"{self.name} [{self.user_id}] {self.duration:.2f}s | " + " · ".join(parts)
+
+    def slowest_spans(self, limit: int = 5) -> List[tuple]:
+        return sorted((s for s in self.spans if s[0] in BREAKDOWN_KINDS), key=lambda s: s[2], reverse=True)[:limit]
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+slow_traces: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+
+@contextmanager
+def span(kind: str, name: str):
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(kind, name, time.perf_counter() - start)
+
+def _user_id(update) -> Optional[int]:
+    user = getattr(update, "effective_user", None)
+    return user.id if user else None
+
+def traced(func):
+    """Decorador para handlers (update, context, ...)"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(update, context, *args, **kwargs):
+        start = time.perf_counter()
+        status = "ok"
+        parent = _current_trace.get()
+        trace = token = None
+        if parent is None:
+            trace = Trace(name, _user_id(update))
+            token = _current_trace.set(trace)
+        try:
+            if parent is not None:
+                with span("handler", name):
+                    return await func(update, context, *args, **kwargs)
+            return await func(update, context, *args, **kwargs)
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            metrics.handler_calls.inc(name, status)
+            metrics.handler_latency.observe(time.perf_counter() - start, name)
+            if trace is not None:
+                _current_trace.reset(token)
+                trace.finish()
+                if trace.duration >= TRACE_SLOW_THRESHOLD:
+                    slow_traces.append(trace)
+                    logger.warning(f"🐢 Update lenta: {trace.summary()}")
+    return wrapper
+
+def recent_slow_traces(limit: int = 10) -> List[Trace]:
+    return list(slow_traces)[-limit:][::-1]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Procesamiento concurrente de updates
+Usuarios distintos se atienden en paralelo (hasta MAX_CONCURRENT_UPDATES),
+pero las updates de un mismo usuario se procesan en orden de llegada, así
+que su sesión nunca la modifican dos handlers a la vez.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+def _update_key(update: object) -> Optional[Hashable]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # user_id -> [lock, updates esperando o en curso]
+        self._locks: Dict[Hashable, list] = {}
+
+    def active_users(self) -> int:
+        return len(self._locks)
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = _update_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # El turno del usuario se toma antes del semáforo global: un usuario con muchas
+        # updates en cola no ocupa plazas que podrían atender a otros
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Banco de pruebas del modo webhook, sin conexión a Telegram
+
+  # Terminal 1: el bot completo en modo webhook, con la Bot API simulada en local
+  python webhook_bench.py serve
+
+  # Terminal 2: enviar updates sintéticas y medir el ritmo de ingesta
+  python webhook_bench.py post --updates 5000 --concurrency 50 --users 200
+
+Con `post --url` se puede apuntar también a un bot real (con su WEBHOOK_SECRET).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from itertools import count
+from typing import Optional, Tuple
+
+import httpx
+from telegram.request import BaseRequest, RequestData
+
+from config import WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+logger = logging.getLogger(__name__)
+
+# ====== Bot API simulada ======
+
+class OfflineRequest(BaseRequest):
+    """Responde en local a todas las llamadas a la Bot API.
+    Con blocked_every=N los chats con id múltiplo de N responden 403 (bot bloqueado)."""
+    def __init__(self, latency: float = 0.0, blocked_every: int = 0):
+        self._latency = latency
+        self._blocked_every = blocked_every
+        self._message_ids = count(1)
+        self.calls = 0
+        self.sent_to = Counter()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method.startswith(("send", "edit", "forward")):
+            chat_id = params.get("chat_id", 1)
+            return {"message_id": next(self._message_ids), "date": int(time.time()),
+                    "chat": {"id": int(chat_id), "type": "private"}}
+        return True
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        self.calls += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if api_method.startswith("send") and "chat_id" in params:
+            chat_id = int(params["chat_id"])
+            if self._blocked_every and chat_id % self._blocked_every == 0:
+                payload = {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+                return 403, json.dumps(payload).encode("utf-8")
+            self.sent_to[chat_id] += 1
+        payload = {"ok": True, "result": self._result(api_method, params)}
+        return 200, json.dumps(payload).encode("utf-8")
+
+def serve(latency: float):
+    import main as bot_main
+    app = bot_main.build_application(request=OfflineRequest(latency))
+    local_url = f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}"
+    logger.info(f"🧪 Bot API simulada (latencia {latency * 1000:.0f} ms)")
+    bot_main.run_webhook(app, local_url)
+
+# ====== Generador de updates ======
+
+def synthetic_update(update_id: int, user_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"bench{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    kind = update_id % 4
+    if kind == 3:
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": "next_case",
+                "message": {"message_id": update_id, "date": int(time.time()), "chat": chat, "text": "caso"}
+            }
+        }
+    text = ["/random_cases", "A", "B"][kind]
+    message = {"message_id": update_id, "date": int(time.time()), "chat": chat, "from": user, "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+async def post(url: str, total: int, concurrency: int, users: int, secret: str):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    ids = count(1)
+    latencies = []
+    errors = 0
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        while True:
+            update_id = next(ids)
+            if update_id > total:
+                return
+            body = synthetic_update(update_id, 10_000 + update_id % users)
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json=body, headers=headers)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"📨 {total} updates en {elapsed:.2f}s → {total / elapsed:.0f} updates/s (errores: {errors})")
+    print(f"⏱ latencia p50 {pct(0.5):.1f} ms · p95 {pct(0.95):.1f} ms · p99 {pct(0.99):.1f} ms")
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Banco de pruebas del modo webhook")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="Levantar el bot en modo webhook con la Bot API simulada")
+    p_serve.add_argument("--latency", type=float, default=0.0, help="Latencia simulada por llamada (s)")
+
+    p_post = sub.add_parser("post", help="Enviar updates sintéticas al webhook")
+    p_post.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+    p_post.add_argument("--updates", type=int, default=2000)
+    p_post.add_argument("--concurrency", type=int, default=20)
+    p_post.add_argument("--users", type=int, default=100)
+    p_post.add_argument("--secret", default=WEBHOOK_SECRET)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.latency)
+    else:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        asyncio.run(post(args.url, args.updates, args.concurrency, args.users, args.secret))
+
+if __name__ == "__main__":
+    main()